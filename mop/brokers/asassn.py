@@ -1,6 +1,6 @@
 from astropy.coordinates import ICRS
 from astropy.coordinates import SkyCoord
-from astropy.time import Time, TimezoneInfo
+from astropy.time import TimezoneInfo
 import astropy.units as u
 from bs4 import BeautifulSoup
 import datetime
@@ -13,7 +13,7 @@ from urllib.error import HTTPError
 
 from tom_dataproducts.models import ReducedDatum
 from tom_targets.models import Target
-from mop.toolbox import TAP, utilities
+from mop.toolbox import TAP, utilities, fit_queue
 
 BROKER_URL = 'http://www.astronomy.ohio-state.edu/asassn/transients.html'
 photometry = 'https://asas-sn.osu.edu/photometry'
@@ -231,22 +231,27 @@ class ASASSNBroker():
                     running == False
                     break
                 i = i + 1
+            index = indices_with_photometry_data[k]
+            target = targets[index]
+
+            # The timestamps of the existing photometry and of all new datapoints are converted together,
+            # and the datapoints ingested are added to the existing timestamps as they are stored
+            try:
+                times = set(utilities.datetimes_to_jd(
+                    [i.timestamp for i in ReducedDatum.objects.filter(target=target) if i.data_type == 'photometry']
+                ).tolist())
+            except:
+                times = set()
+            jds = [float(time_to_float) for time_to_float in hjd]
+            timestamps = utilities.jd_to_datetimes(jds, timezone=TimezoneInfo())
+
             n = 0
             while(n < len(hjd)):
                 data = {'magnitude': mag[n], 'filter': myfilter[n],
                     'error': mag_error[n]}
-                time_to_float = float(hjd[n])
-                jd = Time(time_to_float, format='jd').jd
-                jd = Time(jd, format='jd', scale='utc')
-                index = indices_with_photometry_data[k]
-                target = targets[index]
-                try:
-                    times = [Time(i.timestamp).jd for i in ReducedDatum.objects.filter(target=target) if i.data_type == 'photometry']
-                except: 
-                    times = []
-                if  (jd.value not in times):  
+                if  (jds[n] not in times):
                                 rd, _ = ReducedDatum.objects.get_or_create(
-                                        timestamp=jd.to_datetime(timezone=TimezoneInfo()),
+                                        timestamp=timestamps[n],
                                         value=data,
                                         source_name='ASAS-SN',
                                         source_location='ASAS-SN',
@@ -254,10 +259,15 @@ class ASASSNBroker():
                                         target=target)
                                 rd.save()
                                 rd_list.append(rd)
+                                times.add(jds[n])
                 else:
                     pass
                 
 
                 n = n + 1  # repeats for all of the data points on the link for a specific target
             k = k + 1  # repeats for all targets 
+
+        for target in set([rd.target for rd in rd_list]):
+            fit_queue.enqueue_fit(target, reason='New ASAS-SN photometry')
+
         return rd_list
@@ -14,7 +14,7 @@ import numpy as np
 from astropy.time import Time, TimezoneInfo
 import datetime
 from mop.toolbox import logs
-from mop.toolbox import TAP, utilities, classifier_tools
+from mop.toolbox import TAP, utilities, classifier_tools, fit_queue
 
 BROKER_URL = 'https://www.massey.ac.nz/~iabond/moa/'
 photometry = "https://www.massey.ac.nz/~iabond/moa/alert2019/fetchtxt.php?path=moa/ephot/"
@@ -90,7 +90,9 @@ class MOABroker(GenericBroker):
         for target in targets:
 
             datasets = ReducedDatum.objects.filter(target=target)
-            existing_time = [Time(i.timestamp).jd for i in datasets if i.data_type == 'photometry']
+            existing_time = set(utilities.datetimes_to_jd(
+                [i.timestamp for i in datasets if i.data_type == 'photometry']
+            ).tolist())
 
             year = target.name.split('-')[1]
             event = self.event_dictionnary[target.name][0]
@@ -125,16 +127,17 @@ class MOABroker(GenericBroker):
 
             photometry = np.c_[jd,mags,emags]
 
+            # The timestamps of all datapoints are converted together
+            timestamps = utilities.jd_to_datetimes(photometry[:,0], timezone=TimezoneInfo())
+
             for index,point in enumerate(photometry):
                 try:
-                    jd = Time(point[0], format='jd', scale='utc')
-                    jd.to_datetime(timezone=TimezoneInfo())
                     data = {   'magnitude': point[1],
                            'filter': 'R',
                            'error': point[2]
                        }
                     rd, created = ReducedDatum.objects.get_or_create(
-                    timestamp=jd.to_datetime(timezone=TimezoneInfo()),
+                    timestamp=timestamps[index],
                     value=data,
                     source_name='MOA',
                     source_location=target.name,
@@ -156,6 +159,9 @@ class MOABroker(GenericBroker):
             extras = {'Latest_data_HJD': t_last_jd, 'Latest_data_UTC': t_last_date}
             target.save(extras=extras)
 
+            if len(photometry) > 0:
+                fit_queue.enqueue_fit(target, reason='New MOA photometry')
+
             print(target.name,'Ingest done!')
     def to_generic_alert(self, alert):
         pass
@@ -15,7 +15,7 @@ import numpy as np
 import requests
 from astropy.time import Time, TimezoneInfo
 import logging
-from mop.toolbox import TAP, utilities, classifier_tools
+from mop.toolbox import TAP, utilities, classifier_tools, fit_queue
 
 logger = logging.getLogger(__name__)
 
@@ -166,16 +166,19 @@ class OGLEBroker(GenericBroker):
     def ingest_ogle_photometry(self, target, photometry):
         """Method to store the photometry datapoints in the TOM as ReducedDatums"""
 
+        # The timestamps of all datapoints are converted together
+        timestamps = utilities.jd_to_datetimes([photometry[i][0] for i in range(0,len(photometry),1)],
+                                               timezone=TimezoneInfo())
+
+        ncreated = 0
         for i in range(0,len(photometry),1):
-            jd = Time(photometry[i][0], format='jd', scale='utc')
-            jd.to_datetime(timezone=TimezoneInfo())
             datum = {'magnitude': photometry[i][1],
                     'filter': 'OGLE_I',
                     'error': photometry[i][2]
                     }
             try:
                 rd, created = ReducedDatum.objects.get_or_create(
-                    timestamp=jd.to_datetime(timezone=TimezoneInfo()),
+                    timestamp=timestamps[i],
                     value=datum,
                     source_name='OGLE',
                     source_location=target.name,
@@ -184,6 +187,7 @@ class OGLEBroker(GenericBroker):
 
                 if created:
                     rd.save()
+                    ncreated += 1
 
             except MultipleObjectsReturned:
                 logger.error('OGLE HARVESTER: Found duplicated data for event '+target.name)
@@ -192,6 +196,9 @@ class OGLEBroker(GenericBroker):
         extras = {'Latest_data_HJD': t_last_jd, 'Latest_data_UTC': t_last_date}
         target.save(extras=extras)
 
+        if ncreated > 0:
+            fit_queue.enqueue_fit(target, reason='New OGLE photometry')
+
         return 'OK'
 
     def sort_target_list(self, list_of_targets):
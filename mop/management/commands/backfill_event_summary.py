@@ -0,0 +1,84 @@
+from django.core.management.base import BaseCommand
+from django.db.models import Max
+from django.utils import timezone
+from tom_targets.models import Target, TargetExtra
+from tom_dataproducts.models import ReducedDatum
+from mop.models import EventSummary
+from mop.toolbox import querytools, utilities
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+def backfill_event_summaries(chunk_size=1000, apps=None):
+    """
+    Function to rebuild the EventSummary of every Target from its TargetExtras and photometry.
+    Targets are processed in chunks, with one query per table and a single bulk write for each chunk.
+
+    Parameters:
+        chunk_size  int     Number of Targets summarised together
+        apps        Apps    Optional registry of the historical models to use, when run from a migration
+
+    Returns:
+        nsummaries  int     Number of EventSummaries written
+    """
+
+    # The values of the TargetExtras are always converted by the current EventSummary class
+    if apps:
+        (target_model, extra_model, datum_model, summary_model) = (
+            apps.get_model('tom_targets', 'Target'), apps.get_model('tom_targets', 'TargetExtra'),
+            apps.get_model('tom_dataproducts', 'ReducedDatum'), apps.get_model('mop', 'EventSummary'))
+    else:
+        (target_model, extra_model, datum_model, summary_model) = (Target, TargetExtra, ReducedDatum, EventSummary)
+
+    update_fields = list(EventSummary.EXTRA_FIELDS.values()) + ['last_obs_jd', 'modified']
+
+    target_ids = list(target_model.objects.order_by('pk').values_list('pk', flat=True))
+    nsummaries = 0
+    for i in range(0, len(target_ids), chunk_size):
+        chunk = target_ids[i:i + chunk_size]
+
+        extras = querytools.group_by_target(
+            extra_model.objects.filter(target_id__in=chunk,
+                                       key__in=list(EventSummary.EXTRA_FIELDS.keys())).order_by('target_id')
+        )
+        last_observations = {
+            row['target_id']: row['last_timestamp'] for row in
+            datum_model.objects.filter(target_id__in=chunk, data_type='photometry')
+                .values('target_id').annotate(last_timestamp=Max('timestamp'))
+        }
+        last_obs_jd = dict(zip(last_observations.keys(),
+                               utilities.datetimes_to_jd(last_observations.values()).tolist()))
+
+        now = timezone.now()
+        summaries = []
+        for target_id in chunk:
+            fields = {field: EventSummary.summary_value(key, None) for key, field in EventSummary.EXTRA_FIELDS.items()}
+            for par in extras.get(target_id, []):
+                fields[EventSummary.EXTRA_FIELDS[par.key]] = EventSummary.summary_value(par.key, par.value)
+            summaries.append(summary_model(target_id=target_id, last_obs_jd=last_obs_jd.get(target_id),
+                                           modified=now, **fields))
+
+        summary_model.objects.bulk_create(summaries, update_conflicts=True, unique_fields=['target'],
+                                          update_fields=update_fields)
+        nsummaries += len(summaries)
+        logger.info('EVENT SUMMARY: Summarised ' + str(nsummaries) + ' out of ' + str(len(target_ids)) + ' Targets')
+        utilities.checkpoint()
+
+    return nsummaries
+
+class Command(BaseCommand):
+
+    help = 'Rebuild the summary of the state of every Target used to select events, from its TargetExtras'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--chunk-size', help='Number of Targets summarised together', default=1000, type=int)
+
+    def handle(self, *args, **options):
+
+        t1 = datetime.datetime.utcnow()
+
+        nsummaries = backfill_event_summaries(chunk_size=options['chunk_size'])
+
+        t2 = datetime.datetime.utcnow()
+        logger.info('EVENT SUMMARY: Rebuilt ' + str(nsummaries) + ' event summaries in ' + str(t2 - t1))
@@ -0,0 +1,51 @@
+from django.core.management.base import BaseCommand
+from mop.toolbox import fit_benchmark
+import logging
+
+logger = logging.getLogger(__name__)
+
+class Command(BaseCommand):
+
+    help = 'Benchmark the PSPL fitting pipeline on synthetic microlensing events, and write a JSON report'
+
+    def add_arguments(self, parser):
+        parser.add_argument('output', help='Path to the JSON report to write')
+        parser.add_argument('--cases', help='Names of the benchmark cases to run, default all', nargs='+',
+                            choices=[case['name'] for case in fit_benchmark.BENCHMARK_CASES], default=None)
+        parser.add_argument('--repeats', help='Number of realisations of each case to fit', default=3, type=int)
+        parser.add_argument('--seed', help='Seed of the random number generator', default=0, type=int)
+        parser.add_argument('--linear-fluxes', help='Solve for the fluxes of each dataset analytically during the fit',
+                            action='store_true')
+        parser.add_argument('--bin-baseline', help='Bin the photometry outside the magnified part of the '
+                            'lightcurve into bins of this width [days] before fitting', default=None, type=float)
+        parser.add_argument('--speculative-noblend', help='Fit the model without blending in parallel with the '
+                            'blended model', action='store_true')
+        parser.add_argument('--compare', help='Path to an earlier report to compare with', default=None)
+
+    def handle(self, *args, **options):
+
+        fit_options = {}
+        if options['linear_fluxes']:
+            fit_options['linear_fluxes'] = True
+        if options['bin_baseline']:
+            fit_options['baseline_bin_size'] = options['bin_baseline']
+        if options['speculative_noblend']:
+            fit_options['speculative_noblend'] = True
+
+        report = fit_benchmark.run_benchmark(case_names=options['cases'], seed=options['seed'],
+                                             repeats=options['repeats'], fit_options=fit_options)
+        fit_benchmark.write_report(report, options['output'])
+
+        for case in report['cases']:
+            summary = case['summary']
+            self.stdout.write(case['name'] + ': wall time ' + '{:.3f}'.format(summary['wall_time'] or 0.0)
+                              + 's, nfev ' + str(summary['nfev'])
+                              + ', success rate ' + '{:.2f}'.format(summary['success_rate'])
+                              + ', |tE offset| ' + str(summary['abs_sigma']['tE']) + ' sigma')
+
+        if options['compare']:
+            baseline = fit_benchmark.read_report(options['compare'])
+            for entry in fit_benchmark.compare_reports(baseline, report):
+                self.stdout.write(entry['name'] + ': wall time ratio ' + str(entry['wall_time_ratio'])
+                                  + ', nfev ratio ' + str(entry['nfev_ratio'])
+                                  + ', success rate change ' + str(entry['success_rate_change']))
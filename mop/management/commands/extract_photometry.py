@@ -1,7 +1,6 @@
 from django.core.management.base import BaseCommand
 from tom_targets.models import Target
-from mop.toolbox import obs_control
-from astropy.time import Time
+from mop.toolbox import obs_control, utilities
 import datetime
 from tom_dataproducts.models import ReducedDatum
 
@@ -20,7 +19,7 @@ class Command(BaseCommand):
         target, created = Target.objects.get_or_create(name= options['target_name'])
         datasets = ReducedDatum.objects.filter(target=target)
 
-        time = [Time(i.timestamp).jd for i in datasets if i.data_type == 'photometry']
+        time = utilities.datetimes_to_jd([i.timestamp for i in datasets if i.data_type == 'photometry'])
         names = [i.source_name for i in datasets if i.data_type == 'photometry']
         phot = [[i.value['magnitude'],i.value['error'],i.value['filter']] for i in datasets if i.data_type == 'photometry']
 
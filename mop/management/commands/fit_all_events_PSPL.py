@@ -6,8 +6,8 @@ from astropy.time import Time
 from mop.brokers import gaia as gaia_mop
 import random
 import datetime
-from mop.management.commands.fit_need_events_PSPL import run_fit
-import os
+from mop.management.commands.fit_need_events_PSPL import run_fit, run_batch_fits
+from mop.toolbox import querytools
 
 import logging
 
@@ -22,12 +22,23 @@ class Command(BaseCommand):
     def add_arguments(self, parser):
 
         parser.add_argument('events_to_fit', help='all, alive, need or [years]')
-        parser.add_argument('--cores', help='Number of workers to use', default=os.cpu_count(), type=int)
+        parser.add_argument('--cores', help='Deprecated and ignored, since each fit runs in a single process',
+                            default=None, type=int)
+        parser.add_argument('--batch', help='Fit the events simultaneously with the batched fitting engine',
+                            action='store_true')
+        parser.add_argument('--batch-size', help='Maximum number of events to fit simultaneously',
+                            default=500, type=int)
+        parser.add_argument('--no-cache', help='Re-fit events even if an identical fit has been cached',
+                            action='store_true')
+        parser.add_argument('--bin-baseline', help='Bin the photometry outside the magnified part of each '
+                            'lightcurve into bins of this width [days] before fitting', default=None, type=float)
 
 
     def handle(self, *args, **options):
 
         logger.info('Running fit_all_events')
+        if options['cores'] is not None:
+            logger.warning('The --cores option of fit_all_events_PSPL is deprecated and ignored')
 
         # Avoid (unlikely but possible) clashing processes hitting the DB at the same time
         with transaction.atomic():
@@ -80,10 +91,8 @@ class Command(BaseCommand):
 
             logger.info('Found '+str(len(list_of_targets))+' targets to fit')
 
+            microlensing_targets = []
             for target in list_of_targets:
-                # if the previous job has not been started by another worker yet, claim it
-
-                logger.info('Fitting data for '+target.name)
                 try:
                     if 'Gaia' in target.name:
                         gaia_mop.update_gaia_errors(target)
@@ -97,7 +106,25 @@ class Command(BaseCommand):
                         logger.info(target.name+' not classified as microlensing')
 
                     else:
-                        result = run_fit(target, cores=options['cores'])
+                        microlensing_targets.append(target)
 
                 except:
                     logger.warning('Fitting event '+target.name+' hit an exception')
+
+            # Retrieve the data for all events to be fitted
+            target_data = querytools.fetch_data_for_targetset(microlensing_targets, check_need_to_fit=False)
+
+            if options['batch']:
+                run_batch_fits(target_data, batch_size=options['batch_size'], use_cache=not options['no_cache'])
+
+            else:
+                for target, mulens in target_data.items():
+                    # if the previous job has not been started by another worker yet, claim it
+
+                    logger.info('Fitting data for '+target.name)
+                    try:
+                        result = run_fit(mulens, use_cache=not options['no_cache'],
+                                         baseline_bin_size=options['bin_baseline'])
+
+                    except:
+                        logger.warning('Fitting event '+target.name+' hit an exception')
@@ -8,7 +8,6 @@ from mop.brokers import gaia as gaia_mop
 import json
 import numpy as np
 import datetime
-import os
 import logging
 from mop.management.commands.fit_need_events_PSPL import run_fit
 from django.db import connection
@@ -21,13 +20,24 @@ class Command(BaseCommand):
 
     def add_arguments(self, parser):
         parser.add_argument('target_name', help='name of the event to fit')
-        parser.add_argument('--cores', help='Number of workers to use', default=os.cpu_count(), type=int)
+        parser.add_argument('--cores', help='Deprecated and ignored, since each fit runs in a single process',
+                            default=None, type=int)
         parser.add_argument('--stout', help='Direction for standard output',)
+        parser.add_argument('--linear-fluxes', help='Solve for the fluxes of each dataset analytically during the fit',
+                            action='store_true')
+        parser.add_argument('--no-cache', help='Re-fit the event even if an identical fit has been cached',
+                            action='store_true')
+        parser.add_argument('--bin-baseline', help='Bin the photometry outside the magnified part of the '
+                            'lightcurve into bins of this width [days] before fitting', default=None, type=float)
+        parser.add_argument('--speculative-noblend', help='Fit the model without blending in parallel with the '
+                            'blended model, to reduce the time taken on a second core', action='store_true')
 
 
     def handle(self, *args, **options):
 
         tstart = datetime.datetime.utcnow()
+        if options['cores'] is not None:
+            logger.warning('The --cores option of fit_event_PSPL is deprecated and ignored')
         t, created = Target.objects.get_or_create(name= options['target_name'])
         logger.info('Fitting single event: '+t.name)
 
@@ -35,11 +45,15 @@ class Command(BaseCommand):
             mulens = MicrolensingEvent(t)
             mulens.set_extra_params(TargetExtra.objects.filter(target=t))
             mulens.set_reduced_data(
-                ReducedDatum.objects.filter(target=t).order_by("timestamp")
+                ReducedDatum.objects.filter(target=t, data_type='photometry').order_by("timestamp")
             )
 
-            if len(mulens.red_data) > 0:
-                result = run_fit(mulens, cores=options['cores'], verbose=True)
+            if mulens.ndata > 0:
+                result = run_fit(mulens, verbose=True,
+                                 linear_fluxes=options['linear_fluxes'],
+                                 use_cache=not options['no_cache'],
+                                 baseline_bin_size=options['bin_baseline'],
+                                 speculative_noblend=options['speculative_noblend'])
 
         except:
             logger.warning('Fitting event '+t.name+' hit an exception')
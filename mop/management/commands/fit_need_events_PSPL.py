@@ -2,9 +2,11 @@ from django.core.management.base import BaseCommand
 from tom_dataproducts.models import ReducedDatum
 from tom_targets.models import Target,TargetExtra
 from django.db import transaction
+from django.conf import settings
 from astropy.time import Time
-from mop.toolbox import fittools, utilities
+from mop.toolbox import fittools, fit_workers, fit_queue, fit_cache, fit_profiling, photometry_cache, querytools, utilities
 from mop.toolbox.mop_classes import MicrolensingEvent
+from mop.models import EventSummary
 import datetime
 import os
 import logging
@@ -13,73 +15,66 @@ logger = logging.getLogger(__name__)
 
 from django.db import connection
 
-def run_fit(mulens, cores=0, verbose=False):
+def run_fit(mulens, verbose=False, warm_start=False, linear_fluxes=False, use_cache=True,
+            baseline_bin_size=None, speculative_noblend=False):
     """
-    Function to perform a microlensing model fit to timeseries photometry.
+    Function to perform a microlensing model fit to timeseries photometry.  If the same photometry
+    has previously been fitted with the same configuration, the cached result of that fit is used.
+    The time taken by each stage of the fit is recorded in the event's fit_profile.
 
     Parameters:
-        target   Target object
-        red_data QuerySet of ReducedDatums for the target
-        cores integer, optional number of processing cores to use
+        mulens MicrolensingEvent with its photometry loaded
+        warm_start boolean, optional switch to seed the fit from the previously stored model
+        linear_fluxes boolean, optional switch to solve for the fluxes analytically during the fit
+        use_cache boolean, optional switch to re-use the cached result of an identical fit
+        baseline_bin_size float, optional width of the bins [days] for the baseline photometry
+        speculative_noblend boolean, optional switch to fit the no-blend model in parallel with the blended model
     """
 
     logger.info('Fitting event: '+mulens.name)
 
-    t5 = datetime.datetime.utcnow()
-    if verbose: utilities.checkpoint()
-
     try:
-        t6 = datetime.datetime.utcnow()
-        if verbose: utilities.checkpoint()
-        if verbose: logger.info('Time taken chk 2: ' + str(t6 - t5))
-
         # Retrieve all available ReducedDatum entries for this target.  Note that this may include data
         # other than lightcurve photometry, so the data are then filtered and repackaged for later
         # convenience
         logger.info('FIT: Found '+str(len(mulens.datasets))+' datasets and a total of '
                     +str(mulens.ndata)+' datapoints to model for event '+mulens.name)
 
-        t7 = datetime.datetime.utcnow()
-        if verbose: utilities.checkpoint()
-        if verbose: logger.info('Time taken chk 3: ' + str(t7 - t6))
-
         if mulens.ndata > 10:
-            (model_params, model_telescope) = fittools.fit_pspl_omega2(
-                mulens.target.ra, mulens.target.dec, mulens.datasets)
-            logger.info('FIT: completed modeling process for '+mulens.name)
-
-            t8 = datetime.datetime.utcnow()
-            if verbose: utilities.checkpoint()
-            if verbose: logger.info('Time taken chk 4: ' + str(t8 - t7))
-
-            # Store model lightcurve
-            if model_telescope:
-                mulens.store_model_lightcurve(model_telescope)
-                logger.info('FIT: Stored model lightcurve for event '+mulens.name)
+            if warm_start:
+                warm_start_params = mulens.get_warm_start_parameters()
             else:
-                logger.warning('FIT: No valid model fit produced so not model lightcurve for event '+mulens.name)
-
-            t9 = datetime.datetime.utcnow()
-            if verbose: utilities.checkpoint()
-            if verbose: logger.info('Time taken chk 5: ' + str(t9 - t8))
-
-            # Determine whether or not an event is still active based on the
-            # current time relative to its t0 and tE
-            alive = fittools.check_event_alive(model_params['t0'], model_params['tE'], mulens.last_observation)
+                warm_start_params = None
+            cache_key = fit_cache.fit_cache_key(mulens.datasets, fitter=cache_fitter(linear_fluxes),
+                                                baseline_bin_size=baseline_bin_size, warm_start=warm_start_params)
+            cached_fit = fit_cache.lookup_fit(cache_key) if use_cache else None
 
-            t10 = datetime.datetime.utcnow()
-            if verbose: utilities.checkpoint()
-            if verbose: logger.info('Time taken chk 6: ' + str(t10 - t9))
+            cached = cached_fit is not None
+            if cached:
+                (model_params, model_lightcurve) = cached_fit
+                logger.info('FIT: using cached model fit for ' + mulens.name)
+                cache_key = None
 
-            # Store model parameters
-            model_params['Last_fit'] = Time(datetime.datetime.utcnow()).jd
-            model_params['Alive'] = alive
-            mulens.store_model_parameters(model_params)
-            logger.info('FIT: Stored model parameters for event ' + mulens.name)
+            else:
+                with fit_profiling.active_profile(mulens.fit_profile):
+                    (model_params, model_telescope) = fittools.fit_pspl_omega2(
+                        mulens.target.ra, mulens.target.dec, mulens.get_clean_datasets(),
+                        warm_start=warm_start_params, linear_fluxes=linear_fluxes,
+                        baseline_bin_size=baseline_bin_size, speculative_noblend=speculative_noblend)
+                logger.info('FIT: completed modeling process for '+mulens.name)
+
+                model_lightcurve = None
+                if model_telescope:
+                    model_lightcurve = (model_telescope.lightcurve_magnitude['time'].value,
+                                        model_telescope.lightcurve_magnitude['mag'].value)
+
+            # Store model lightcurve and parameters, committing the results for this event together
+            result = {'name': mulens.name, 'model_params': model_params, 'model_lightcurve': model_lightcurve,
+                      'cached': cached}
+            if not store_fit_result(mulens, result, cache_key=cache_key):
+                return False
 
-            t11 = datetime.datetime.utcnow()
-            if verbose: utilities.checkpoint()
-            if verbose: logger.info('Time taken chk 6: ' + str(t11 - t10))
+            return True
 
         else:
             logger.info('Insufficient lightcurve data available to model event '+mulens.name)
@@ -96,135 +91,482 @@ def run_fit(mulens, cores=0, verbose=False):
         logger.error('Job failed: '+mulens.name)
         return False
 
+def cache_fitter(linear_fluxes=False):
+    """Function to return the name of the fitting engine used, for the fit cache"""
+
+    if linear_fluxes:
+        return fit_cache.FITTER_LINEAR_FLUXES
+    return fit_cache.FITTER_TRF
+
+def store_model_parameters(mulens, model_params):
+    """
+    Function to store the parameters of a completed model fit, after determining whether or not
+    the event is still active based on the current time relative to its t0 and tE.
+
+    Parameters:
+        mulens          MicrolensingEvent   Event that has been modeled
+        model_params    dict                Fitted model parameters, as returned by fit_pspl_omega2
+    """
+
+    alive = fittools.check_event_alive(model_params['t0'], model_params['tE'], mulens.last_observation)
+
+    model_params['Last_fit'] = Time(datetime.datetime.utcnow()).jd
+    model_params['Alive'] = alive
+
+    # Record the fingerprint of the data that were fitted, so that the event is not re-fitted
+    # until its photometry changes
+    model_params['Fit_fingerprint'] = mulens.photometry_fingerprint()
+    mulens.store_model_parameters(model_params)
+
+    # The time of the last datapoint fitted is held only in the event's summary
+    EventSummary.update_fields(mulens.target.pk, {'last_obs_jd': mulens.last_observation})
+    logger.info('FIT: Stored model parameters for event ' + mulens.name)
+
+def run_parallel_fits(target_data, cores, warm_start=False, linear_fluxes=False, callback=None,
+                      time_budget=None, max_nfev=None, use_cache=True, baseline_bin_size=None,
+                      speculative_noblend=False):
+    """
+    Function to fit a set of events using a pool of worker processes.  The data for each event are
+    passed to the workers as numpy arrays, and the results of each fit are stored in the database
+    by this (parent) process as the fits complete.  Fits that exceed their time or evaluation
+    budget are abandoned, so that they do not hold up the remaining events.
+
+    Parameters:
+        target_data dict    MicrolensingEvents with reduced data loaded, indexed by Target
+        cores       int     Number of worker processes to use.  With speculative_noblend, each fit uses
+                            two processes, so only half this number of events are fitted at once
+        warm_start  bool    Switch to seed the fits from the previously stored models
+        linear_fluxes bool  Switch to solve for the fluxes analytically during the fits
+        callback    func    Optional function called with each MicrolensingEvent, whether its fit
+                            was successfully stored and the fit status, as each fit completes
+        time_budget float   Optional maximum wall-clock time allowed for each fit [s]
+        max_nfev    int     Optional maximum number of objective function evaluations for each fit
+        use_cache   bool    Switch to re-use the cached results of identical fits
+        baseline_bin_size float Optional width of the bins [days] for the baseline photometry
+        speculative_noblend bool Switch to fit the model without blending in parallel with the blended model,
+                            using a second process for each fit
+    """
+
+    events = {}
+    cache_keys = {}
+    jobs = []
+    for t, mulens in target_data.items():
+        if mulens.ndata > 10:
+            cache_key = fit_cache.fit_cache_key(
+                mulens.datasets, fitter=cache_fitter(linear_fluxes), baseline_bin_size=baseline_bin_size,
+                warm_start=mulens.get_warm_start_parameters() if warm_start else None, max_nfev=max_nfev
+            )
+            cached_fit = fit_cache.lookup_fit(cache_key) if use_cache else None
+            if cached_fit:
+                success = store_fit_result(mulens, {'name': mulens.name, 'model_params': cached_fit[0],
+                                                    'model_lightcurve': cached_fit[1], 'cached': True})
+                if callback:
+                    callback(mulens, success, fit_workers.FIT_OK)
+                continue
+
+            events[mulens.name] = mulens
+            cache_keys[mulens.name] = cache_key
+            jobs.append(fit_workers.build_fit_job(mulens, warm_start=warm_start, linear_fluxes=linear_fluxes,
+                                                  max_nfev=max_nfev, baseline_bin_size=baseline_bin_size,
+                                                  speculative_noblend=speculative_noblend))
+
+        # Events with insufficient data are not fitted, but still need their Alive
+        # status reviewed
+        else:
+            success = run_fit(mulens)
+            if callback:
+                callback(mulens, success is not False, fit_workers.FIT_OK)
+
+    # Each speculative fit runs in a second process alongside its worker, so the number of workers is
+    # halved to keep the total number of processes within the cores available
+    if speculative_noblend:
+        cores = max(cores // 2, 1)
+
+    for i, result in enumerate(fit_workers.run_parallel_fits(jobs, cores, time_budget=time_budget)):
+        mulens = events[result['name']]
+        logger.info('FIT_NEED_EVENTS: Completed modeling of ' + mulens.name + ' in '
+                    + str(result['fit_time']) + ' with status ' + result.get('fit_status', '') + ', '
+                    + str(i) + ' out of ' + str(len(jobs)))
+
+        success = store_fit_result(mulens, result, cache_key=cache_keys[mulens.name])
+        if callback:
+            callback(mulens, success, result.get('fit_status', fit_workers.FIT_FAILED))
+
+def run_batch_fits(target_data, batch_size=500, use_cache=True):
+    """
+    Function to fit a set of events simultaneously, using the batched fitting engine in fittools,
+    and store the results in the database.
+
+    Parameters:
+        target_data dict    MicrolensingEvents with reduced data loaded, indexed by Target
+        batch_size  int     Maximum number of events to fit simultaneously
+        use_cache   bool    Switch to re-use the cached results of identical fits
+    """
+
+    events = {}
+    cache_keys = {}
+    jobs = []
+    for t, mulens in target_data.items():
+        if mulens.ndata > 10:
+            cache_key = fit_cache.fit_cache_key(mulens.datasets, fitter=fit_cache.FITTER_BATCH)
+            cached_fit = fit_cache.lookup_fit(cache_key) if use_cache else None
+            if cached_fit:
+                store_fit_result(mulens, {'name': mulens.name, 'model_params': cached_fit[0],
+                                          'model_lightcurve': cached_fit[1], 'cached': True})
+                continue
+
+            events[mulens.name] = mulens
+            cache_keys[mulens.name] = cache_key
+            jobs.append(fit_workers.build_fit_job(mulens))
+        else:
+            run_fit(mulens)
+
+    logger.info('FIT: Batch fitting ' + str(len(jobs)) + ' events')
+    t1 = datetime.datetime.utcnow()
+    results = fittools.fit_pspl_batch(jobs, batch_size=batch_size, verbose=True)
+    logger.info('FIT: Completed batch modeling of ' + str(len(jobs)) + ' events in '
+                + str(datetime.datetime.utcnow() - t1))
+
+    for result in results:
+        store_fit_result(events[result['name']], result, cache_key=cache_keys[result['name']])
+
+def store_fit_result(mulens, result, cache_key=None):
+    """
+    Function to store the model lightcurve and parameters of an event, from the result of a fit
+    returned by fit_workers.fit_worker or fittools.fit_pspl_batch, and record the profile of the fit
+
+    Parameters:
+        mulens      MicrolensingEvent   Event that has been modeled
+        result      dict                Result of the model fit
+        cache_key   str                 Optional key under which to add the result to the fit cache
+
+    Returns:
+        status  bool                True if the results were stored successfully
+    """
+
+    # Stage timings measured by a worker process are added to those of this process
+    mulens.fit_profile.update(result.get('timings', {}))
+
+    if result['model_params'] is None:
+        logger.error('Job failed: ' + mulens.name)
+        record_fit_profile(mulens, result.get('fit_status', fit_workers.FIT_FAILED))
+        return False
+
+    # The results for each event are committed together, as soon as they are available
+    try:
+        with mulens.fit_profile.stage('db_write'), transaction.atomic():
+            if result['model_lightcurve']:
+                mulens.store_model_lightcurve_arrays(*result['model_lightcurve'])
+                logger.info('FIT: Stored model lightcurve for event ' + mulens.name)
+            else:
+                logger.warning('FIT: No valid model fit produced so not model lightcurve for event ' + mulens.name)
+
+            # The result is cached before the parameters are stored, since storing them adds the
+            # Alive status and time of the fit, which are not properties of the fit itself
+            if cache_key:
+                fit_cache.store_fit(cache_key, mulens.target, result['model_params'], result['model_lightcurve'])
+
+            store_model_parameters(mulens, result['model_params'])
+
+    except:
+        logger.error('Failed to store fit results for ' + mulens.name)
+        record_fit_profile(mulens, fit_workers.FIT_FAILED)
+        return False
+
+    record_fit_profile(mulens, fit_workers.FIT_OK, cached=result.get('cached', False))
+
+    return True
+
+def record_fit_profile(mulens, fit_status, cached=False):
+    """
+    Function to record the profile of an event's model fit in the database, then start a new profile
+    for its next fit.  Failure to record the profile does not affect the fit.
+
+    Parameters:
+        mulens      MicrolensingEvent   Event that has been modeled
+        fit_status  str                 Outcome of the fit
+        cached      bool                True if the result was taken from the fit cache
+    """
+
+    logger.info('FIT: Profile of the fit of ' + mulens.name + ': ' + mulens.fit_profile.summary())
+
+    try:
+        fit_profiling.store_fit_timing(mulens.target, mulens.fit_profile, fit_status=fit_status,
+                                       cached=cached, ndata=mulens.ndata)
+    except Exception as e:
+        logger.warning('FIT: Failed to record the profile of the fit of ' + mulens.name + ': ' + repr(e))
+
+    mulens.fit_profile = fit_profiling.FitProfile()
+
+def sweep_need_to_fit(run_every=4):
+    """
+    Function to identify those alive microlensing events whose models need to be updated,
+    and add them to the fit queue.  Events that do not need to be re-fitted have their Alive
+    status reviewed instead.  No rows are locked during the sweep, so that it does not block
+    the web UI or the harvesters.
+
+    Parameters:
+        run_every   int     Events last modeled more than this many hours ago are reviewed
+
+    Returns:
+        queued      list    Targets added to the fit queue
+    """
+
+    t1 = datetime.datetime.utcnow()
+
+    # Cutoff date: N hours ago (from the "--run-every=N" hours command line argument)
+    cutoff = Time(datetime.datetime.utcnow() - datetime.timedelta(hours=run_every)).jd
+
+    # Find alive microlensing targets for which the fits need to be updated, selecting
+    # them from their event summaries in a single query.
+    # The requirement for recent data is taken care of at a later stage of selection.
+    target_list = list(Target.objects.filter(
+        querytools.alive_microlensing(),
+        event_summary__last_fit_jd__lte=cutoff
+    ))
+
+    logger.info('FIT_NEED_EVENTS: Initial target list has ' + str(len(target_list)) + ' entries')
+
+    utilities.checkpoint()
+
+    target_extras = querytools.group_by_target(
+        TargetExtra.objects.filter(target__in=target_list).order_by('target_id')
+    )
+    (datums, photometry, generations) = querytools.fetch_reduced_data(target_list)
+
+    t2 = datetime.datetime.utcnow()
+    logger.info('FIT_NEED_EVENTS: Retrieved associated data for ' + str(len(target_list)) + ' Targets')
+    utilities.checkpoint()
+    logger.info('FIT_NEED_EVENTS: Time taken chk 2: ' + str(t2 - t1))
+
+    logger.info('FIT_NEED_EVENTS: Reviewing target list to identify those that need remodeling')
+    queued = []
+    uncached = {}
+    for i,t in enumerate(target_list):
+
+        # Catch for events where the RA, Dec is not set - source of this error unknown
+        try:
+            mulens = MicrolensingEvent(t)
+            if type(mulens.ra) == float:
+                mulens.set_extra_params(target_extras.get(t.pk, []))
+                mulens.set_reduced_data(datums.get(t.pk, []), photometry=photometry.get(t.pk))
+                if t.pk not in photometry:
+                    uncached[t] = photometry_cache.pack_photometry(mulens.datasets, mulens.first_observation,
+                                                                   mulens.last_observation,
+                                                                   generation=generations.get(t.pk))
+                (status, reason) = mulens.check_need_to_fit()
+                logger.info('FIT_NEED_EVENTS: Need to fit ' + t.name
+                            + ': ' + repr(status) + ', reason: ' + reason)
+
+                # If the event is to be fitted, the fit worker will take care of evaluating whether or
+                # not the event is still alive, based on the new model.
+                # If the event is not to be fitted for any reason, we need to check whether or not
+                # it is still alive.
+                if mulens.need_to_fit:
+                    fit_queue.enqueue_fit(t, reason='Need to fit sweep: ' + reason)
+                    queued.append(t)
+
+                else:
+                    review_alive_status(mulens)
+
+                logger.info('FIT_NEED_EVENTS: evaluated target ' + t.name + ', '
+                            + str(i) + ' out of ' + str(len(target_list)))
+                utilities.checkpoint()
+
+            else:
+                logger.info('FIT_NEED_EVENTS: Event with invalid RA, Dec, skipping')
+
+        except ValueError:
+            logger.info('FIT_NEED_EVENTS: Could not create an Event object for ' + t.name + ', skipping')
+
+    photometry_cache.store_photometry(uncached)
+
+    t3 = datetime.datetime.utcnow()
+    logger.info('FIT_NEED_EVENTS: Queued ' + str(len(queued)) + ' targets for fitting in ' + str(t3 - t2))
+    utilities.checkpoint()
+
+    return queued
+
+def review_alive_status(mulens):
+    """Function to update the Alive status of an event that is not being re-fitted,
+    based on its existing model"""
+
+    if mulens.t0 and mulens.tE:
+        alive = fittools.check_event_alive(float(mulens.t0),
+                                           float(mulens.tE),
+                                           mulens.last_observation)
+        if alive != bool(mulens.Alive):
+            update_extras = {'Alive': alive}
+            mulens.store_parameter_set(update_extras)
+            logger.info('Updated Alive status to ' + repr(alive))
+
+def process_fit_queue(worker, cores=1, claim_size=10, lease_time=fit_queue.LEASE_TIME, max_jobs=0,
+                      warm_start=False, linear_fluxes=False, time_budget=None, max_nfev=None, use_cache=True,
+                      baseline_bin_size=None, speculative_noblend=False):
+    """
+    Function to fit events from the fit queue until it is empty.  Jobs are claimed in small batches,
+    and the results of each fit are committed as soon as the event is completed, so that several
+    workers can share the queue.
+
+    Parameters:
+        worker          str     Identifier of this worker
+        cores           int     Number of worker processes to use for fitting
+        claim_size      int     Number of jobs to claim at a time
+        lease_time      int     Duration of the lease on each claimed job [s]
+        max_jobs        int     Maximum number of jobs to process, or zero for no limit
+        warm_start      bool    Switch to seed the fits from the previously stored models
+        linear_fluxes   bool    Switch to solve for the fluxes analytically during the fits
+        time_budget     float   Maximum wall-clock time allowed for each fit [s], or None for no limit
+        max_nfev        int     Maximum number of objective function evaluations for each fit, or None
+        use_cache       bool    Switch to re-use the cached results of identical fits
+        baseline_bin_size float Width of the bins [days] for the baseline photometry, or None for no binning
+        speculative_noblend bool Switch to fit the model without blending in parallel with the blended model
+
+    Returns:
+        nprocessed      int     Number of jobs processed
+    """
+
+    nprocessed = 0
+    while max_jobs <= 0 or nprocessed < max_jobs:
+        batch_size = claim_size if max_jobs <= 0 else min(claim_size, max_jobs - nprocessed)
+        jobs = fit_queue.claim_fit_jobs(worker, batch_size=batch_size, lease_time=lease_time)
+        if len(jobs) == 0:
+            break
+
+        process_fit_jobs(jobs, worker, cores=cores, lease_time=lease_time,
+                         warm_start=warm_start, linear_fluxes=linear_fluxes,
+                         time_budget=time_budget, max_nfev=max_nfev, use_cache=use_cache,
+                         baseline_bin_size=baseline_bin_size, speculative_noblend=speculative_noblend)
+        nprocessed += len(jobs)
+        logger.info('FIT_NEED_EVENTS: Worker ' + worker + ' has processed ' + str(nprocessed) + ' jobs')
+        utilities.checkpoint()
+
+    return nprocessed
+
+def process_fit_jobs(jobs, worker, cores=1, lease_time=fit_queue.LEASE_TIME, warm_start=False,
+                     linear_fluxes=False, time_budget=None, max_nfev=None, use_cache=True,
+                     baseline_bin_size=None, speculative_noblend=False):
+    """
+    Function to fit the events of a batch of claimed fit jobs.  Each job is marked as completed
+    as soon as the results of its fit are stored.  Every fit runs in a worker subprocess, so that
+    fits exceeding their time budget can be terminated.  Jobs whose fits fail or exceed their
+    budget are returned to the queue to be retried after a back-off.
+
+    Parameters:
+        jobs            list    FitJobs claimed by this worker
+        worker          str     Identifier of this worker
+        cores           int     Number of worker processes to use for fitting
+        lease_time      int     Duration of the lease on each claimed job [s]
+        warm_start      bool    Switch to seed the fits from the previously stored models
+        linear_fluxes   bool    Switch to solve for the fluxes analytically during the fits
+        time_budget     float   Maximum wall-clock time allowed for each fit [s], or None for no limit
+        max_nfev        int     Maximum number of objective function evaluations for each fit, or None
+        use_cache       bool    Switch to re-use the cached results of identical fits
+        baseline_bin_size float Width of the bins [days] for the baseline photometry, or None for no binning
+        speculative_noblend bool Switch to fit the model without blending in parallel with the blended model
+    """
+
+    pending = {job.target.name: job for job in jobs}
+    errors = {
+        fit_workers.FIT_TIMEOUT: 'Model fit exceeded the time budget of ' + str(time_budget) + 's',
+        fit_workers.FIT_ITERATION_LIMIT: 'Model fit exceeded ' + str(max_nfev) + ' evaluations',
+    }
+
+    def finish(name, success, fit_status=fit_workers.FIT_FAILED):
+        job = pending.pop(name)
+        if success:
+            fit_queue.complete_fit_job(job, worker)
+        else:
+            # A fit that completed but whose results could not be stored is also recorded as failed
+            if fit_status == fit_workers.FIT_OK:
+                fit_status = fit_workers.FIT_FAILED
+            fit_queue.fail_fit_job(job, worker, error=errors.get(fit_status, 'Model fit failed'),
+                                   fit_status=fit_status)
+        fit_queue.heartbeat(pending.values(), worker, lease_time=lease_time)
+
+    target_data = querytools.fetch_data_for_targetset([job.target for job in jobs], check_need_to_fit=False)
+
+    # The queue may contain events that do not need to be fitted, for example if they were queued
+    # by a harvester but no new data were found
+    fit_data = {}
+    for t, mulens in target_data.items():
+        (status, reason) = mulens.check_need_to_fit()
+        if status and mulens.ndata > 10:
+            fit_data[t] = mulens
+        elif status:
+            finish(mulens.name, run_fit(mulens, use_cache=use_cache) is not False)
+        else:
+            logger.info('FIT_NEED_EVENTS: No need to fit ' + mulens.name + ', reason: ' + reason)
+            review_alive_status(mulens)
+            finish(mulens.name, True)
+
+    run_parallel_fits(fit_data, max(cores, 1), warm_start=warm_start, linear_fluxes=linear_fluxes,
+                      callback=lambda mulens, success, fit_status: finish(mulens.name, success, fit_status),
+                      time_budget=time_budget, max_nfev=max_nfev, use_cache=use_cache,
+                      baseline_bin_size=baseline_bin_size, speculative_noblend=speculative_noblend)
+    utilities.checkpoint()
+
+    # Any jobs remaining could not be loaded from the database
+    for name in list(pending.keys()):
+        finish(name, False)
+
 class Command(BaseCommand):
     help = 'Fit events with PSPL and parallax, then ingest fit parameters in the db'
 
     def add_arguments(self, parser):
         parser.add_argument('--cores', help='Number of workers (CPU cores) to use', default=os.cpu_count(), type=int)
         parser.add_argument('--run-every', help='Run each Fit every N hours', default=4, type=int)
+        parser.add_argument('--warm-start', help='Seed each fit from the previously stored model',
+                            action='store_true')
+        parser.add_argument('--linear-fluxes', help='Solve for the fluxes of each dataset analytically during the fits',
+                            action='store_true')
+        parser.add_argument('--worker-only', help='Process the fit queue without sweeping for events that need fitting',
+                            action='store_true')
+        parser.add_argument('--sweep-only', help='Queue the events that need fitting without fitting them',
+                            action='store_true')
+        parser.add_argument('--claim-size', help='Number of fit jobs to claim at a time', default=10, type=int)
+        parser.add_argument('--lease', help='Duration of the lease on claimed fit jobs [s]',
+                            default=fit_queue.LEASE_TIME, type=int)
+        parser.add_argument('--max-jobs', help='Maximum number of fit jobs to process, 0 for no limit',
+                            default=0, type=int)
+        parser.add_argument('--time-budget', help='Maximum wall-clock time allowed for each fit [s], 0 for no limit',
+                            default=getattr(settings, 'FIT_TIME_BUDGET', 600), type=float)
+        parser.add_argument('--max-evaluations', help='Maximum number of objective function evaluations for each fit, '
+                            '0 for no limit', default=getattr(settings, 'FIT_MAX_EVALUATIONS', 5000), type=int)
+        parser.add_argument('--no-cache', help='Re-fit events even if an identical fit has been cached',
+                            action='store_true')
+        parser.add_argument('--bin-baseline', help='Bin the photometry outside the magnified part of each '
+                            'lightcurve into bins of this width [days] before fitting', default=None, type=float)
+        parser.add_argument('--speculative-noblend', help='Fit the model without blending in parallel with the '
+                            'blended model of each event, using a second core for each fit.  Only half of the '
+                            '--cores are then used for workers, so that no more than --cores processes run',
+                            action='store_true')
 
     def handle(self, *args, **options):
 
-        with transaction.atomic():
-
-            t1 = datetime.datetime.utcnow()
-            logger.info('FIT_NEED_EVENTS: Starting checkpoint: ')
-            utilities.checkpoint()
-
-            # Cutoff date: N hours ago (from the "--run-every=N" hours command line argument)
-            cutoff = Time(datetime.datetime.utcnow() - datetime.timedelta(hours=options['run_every'])).jd
-
-            # Find alive microlensing targets for which the fits need to be updated
-            # We really want the intersection of three querysets: those targets that have separate
-            # TargetExtras meeting all criteria.  Using prefetch_related targets here because
-            # it is massively more efficient in time and DB connections, together with select_for_update
-            # to skip any Target being accessed by another process.
-            ts1 = TargetExtra.objects.prefetch_related('target').select_for_update(skip_locked=True).filter(
-                key='Classification', value__icontains='Microlensing'
-                )
-            ts2 = TargetExtra.objects.prefetch_related('target').select_for_update(skip_locked=True).filter(
-                key='Alive', value__icontains=True
-                )
-            ts3 = TargetExtra.objects.prefetch_related('target').select_for_update(skip_locked=True).filter(
-                key='Last_fit', value__lte=cutoff
-            )
-
-            # This is taken care of at a later stage of selection.
-            #ts4 = TargetExtra.objects.prefetch_related('target').select_for_update(skip_locked=True).filter(
-            #    key='Latest_data_HJD', value__gt=cutoff
-            #)
-            logger.info('FIT_NEED_EVENTS: Initial queries selected '
-                        + str(ts1.count()) + ' events classified as microlensing, '
-                        + str(ts2.count()) + ' events currently Alive, '
-                        + str(ts3.count()) + ' events last modeled before ' + repr(cutoff))
-
-            # This doesn't directly produce a queryset of targets, instead it returns a queryset of target IDs.
-            # So we have to extract the corresponding targets:
-            targets1 = [x.target for x in ts1]
-            targets2 = [x.target for x in ts2]
-            targets3 = [x.target for x in ts3]
-            #targets4 = [x.target for x in ts4]
-            target_list = list(set(targets1).intersection(
-                set(targets2)
-            ).intersection(
-                set(targets3)
-            ))
-
-            logger.info('FIT_NEED_EVENTS: Initial target list has ' + str(len(target_list)) + ' entries')
-
-            utilities.checkpoint()
-
-            target_extras = TargetExtra.objects.filter(
-                target__in=target_list
-            )
-            datums = ReducedDatum.objects.filter(target__in=target_list).order_by("timestamp")
-
-            t2 = datetime.datetime.utcnow()
-            logger.info('FIT_NEED_EVENTS: Retrieved associated data for ' + str(len(target_list)) + ' Targets')
-            utilities.checkpoint()
-            logger.info('FIT_NEED_EVENTS: Time taken chk 2: ' + str(t2 - t1))
-
-            logger.info('FIT_NEED_EVENTS: Reviewing target list to identify those that need remodeling')
-            target_data = {}
-            for i,t in enumerate(target_list):
-
-                # Catch for events where the RA, Dec is not set - source of this error unknown
-                try:
-                    mulens = MicrolensingEvent(t)
-                    if type(mulens.ra) == float:
-                        mulens.set_extra_params(target_extras.filter(target=t))
-                        mulens.set_reduced_data(datums.filter(target=t))
-                        (status, reason) = mulens.check_need_to_fit()
-                        logger.info('FIT_NEED_EVENTS: Need to fit ' + t.name
-                                    + ': ' + repr(status) + ', reason: ' + reason)
-
-                        # If the event is to be fitted, this will take care of evaluating whether or
-                        # not the event is still alive, based on the new model.
-                        # If the event is not to be fitted for any reason, we need to check whether or not
-                        # it is still alive.
-                        if mulens.need_to_fit:
-                            target_data[t] = mulens
-
-                        else:
-                            if mulens.t0 and mulens.tE:
-                                alive = fittools.check_event_alive(float(mulens.t0),
-                                                                   float(mulens.tE),
-                                                                   mulens.last_observation)
-                                if alive != bool(mulens.Alive):
-                                    update_extras = {'Alive': alive}
-                                    mulens.store_parameter_set(update_extras)
-                                    logger.info('Updated Alive status to ' + repr(alive))
-
-                        logger.info('FIT_NEED_EVENTS: evaluated target ' + t.name + ', '
-                                    + str(i) + ' out of ' + str(len(target_list)))
-                        utilities.checkpoint()
-
-                    else:
-                        logger.info('FIT_NEED_EVENTS: Event with invalid RA, Dec, skipping')
-
-                except ValueError:
-                    logger.info('FIT_NEED_EVENTS: Could not create an Event object for ' + t.name + ', skipping')
-
-            t3 = datetime.datetime.utcnow()
-            logger.info('FIT_NEED_EVENTS: Collated data for ' + str(len(target_data)) + ' targets in ' + str(t3 - t2))
-            utilities.checkpoint()
-
-            # Loop through all targets in the set
-            for i, (t, mulens) in enumerate(target_data.items()):
-                logger.info('FIT_NEED_EVENTS: modeling target ' + mulens.name + ', '
-                            + str(i) + ' out of ' + str(len(target_data)))
-
-                t4 = datetime.datetime.utcnow()
-
-                result = run_fit(mulens, cores=options['cores'])
-
-                t5 = datetime.datetime.utcnow()
-                logger.info('FIT_NEED_EVENTS: Completed modeling of ' + mulens.name + ' in ' + str(t5 - t4))
-                utilities.checkpoint()
+        t1 = datetime.datetime.utcnow()
+        logger.info('FIT_NEED_EVENTS: Starting checkpoint: ')
+        utilities.checkpoint()
+
+        if not options['worker_only']:
+            sweep_need_to_fit(run_every=options['run_every'])
+
+        if not options['sweep_only']:
+            worker = fit_queue.worker_id()
+            nprocessed = process_fit_queue(worker, cores=options['cores'], claim_size=options['claim_size'],
+                                           lease_time=options['lease'], max_jobs=options['max_jobs'],
+                                           warm_start=options['warm_start'],
+                                           linear_fluxes=options['linear_fluxes'],
+                                           time_budget=options['time_budget'] or None,
+                                           max_nfev=options['max_evaluations'] or None,
+                                           use_cache=not options['no_cache'],
+                                           baseline_bin_size=options['bin_baseline'],
+                                           speculative_noblend=options['speculative_noblend'])
+            logger.info('FIT_NEED_EVENTS: Worker ' + worker + ' processed ' + str(nprocessed) + ' fit jobs')
 
-            t6 = datetime.datetime.utcnow()
-            logger.info('FIT_NEED_EVENTS: Finished modeling set of targets in ' + str(t6 - t1))
-            utilities.checkpoint()
+        t6 = datetime.datetime.utcnow()
+        logger.info('FIT_NEED_EVENTS: Finished modeling set of targets in ' + str(t6 - t1))
+        utilities.checkpoint()
 
 if __name__ == '__main__':
     main()
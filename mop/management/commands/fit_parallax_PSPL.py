@@ -0,0 +1,103 @@
+from django.core.management.base import BaseCommand
+from django.conf import settings
+from tom_targets.models import Target
+from mop.toolbox import parallax_fits, fit_workers, fit_profiling, querytools, utilities
+from mop.management.commands.fit_need_events_PSPL import store_fit_result, record_fit_profile
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+def run_parallax_fit(mulens, max_nfev=None, verbose=False):
+    """
+    Function to fit a PSPL model with annual parallax to an event, seeded from its stored static model.
+    The parallax model is stored in place of the static model only if it fits the photometry significantly
+    better.  Either way, the fingerprint of the photometry fitted is recorded, so that the event is not
+    re-fitted with parallax until its photometry changes.  The Earth's ephemeris for the photometry is
+    cached, so that it is computed only once for each version of the photometry.
+
+    Parameters:
+        mulens      MicrolensingEvent   Event with its TargetExtras and reduced data loaded
+        max_nfev    int                 Optional maximum number of objective function evaluations
+        verbose     bool                Switch for logging output
+
+    Returns:
+        status      bool                True if the fit completed and its outcome was recorded
+    """
+
+    logger.info('PARALLAX: Fitting parallax model to ' + mulens.name)
+
+    try:
+        datasets = mulens.get_clean_datasets()
+        static_model = {key: float(getattr(mulens, key)) for key in ['t0', 'u0', 'tE']}
+
+        with fit_profiling.active_profile(mulens.fit_profile):
+            (model_params, model_telescope) = parallax_fits.fit_pspl_parallax(
+                mulens.ra, mulens.dec, datasets, static_model, target=mulens.target,
+                max_nfev=max_nfev, verbose=verbose)
+            static_chi2 = parallax_fits.static_model_chi2(datasets, static_model)
+
+    except Exception as e:
+        logger.error('PARALLAX: Parallax fit failed for ' + mulens.name + ': ' + repr(e))
+        record_fit_profile(mulens, fit_workers.FIT_FAILED)
+        return False
+
+    logger.info('PARALLAX: ' + mulens.name + ' static model chi2 = ' + str(static_chi2)
+                + ', parallax model chi2 = ' + str(model_params['chi2']))
+
+    success = True
+    if parallax_fits.prefer_parallax_model(static_chi2, model_params):
+        logger.info('PARALLAX: Adopting parallax model for ' + mulens.name)
+        model_params['Fit_data_reduction'] = ''
+        model_lightcurve = None
+        if model_telescope:
+            model_lightcurve = (model_telescope.lightcurve_magnitude['time'].value,
+                                model_telescope.lightcurve_magnitude['mag'].value)
+        success = store_fit_result(mulens, {'name': mulens.name, 'model_params': model_params,
+                                            'model_lightcurve': model_lightcurve})
+    else:
+        logger.info('PARALLAX: Parallax not significant for ' + mulens.name + ', retaining static model')
+        record_fit_profile(mulens, fit_workers.FIT_OK)
+
+    if success:
+        mulens.store_parameter_set({'Parallax_fingerprint': mulens.photometry_fingerprint()})
+
+    return success
+
+class Command(BaseCommand):
+
+    help = 'Fit PSPL models with annual parallax to alive long-timescale events whose photometry has changed'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--target', help='Name of a single event to fit, default all eligible events',
+                            default=None)
+        parser.add_argument('--force', help='Re-fit events even if their photometry has already been fitted '
+                            'with parallax', action='store_true')
+        parser.add_argument('--max-evaluations', help='Maximum number of objective function evaluations for each fit, '
+                            '0 for no limit', default=getattr(settings, 'FIT_MAX_EVALUATIONS', 5000), type=int)
+
+    def handle(self, *args, **options):
+
+        t1 = datetime.datetime.utcnow()
+
+        if options['target']:
+            target_list = list(Target.objects.filter(name=options['target']))
+        else:
+            target_list = querytools.fetch_alive_events_in_category(parallax_fits.PARALLAX_CATEGORY)
+        logger.info('PARALLAX: Reviewing ' + str(len(target_list)) + ' events for parallax fits')
+
+        target_data = querytools.fetch_data_for_targetset(target_list, check_need_to_fit=False)
+
+        nfitted = 0
+        for t, mulens in target_data.items():
+            (status, reason) = parallax_fits.need_parallax_fit(mulens, force=options['force'])
+            if not status:
+                logger.info('PARALLAX: No need to fit ' + mulens.name + ', reason: ' + reason)
+                continue
+
+            run_parallax_fit(mulens, max_nfev=options['max_evaluations'] or None, verbose=True)
+            nfitted += 1
+            utilities.checkpoint()
+
+        t2 = datetime.datetime.utcnow()
+        logger.info('PARALLAX: Fitted ' + str(nfitted) + ' events with parallax in ' + str(t2 - t1))
@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+from mop.toolbox import fit_profiling
+import datetime
+import json
+
+class Command(BaseCommand):
+
+    help = 'Report percentiles of the time taken by each stage of recent model fits'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', help='Include the fits made within this many days', default=7, type=float)
+        parser.add_argument('--percentiles', help='Percentiles to report', nargs='+', type=float,
+                            default=fit_profiling.PERCENTILES)
+        parser.add_argument('--include-cached', help='Include fits whose results were taken from the fit cache',
+                            action='store_true')
+        parser.add_argument('--json', help='Output the report as JSON', action='store_true')
+        parser.add_argument('--prune-days', help='Delete the profiles of fits made more than this many days ago',
+                            default=None, type=float)
+
+    def handle(self, *args, **options):
+
+        if options['prune_days']:
+            ndeleted = fit_profiling.prune_fit_timings(options['prune_days'])
+            self.stdout.write('Deleted ' + str(ndeleted) + ' fit profiles')
+
+        since = timezone.now() - datetime.timedelta(days=options['days'])
+        percentiles = [int(p) if float(p).is_integer() else p for p in options['percentiles']]
+        statistics = fit_profiling.stage_percentiles(since=since, percentiles=percentiles,
+                                                     cached=options['include_cached'])
+
+        if options['json']:
+            self.stdout.write(json.dumps(statistics, indent=2))
+            return
+
+        columns = ['nfits', 'mean'] + ['p' + str(p) for p in percentiles]
+        self.stdout.write('{:<24}'.format('stage') + ''.join(['{:>10}'.format(c) for c in columns]))
+        for name, stats in statistics.items():
+            self.stdout.write('{:<24}'.format(name) + '{:>10d}'.format(stats['nfits'])
+                              + ''.join(['{:>10.3f}'.format(stats[c]) for c in columns[1:]]))
@@ -1,8 +1,7 @@
 from django.core.management.base import BaseCommand
 from django.db import transaction
 from tom_dataproducts.models import ReducedDatum
-from astropy.time import Time
-from mop.toolbox import querytools, fittools
+from mop.toolbox import querytools, fittools, utilities
 import numpy as np
 from mop.toolbox import classifier_tools
 
@@ -91,19 +90,22 @@ def retrieve_target_photometry(target):
     datasets = ReducedDatum.objects.filter(target=target)
 
     phot = []
-    time = []
+    timestamps = []
     for data in datasets:
         if data.data_type == 'photometry':
             if 'magnitude' in data.value.keys():
                 try:
                     phot.append([float(data.value['magnitude']),
                     float(data.value['error'])])
-                    time.append(Time(data.timestamp).jd)
+                    timestamps.append(data.timestamp)
                 except:
                     # Weights == 1
                     phot.append([float(data.value['magnitude']),
                     1])
-                    time.append(Time(data.timestamp).jd)
+                    timestamps.append(data.timestamp)
+
+    # The timestamps of all datapoints are converted together
+    time = utilities.datetimes_to_jd(timestamps)
 
     photometry = np.c_[time,phot]
 
@@ -6,8 +6,8 @@ import requests
 from requests.exceptions import HTTPError
 from tom_dataproducts.models import ReducedDatum
 from datetime import datetime
-from astropy.time import Time, TimezoneInfo
-from mop.toolbox import TAP, utilities, classifier_tools
+from astropy.time import TimezoneInfo
+from mop.toolbox import TAP, utilities, classifier_tools, fit_queue
 import logging
 
 logger = logging.getLogger(__name__)
@@ -43,38 +43,47 @@ class MOPGaia(gaia.GaiaBroker):
             html_data = response.text.split('\n')
 
             try:
-                times = [Time(i.timestamp).jd for i in ReducedDatum.objects.filter(target=target) if i.data_type == 'photometry']
+                times = set(utilities.datetimes_to_jd(
+                    [i.timestamp for i in ReducedDatum.objects.filter(target=target) if i.data_type == 'photometry']
+                ).tolist())
             except:
-                times = []
+                times = set()
 
-            for entry in html_data[2:]:
-                phot_data = entry.split(',')
+            photometry = [entry.split(',') for entry in html_data[2:]]
+            photometry = [phot_data for phot_data in photometry if len(phot_data) == 3]
 
-                if len(phot_data) == 3:
+            # The timestamps of all datapoints are converted together
+            jds = [float(phot_data[1]) for phot_data in photometry]
+            timestamps = utilities.jd_to_datetimes(jds, timezone=TimezoneInfo())
 
-                    jd = Time(float(phot_data[1]), format='jd', scale='utc')
-                    jd.to_datetime(timezone=TimezoneInfo())
+            ncreated = 0
+            for phot_data, jd, timestamp in zip(photometry, jds, timestamps):
 
-                    if ('untrusted' not in phot_data[2]) and ('null' not in phot_data[2]) and (jd.value not in times):
+                if ('untrusted' not in phot_data[2]) and ('null' not in phot_data[2]) and (jd not in times):
 
-                        value = {
-                        'magnitude': float(phot_data[2]),
-                        'filter': 'G'
-                        }
+                    value = {
+                    'magnitude': float(phot_data[2]),
+                    'filter': 'G'
+                    }
 
-                        rd, _ = ReducedDatum.objects.get_or_create(
-                                timestamp=jd.to_datetime(timezone=TimezoneInfo()),
-                                value=value,
-                                source_name=self.name,
-                                source_location=alert_url,
-                                data_type='photometry',
-                                target=target)
+                    rd, created = ReducedDatum.objects.get_or_create(
+                            timestamp=timestamp,
+                            value=value,
+                            source_name=self.name,
+                            source_location=alert_url,
+                            data_type='photometry',
+                            target=target)
 
-                        rd.save()
+                    rd.save()
+                    if created:
+                        ncreated += 1
 
             (t_last_jd, t_last_date) = TAP.TAP_time_last_datapoint(target)
             extras = {'Latest_data_HJD': t_last_jd, 'Latest_data_UTC': t_last_date}
             target.save(extras=extras)
+
+            if ncreated > 0:
+                fit_queue.enqueue_fit(target, reason='New Gaia photometry')
         except requests.exceptions.HTTPError:
             pass
 
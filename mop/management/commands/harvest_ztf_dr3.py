@@ -1,8 +1,8 @@
 from django.core.management.base import BaseCommand
 from tom_dataproducts.models import ReducedDatum
 from tom_targets.models import Target,TargetExtra
-from astropy.time import Time, TimezoneInfo
-from mop.toolbox import fittools
+from astropy.time import TimezoneInfo
+from mop.toolbox import fittools, utilities, fit_queue
 from mop.brokers import gaia as gaia_mop
 from django.conf import settings
 
@@ -63,9 +63,11 @@ class Command(BaseCommand):
             radius = 0.0001 #arsec
 
             try:
-                times = [Time(i.timestamp).jd for i in ReducedDatum.objects.filter(target=target) if i.data_type == 'photometry']
+                times = set(utilities.datetimes_to_jd(
+                    [i.timestamp for i in ReducedDatum.objects.filter(target=target) if i.data_type == 'photometry']
+                ).tolist())
             except:
-                times = []
+                times = set()
 
             try:
                 url = 'https://irsa.ipac.caltech.edu/cgi-bin/ZTF/nph_light_curves?POS=CIRCLE '+str(ra)+' '+str(dec)+' '+str(radius)+'&FORMAT=CSV'
@@ -79,24 +81,30 @@ class Command(BaseCommand):
                     #mjd, mag, magerr, filter
                     lightcurve = np.c_[light[1:,3],light[1:,4],light[1:,5],light[1:,7]]
 
+                    photometry = []
                     for line in lightcurve:
                         try:
-                            jd = Time(float(line[0])+2400000.5, format='jd', scale='utc')
-                            mag = float(line[1])
-                            emag = float(line[2])
+                            photometry.append((float(line[0])+2400000.5, float(line[1]), float(line[2]),
+                                               filters[line[-1]]))
+                        except:
+                            pass
+
+                    # The timestamps of all datapoints are converted together
+                    timestamps = utilities.jd_to_datetimes([entry[0] for entry in photometry],
+                                                           timezone=TimezoneInfo())
 
-                            filt = filters[line[-1]]
+                    ncreated = 0
+                    for (jd, mag, emag, filt), timestamp in zip(photometry, timestamps):
+                        try:
                             value = {
                                     'magnitude': mag,
                                     'filter': filt,
                                     'error': emag
                                     }
 
-                            jd.to_datetime(timezone=TimezoneInfo())
-
-                            if  (jd.value not in times):
-                                rd, _ = ReducedDatum.objects.get_or_create(
-                                    timestamp=jd.to_datetime(timezone=TimezoneInfo()),
+                            if  (jd not in times):
+                                rd, created = ReducedDatum.objects.get_or_create(
+                                    timestamp=timestamp,
                                     value=value,
                                     source_name='ZTFDR3',
                                     source_location='IRSA',
@@ -104,6 +112,8 @@ class Command(BaseCommand):
                                     target=target)
 
                                 rd.save()
+                                if created:
+                                    ncreated += 1
 
                             else:
                                 pass
@@ -113,6 +123,9 @@ class Command(BaseCommand):
 
                     logger.info('ZTF HARVESTER: Ingested ZTF data for ' + str(target.name))
 
+                    if ncreated > 0:
+                        fit_queue.enqueue_fit(target, reason='New ZTF photometry')
+
             except:
                 print('Can not connect to IRSA')
                 pass
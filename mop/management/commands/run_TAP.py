@@ -70,6 +70,9 @@ class Command(BaseCommand):
             utilities.checkpoint()
 
 
+            # The current magnitudes of all events are calculated together from their models
+            model_mags_now = TAP.TAP_model_mags_now(target_data.values())
+
             #for k,event in enumerate(list_of_events_alive[:]):
             for k, (event, mulens) in enumerate(target_data.items()):
                 logger.info('runTAP: analyzing event ' + mulens.name + ', ' + str(k) + ' out of ' + nalive)
@@ -125,7 +128,7 @@ class Command(BaseCommand):
                             t_last = Time.now(jd) - TimeDelta(days=30.0)
                         logger.info('runTAP: Last datapoint: ' + str(t_last))
 
-                        mag_now = TAP.TAP_mag_now(mulens)
+                        mag_now = TAP.TAP_mag_now(mulens, model_mag=model_mags_now.get(mulens.name))
                         logger.info('runTAP: Mag now = ' + str(mag_now))
 
                         long_priority = TAP_priority.TAP_long_event_priority(time_now, t_last, tE_pspl)
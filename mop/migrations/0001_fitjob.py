@@ -0,0 +1,38 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    initial = True
+
+    dependencies = [
+        ('tom_targets', '0020_alter_targetname_created_alter_targetname_modified'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FitJob',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('status', models.CharField(choices=[('queued', 'Queued'), ('running', 'Running'), ('done', 'Done'), ('failed', 'Failed')], default='queued', max_length=20)),
+                ('priority', models.IntegerField(default=0)),
+                ('reason', models.CharField(blank=True, default='', max_length=200)),
+                ('enqueued', models.DateTimeField(default=django.utils.timezone.now)),
+                ('requeued', models.BooleanField(default=False)),
+                ('worker', models.CharField(blank=True, default='', max_length=100)),
+                ('lease_expires', models.DateTimeField(blank=True, null=True)),
+                ('heartbeat', models.DateTimeField(blank=True, null=True)),
+                ('attempts', models.IntegerField(default=0)),
+                ('last_error', models.TextField(blank=True, default='')),
+                ('modified', models.DateTimeField(auto_now=True)),
+                ('target', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='fit_job', to='tom_targets.target')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['status', 'priority', 'enqueued'], name='mop_fitjob_claim_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:11
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mop', '0001_fitjob'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fitjob',
+            name='failures',
+            field=models.IntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='fitjob',
+            name='fit_status',
+            field=models.CharField(blank=True, default='', max_length=20),
+        ),
+        migrations.AddField(
+            model_name='fitjob',
+            name='retry_after',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:17
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tom_targets', '0020_alter_targetname_created_alter_targetname_modified'),
+        ('mop', '0002_fitjob_backoff'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FitResultCache',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('model_params', models.TextField()),
+                ('model_lightcurve', models.TextField(blank=True, default='')),
+                ('size', models.IntegerField(default=0)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('last_used', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('hits', models.IntegerField(default=0)),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fit_results', to='tom_targets.target')),
+            ],
+        ),
+    ]
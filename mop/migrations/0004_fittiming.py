@@ -0,0 +1,30 @@
+# Generated by Django 4.2.30 on 2026-10-18 08:54
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tom_targets', '0020_alter_targetname_created_alter_targetname_modified'),
+        ('mop', '0003_fitresultcache'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FitTiming',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created', models.DateTimeField(db_index=True, default=django.utils.timezone.now)),
+                ('fit_status', models.CharField(blank=True, default='', max_length=20)),
+                ('cached', models.BooleanField(default=False)),
+                ('ndata', models.IntegerField(default=0)),
+                ('total', models.FloatField(default=0.0)),
+                ('timings', models.TextField(default='{}')),
+                ('queries', models.TextField(default='{}')),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='fit_timings', to='tom_targets.target')),
+            ],
+        ),
+    ]
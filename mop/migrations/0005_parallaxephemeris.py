@@ -0,0 +1,27 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:12
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tom_targets', '0020_alter_targetname_created_alter_targetname_modified'),
+        ('mop', '0004_fittiming'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ParallaxEphemeris',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('key', models.CharField(max_length=64, unique=True)),
+                ('positions', models.TextField()),
+                ('ndata', models.IntegerField(default=0)),
+                ('created', models.DateTimeField(default=django.utils.timezone.now)),
+                ('target', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parallax_ephemerides', to='tom_targets.target')),
+            ],
+        ),
+    ]
@@ -0,0 +1,52 @@
+# Generated by Django 4.2.30 on 2026-10-18 09:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+import django.utils.timezone
+
+
+def backfill_event_summaries(apps, schema_editor):
+    """Summarises the existing Targets, so that the events selected from the summaries are
+    available as soon as the table is created"""
+
+    from mop.management.commands.backfill_event_summary import backfill_event_summaries
+    backfill_event_summaries(apps=apps)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('tom_targets', '0020_alter_targetname_created_alter_targetname_modified'),
+        ('tom_dataproducts', '0012_alter_reduceddatum_data_product_and_more'),
+        ('mop', '0005_parallaxephemeris'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='EventSummary',
+            fields=[
+                ('id', models.AutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('alive', models.BooleanField(null=True)),
+                ('classification', models.CharField(choices=[('microlensing', 'Microlensing'), ('unclassified', 'Unclassified'), ('variable', 'Variable'), ('other', 'Other')], default='other', max_length=20)),
+                ('category', models.CharField(blank=True, default='', max_length=50)),
+                ('outside_hcz', models.BooleanField(default=False)),
+                ('yso', models.BooleanField(null=True)),
+                ('qso', models.BooleanField(null=True)),
+                ('galaxy', models.BooleanField(null=True)),
+                ('t0', models.FloatField(blank=True, null=True)),
+                ('u0', models.FloatField(blank=True, null=True)),
+                ('tE', models.FloatField(blank=True, null=True)),
+                ('tap_priority', models.FloatField(blank=True, null=True)),
+                ('tap_priority_longte', models.FloatField(blank=True, null=True)),
+                ('mag_now', models.FloatField(blank=True, null=True)),
+                ('last_fit_jd', models.FloatField(blank=True, null=True)),
+                ('last_obs_jd', models.FloatField(blank=True, null=True)),
+                ('modified', models.DateTimeField(default=django.utils.timezone.now)),
+                ('target', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='event_summary', to='tom_targets.target')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['classification', 'alive', 'outside_hcz'], name='mop_summary_select_idx'), models.Index(fields=['classification', 'alive', 'last_fit_jd'], name='mop_summary_fit_idx'), models.Index(fields=['tap_priority'], name='mop_summary_tap_idx'), models.Index(fields=['tap_priority_longte'], name='mop_summary_tap_longte_idx')],
+            },
+        ),
+        migrations.RunPython(backfill_event_summaries, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,76 @@
+from django.db import migrations
+
+# Indexes for MOP's most frequent queries on the TargetExtra and ReducedDatum tables.  These tables
+# belong to the TOM Toolkit apps, so the indexes are created with SQL rather than through their models.
+# The SQL is supported by both PostgreSQL and SQLite.  On PostgreSQL the indexes are built concurrently,
+# so that the harvesters can continue to write to these large tables while the migration runs.
+
+# Keys of the TargetExtras selected by value.  Only these are indexed on their value, since they have
+# short values, whereas the values of other keys, such as Fit_covariance, may exceed the size limit
+# of an index entry.  The condition is written as alternative equalities rather than an IN list,
+# since SQLite can only match a query to the former
+SELECTION_KEYS = ['Alive', 'Classification', 'Category', 'Sky_location', 'YSO', 'QSO', 'galaxy']
+
+INDEXES = {
+    # TargetExtras selected by key and value, e.g. Classification containing 'Microlensing'
+    'mop_extra_key_value_idx':
+        'tom_targets_targetextra (key, value) WHERE '
+        + ' OR '.join(["key = '" + key + "'" for key in SELECTION_KEYS]),
+
+    # TargetExtras selected by key and numerical value, e.g. TAP_priority above a threshold
+    'mop_extra_key_float_idx':
+        'tom_targets_targetextra (key, float_value) WHERE float_value IS NOT NULL',
+
+    # ReducedDatums of a target selected by type and source, e.g. an event's tabular data products
+    'mop_datum_target_type_idx':
+        'tom_dataproducts_reduceddatum (target_id, data_type, source_name, timestamp)',
+
+    # Stored model lightcurves, selected by source, type, timestamp and target name
+    'mop_datum_source_idx':
+        'tom_dataproducts_reduceddatum (source_name, data_type, timestamp, source_location)',
+
+    # Photometry of a set of targets in time order, as loaded for fitting
+    'mop_datum_photometry_idx':
+        'tom_dataproducts_reduceddatum (target_id, timestamp) WHERE data_type = \'photometry\'',
+}
+
+
+def create_indexes(apps, schema_editor):
+    """Creates the indexes, concurrently on PostgreSQL.  A concurrent build that fails leaves an
+    invalid index behind, which is dropped so that the index is rebuilt"""
+
+    concurrently = schema_editor.connection.vendor == 'postgresql'
+    for name, definition in INDEXES.items():
+        if concurrently:
+            with schema_editor.connection.cursor() as cursor:
+                cursor.execute('SELECT NOT indisvalid FROM pg_index WHERE indexrelid = to_regclass(%s)', [name])
+                row = cursor.fetchone()
+            if row and row[0]:
+                schema_editor.execute('DROP INDEX CONCURRENTLY IF EXISTS ' + name)
+            schema_editor.execute('CREATE INDEX CONCURRENTLY IF NOT EXISTS ' + name + ' ON ' + definition)
+        else:
+            schema_editor.execute('CREATE INDEX IF NOT EXISTS ' + name + ' ON ' + definition)
+
+
+def drop_indexes(apps, schema_editor):
+    """Drops the indexes, concurrently on PostgreSQL"""
+
+    concurrently = schema_editor.connection.vendor == 'postgresql'
+    for name in INDEXES:
+        schema_editor.execute('DROP INDEX ' + ('CONCURRENTLY ' if concurrently else '') + 'IF EXISTS ' + name)
+
+
+class Migration(migrations.Migration):
+
+    # Indexes cannot be built concurrently within a transaction
+    atomic = False
+
+    dependencies = [
+        ('tom_targets', '0020_alter_targetname_created_alter_targetname_modified'),
+        ('tom_dataproducts', '0012_alter_reduceddatum_data_product_and_more'),
+        ('mop', '0006_eventsummary'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_indexes, drop_indexes)
+    ]
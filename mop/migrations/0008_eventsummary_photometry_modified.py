@@ -0,0 +1,18 @@
+# Generated by Django 4.2.30 on 2026-10-18 10:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('mop', '0007_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='eventsummary',
+            name='photometry_modified',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,311 @@
+from django.db import models
+from django.db.models.functions import Coalesce, Greatest
+from django.db.models.signals import post_save, post_delete
+from django.dispatch import receiver
+from django.utils import timezone
+from tom_targets.models import Target, TargetExtra
+from tom_dataproducts.models import ReducedDatum
+
+
+class FitJob(models.Model):
+    """
+    Queue entry for the model fit of a single Target.
+
+    Each Target has at most one FitJob, which is (re)queued whenever the event needs to be modeled,
+    for example when new photometry is harvested.  Fit workers claim jobs in small batches by taking a
+    time-limited lease on them, which they extend with a heartbeat while fitting.  If a worker dies,
+    its lease expires and the job becomes available to other workers.  Jobs whose fit fails or
+    exceeds its time budget are retried after an exponentially increasing back-off.
+    """
+
+    STATUS_QUEUED = 'queued'
+    STATUS_RUNNING = 'running'
+    STATUS_DONE = 'done'
+    STATUS_FAILED = 'failed'
+    STATUS_CHOICES = [
+        (STATUS_QUEUED, 'Queued'),
+        (STATUS_RUNNING, 'Running'),
+        (STATUS_DONE, 'Done'),
+        (STATUS_FAILED, 'Failed'),
+    ]
+
+    target = models.OneToOneField(Target, on_delete=models.CASCADE, related_name='fit_job')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default=STATUS_QUEUED)
+    priority = models.IntegerField(default=0)
+    reason = models.CharField(max_length=200, blank=True, default='')
+    enqueued = models.DateTimeField(default=timezone.now)
+
+    # Set if the job is re-queued while a worker holds it, so that it is fitted again once
+    # the current fit completes
+    requeued = models.BooleanField(default=False)
+
+    worker = models.CharField(max_length=100, blank=True, default='')
+    lease_expires = models.DateTimeField(null=True, blank=True)
+    heartbeat = models.DateTimeField(null=True, blank=True)
+    attempts = models.IntegerField(default=0)
+    last_error = models.TextField(blank=True, default='')
+
+    # Outcome of the last fit, and the number of consecutive fits that failed or exceeded their
+    # budget.  Such jobs are not claimed again until retry_after
+    fit_status = models.CharField(max_length=20, blank=True, default='')
+    failures = models.IntegerField(default=0)
+    retry_after = models.DateTimeField(null=True, blank=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'priority', 'enqueued'], name='mop_fitjob_claim_idx'),
+        ]
+
+    def __str__(self):
+        return self.target.name + ' (' + self.status + ')'
+
+
+class FitResultCache(models.Model):
+    """
+    Cached result of a model fit, keyed by the fingerprint of the photometry fitted and the
+    configuration of the fit.  Re-fitting identical data with the same configuration reproduces the
+    same model, so the stored parameters and model lightcurve can be re-used instead.  The least
+    recently used entries are evicted once the cache exceeds its configured size.
+    """
+
+    key = models.CharField(max_length=64, unique=True)
+    target = models.ForeignKey(Target, on_delete=models.CASCADE, related_name='fit_results')
+
+    # JSON-encoded model parameters and model lightcurve arrays.  These are stored as text
+    # rather than in JSONFields, since the parameters of failed fits may include NaN values
+    model_params = models.TextField()
+    model_lightcurve = models.TextField(blank=True, default='')
+    size = models.IntegerField(default=0)
+
+    created = models.DateTimeField(default=timezone.now)
+    last_used = models.DateTimeField(default=timezone.now, db_index=True)
+    hits = models.IntegerField(default=0)
+
+    def __str__(self):
+        return self.target.name + ' (' + self.key[0:12] + ')'
+
+
+class FitTiming(models.Model):
+    """
+    Profile of a single model fit of a Target, recording the wall-clock time spent in each stage of the
+    fit pipeline, so that the distribution of the time taken by each stage can be monitored.
+    """
+
+    target = models.ForeignKey(Target, on_delete=models.CASCADE, related_name='fit_timings')
+    created = models.DateTimeField(default=timezone.now, db_index=True)
+    fit_status = models.CharField(max_length=20, blank=True, default='')
+    cached = models.BooleanField(default=False)
+    ndata = models.IntegerField(default=0)
+    total = models.FloatField(default=0.0)
+
+    # JSON-encoded dictionaries of the time [s] spent, and the number of database queries made,
+    # in each stage
+    timings = models.TextField(default='{}')
+    queries = models.TextField(default='{}')
+
+    def __str__(self):
+        return self.target.name + ' (' + str(self.created) + ')'
+
+
+class ParallaxEphemeris(models.Model):
+    """
+    Positions of the Earth at the times of a Target's photometry, projected onto the North and East
+    directions on the sky at the Target, as required to model the annual parallax of the event.  These
+    are computed once for each version of the Target's photometry, keyed by its fingerprint, so that
+    repeated parallax fits do not recompute the ephemerides.
+    """
+
+    key = models.CharField(max_length=64, unique=True)
+    target = models.ForeignKey(Target, on_delete=models.CASCADE, related_name='parallax_ephemerides')
+
+    # JSON-encoded dictionary of the projected positions for each telescope, as base64-encoded arrays
+    positions = models.TextField()
+    ndata = models.IntegerField(default=0)
+
+    created = models.DateTimeField(default=timezone.now)
+
+    def __str__(self):
+        return self.target.name + ' (' + self.key[0:12] + ')'
+
+
+class EventSummary(models.Model):
+    """
+    Summary of the state of a Target that is used to select events for model fitting, TAP and display,
+    held in typed, indexed columns.  The same information is held in the Target's TargetExtras as string
+    values, which can only be selected with a join and string match for each criterion.
+
+    The summary is kept up to date whenever one of the summarised TargetExtras is saved, by the fit, TAP
+    and classifier write paths among others.  The summaries of existing Targets are created by the migration
+    that adds this table, and can be rebuilt with the backfill_event_summary command.
+    """
+
+    CLASS_MICROLENSING = 'microlensing'
+    CLASS_UNCLASSIFIED = 'unclassified'
+    CLASS_VARIABLE = 'variable'
+    CLASS_OTHER = 'other'
+    CLASSIFICATION_CHOICES = [
+        (CLASS_MICROLENSING, 'Microlensing'),
+        (CLASS_UNCLASSIFIED, 'Unclassified'),
+        (CLASS_VARIABLE, 'Variable'),
+        (CLASS_OTHER, 'Other'),
+    ]
+
+    # TargetExtras summarised, and the fields in which they are held
+    EXTRA_FIELDS = {
+        'Alive': 'alive',
+        'Classification': 'classification',
+        'Category': 'category',
+        'Sky_location': 'outside_hcz',
+        'YSO': 'yso',
+        'QSO': 'qso',
+        'galaxy': 'galaxy',
+        't0': 't0',
+        'u0': 'u0',
+        'tE': 'tE',
+        'TAP_priority': 'tap_priority',
+        'TAP_priority_longtE': 'tap_priority_longte',
+        'Mag_now': 'mag_now',
+        'Last_fit': 'last_fit_jd',
+    }
+
+    target = models.OneToOneField(Target, on_delete=models.CASCADE, related_name='event_summary')
+
+    # Boolean flags are null if the corresponding TargetExtra is missing or has no valid value
+    alive = models.BooleanField(null=True)
+    classification = models.CharField(max_length=20, choices=CLASSIFICATION_CHOICES, default=CLASS_OTHER)
+    category = models.CharField(max_length=50, blank=True, default='')
+    outside_hcz = models.BooleanField(default=False)
+    yso = models.BooleanField(null=True)
+    qso = models.BooleanField(null=True)
+    galaxy = models.BooleanField(null=True)
+
+    # Numerical values are null if the corresponding TargetExtra is missing or not finite
+    t0 = models.FloatField(null=True, blank=True)
+    u0 = models.FloatField(null=True, blank=True)
+    tE = models.FloatField(null=True, blank=True)
+    tap_priority = models.FloatField(null=True, blank=True)
+    tap_priority_longte = models.FloatField(null=True, blank=True)
+    mag_now = models.FloatField(null=True, blank=True)
+    last_fit_jd = models.FloatField(null=True, blank=True)
+    last_obs_jd = models.FloatField(null=True, blank=True)
+
+    # Time the photometry of the Target last changed, which versions its cached photometry.  This may
+    # lie in the future while photometry is being ingested, in which case the photometry is not cached
+    photometry_modified = models.DateTimeField(null=True, blank=True)
+
+    modified = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        indexes = [
+            # The classification leads these indexes, since some databases cannot use an index on a
+            # boolean field selected by its value alone
+            models.Index(fields=['classification', 'alive', 'outside_hcz'], name='mop_summary_select_idx'),
+            models.Index(fields=['classification', 'alive', 'last_fit_jd'], name='mop_summary_fit_idx'),
+            models.Index(fields=['tap_priority'], name='mop_summary_tap_idx'),
+            models.Index(fields=['tap_priority_longte'], name='mop_summary_tap_longte_idx'),
+        ]
+
+    def __str__(self):
+        return self.target.name + ' (' + self.classification + ')'
+
+    @classmethod
+    def summary_value(cls, key, value):
+        """Method to convert the value of a TargetExtra to that of the corresponding summary field"""
+
+        field = cls.EXTRA_FIELDS[key]
+
+        if field == 'classification':
+            value = str(value).lower() if value is not None else ''
+            if 'microlensing' in value:
+                return cls.CLASS_MICROLENSING
+            elif 'unclassified' in value:
+                return cls.CLASS_UNCLASSIFIED
+            elif 'variable' in value:
+                return cls.CLASS_VARIABLE
+            return cls.CLASS_OTHER
+
+        elif field == 'category':
+            return str(value) if value is not None else ''
+
+        elif field == 'outside_hcz':
+            return value is not None and 'outside hcz' in str(value).lower()
+
+        elif field in ['alive', 'yso', 'qso', 'galaxy']:
+            return {'true': True, 'false': False}.get(str(value).lower())
+
+        try:
+            value = float(value)
+        except (TypeError, ValueError, OverflowError):
+            return None
+        if value != value or value in [float('inf'), float('-inf')]:
+            return None
+        return value
+
+    @classmethod
+    def update_fields(cls, target_id, fields):
+        """Method to set fields of the summary of a Target, creating the summary if necessary"""
+
+        fields = dict(fields, modified=timezone.now())
+        if cls.objects.filter(target_id=target_id).update(**fields) == 0:
+            (summary, created) = cls.objects.get_or_create(target_id=target_id, defaults=fields)
+            if not created:
+                cls.objects.filter(target_id=target_id).update(**fields)
+
+    @classmethod
+    def touch_photometry(cls, target_id, modified=None, create=True):
+        """Method to record that the photometry of a Target has changed, at the time given or now.
+        The time recorded never moves backwards, so that a pending ingest cannot be cut short"""
+
+        if modified is None:
+            modified = timezone.now()
+        latest = Greatest(Coalesce('photometry_modified', models.Value(modified)), models.Value(modified))
+        if cls.objects.filter(target_id=target_id).update(photometry_modified=latest) == 0 and create:
+            (summary, created) = cls.objects.get_or_create(target_id=target_id,
+                                                           defaults={'photometry_modified': modified})
+            if not created:
+                cls.objects.filter(target_id=target_id).update(photometry_modified=latest)
+
+
+@receiver(post_save, sender=TargetExtra)
+def summarise_target_extra(sender, instance, raw=False, **kwargs):
+    """Updates the EventSummary of a Target whenever one of its summarised TargetExtras is saved"""
+
+    if raw or instance.key not in EventSummary.EXTRA_FIELDS:
+        return
+    EventSummary.update_fields(instance.target_id, {
+        EventSummary.EXTRA_FIELDS[instance.key]: EventSummary.summary_value(instance.key, instance.value)
+    })
+
+
+@receiver(post_delete, sender=TargetExtra)
+def unsummarise_target_extra(sender, instance, **kwargs):
+    """Clears the summarised value of a TargetExtra when it is deleted"""
+
+    if instance.key not in EventSummary.EXTRA_FIELDS:
+        return
+    EventSummary.objects.filter(target_id=instance.target_id).update(**{
+        EventSummary.EXTRA_FIELDS[instance.key]: EventSummary.summary_value(instance.key, None),
+        'modified': timezone.now()
+    })
+
+
+@receiver(post_save, sender=ReducedDatum)
+def touch_saved_photometry(sender, instance, raw=False, **kwargs):
+    """Records the change in the photometry of a Target whenever one of its photometric ReducedDatums
+    is saved.  The change is recorded in the same transaction as the datum, so that photometry cached
+    under the previous version is not used once the datum is committed"""
+
+    if raw or instance.data_type != 'photometry':
+        return
+    EventSummary.touch_photometry(instance.target_id)
+
+
+@receiver(post_delete, sender=ReducedDatum)
+def touch_deleted_photometry(sender, instance, **kwargs):
+    """Records the change in the photometry of a Target whenever one of its photometric ReducedDatums
+    is deleted.  No summary is created, since the Target itself may be being deleted"""
+
+    if instance.data_type != 'photometry':
+        return
+    EventSummary.touch_photometry(instance.target_id, create=False)
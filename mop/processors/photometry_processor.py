@@ -6,9 +6,10 @@ from astropy.io import ascii
 from astropy.time import Time, TimezoneInfo
 
 
+from django.conf import settings
 from tom_dataproducts.data_processor import DataProcessor
 from tom_dataproducts.exceptions import InvalidFileFormatException
-from mop.toolbox import TAP
+from mop.toolbox import TAP, photometry_cache
 
 # This is a custom processor made for AWS S3 bucket compliance
 
@@ -20,6 +21,11 @@ class PhotometryProcessor(DataProcessor):
         mimetype = mimetypes.guess_type(data_product.data.name)[0]
         if mimetype in self.PLAINTEXT_MIMETYPES:
             photometry = self._process_photometry_from_plaintext(data_product)
+
+            # The TOM stores the photometry returned with a bulk insert, which sends no signals, so the
+            # target's cached photometry is invalidated here, and is not re-cached until the insert is done
+            ingest_window = getattr(settings, 'PHOTOMETRY_INGEST_WINDOW', photometry_cache.PHOTOMETRY_INGEST_WINDOW)
+            photometry_cache.invalidate_photometry(data_product.target, ingest_window=ingest_window)
             return [(datum.pop('timestamp'), datum, datum['filter']) for datum in photometry]
         else:
             raise InvalidFileFormatException('Unsupported file type')
@@ -222,6 +222,11 @@ CACHES = {
     'default': {
         'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
         'LOCATION': tempfile.gettempdir()
+    },
+    'photometry': {
+        'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+        'LOCATION': os.path.join(tempfile.gettempdir(), 'mop_photometry'),
+        'OPTIONS': {'MAX_ENTRIES': int(os.getenv('PHOTOMETRY_CACHE_MAX_ENTRIES', 20000))}
     }
 }
 
@@ -374,6 +379,9 @@ EXTRA_FIELDS = [{'name': 'Alive', 'type': 'boolean', 'default':True},
                 {'name': '[Fe/H]', 'type': 'number', 'default': 0},
                 {'name': 'RUWE', 'type': 'number', 'default': 0},
                 {'name': 'Fit_covariance', 'type': 'string', 'default': ''},
+                {'name': 'Fit_fingerprint', 'type': 'string', 'default': '', 'hidden': True},
+                {'name': 'Parallax_fingerprint', 'type': 'string', 'default': '', 'hidden': True},
+                {'name': 'Fit_data_reduction', 'type': 'string', 'default': ''},
                 {'name': 'TAP_priority', 'type': 'number', 'default': ''},
                 {'name': 'TAP_priority_error', 'type': 'number', 'default': ''},
                 {'name': 'TAP_priority_longtE', 'type': 'number', 'default': ''},
@@ -439,6 +447,43 @@ THUMBNAIL_DEFAULT_SIZE = (200, 200)
 HINTS_ENABLED = True
 HINT_LEVEL = 20
 
+# Per-event limits on model fits: the maximum wall-clock time allowed for each fit [s], and the
+# maximum number of evaluations of the objective function by the fitter.  Zero means no limit.
+FIT_TIME_BUDGET = int(os.getenv('FIT_TIME_BUDGET', 600))
+FIT_MAX_EVALUATIONS = int(os.getenv('FIT_MAX_EVALUATIONS', 5000))
+
+# Limits on the number of cached model fit results, and their total size [bytes].  The least
+# recently used results are evicted once either limit is exceeded
+FIT_CACHE_MAX_ENTRIES = int(os.getenv('FIT_CACHE_MAX_ENTRIES', 5000))
+FIT_CACHE_MAX_SIZE = int(os.getenv('FIT_CACHE_MAX_SIZE', 250 * 1024 * 1024))
+
+# Model lightcurves are sampled on an adaptive time grid, such that interpolating between samples
+# reproduces the model to within MODEL_LIGHTCURVE_TOLERANCE [mag], and are stored in a compact
+# binary encoding unless MODEL_LIGHTCURVE_COMPACT is False
+MODEL_LIGHTCURVE_TOLERANCE = float(os.getenv('MODEL_LIGHTCURVE_TOLERANCE', 0.001))
+MODEL_LIGHTCURVE_COMPACT = ast.literal_eval(os.getenv('MODEL_LIGHTCURVE_COMPACT', 'True'))
+
+# Switch to calculate the statistics of the residuals of each model fit, chi2_dof and the normality
+# tests in FIT_RESIDUAL_TESTS.  These statistics were previously always NaN, and the thresholds of the
+# anomaly detector have yet to be calibrated against their actual values, so they are disabled by default
+FIT_RESIDUAL_STATISTICS = ast.literal_eval(os.getenv('FIT_RESIDUAL_STATISTICS', 'False'))
+
+# Normality tests applied to the residuals of each model fit, any of SW (Shapiro-Wilk),
+# AD (Anderson-Darling) and KS (Kolmogorov-Smirnov).  An empty string disables them
+FIT_RESIDUAL_TESTS = [test for test in os.getenv('FIT_RESIDUAL_TESTS', 'SW,AD,KS').split(',') if test]
+
+# Switch to record the time taken by each stage of every model fit in the database
+FIT_PROFILING = ast.literal_eval(os.getenv('FIT_PROFILING', 'True'))
+
+# The lightcurves of each target are cached in columnar form in the PHOTOMETRY_CACHE_ALIAS cache for
+# up to PHOTOMETRY_CACHE_TIMEOUT [s].  Cached lightcurves are keyed on the time the target's photometry
+# last changed, which is held in the database, so the cache need not be shared between pods.  Uploaded
+# photometry is not cached for PHOTOMETRY_INGEST_WINDOW [s] after the upload is processed
+PHOTOMETRY_CACHE = ast.literal_eval(os.getenv('PHOTOMETRY_CACHE', 'True'))
+PHOTOMETRY_CACHE_ALIAS = 'photometry'
+PHOTOMETRY_CACHE_TIMEOUT = int(os.getenv('PHOTOMETRY_CACHE_TIMEOUT', 7 * 24 * 3600))
+PHOTOMETRY_INGEST_WINDOW = int(os.getenv('PHOTOMETRY_INGEST_WINDOW', 300))
+
 try:
     from local_settings import * # noqa
 except ImportError:
@@ -8,7 +8,7 @@ import plotly.graph_objs as go
 
 from tom_dataproducts.models import DataProduct, ReducedDatum
 from tom_dataproducts.processors.data_serializers import SpectrumSerializer
-from mop.toolbox import utilities
+from mop.toolbox import utilities, model_lightcurves
 from mop.forms import TargetClassificationForm
 from astropy.time import Time
 from datetime import datetime
@@ -91,8 +91,9 @@ def mop_photometry(mulens):
     ### Try to plot model if exist
     if mulens.existing_model:
 
-        fig.add_trace(go.Scatter(x = np.array(mulens.existing_model.value['lc_model_time']) - 2460000,
-                                 y = np.array(mulens.existing_model.value['lc_model_magnitude']),
+        (model_times, model_mags) = model_lightcurves.decode_model_lightcurve(mulens.existing_model.value)
+        fig.add_trace(go.Scatter(x = model_times - 2460000,
+                                 y = model_mags,
                                  mode = 'lines',
                                  name = 'Model',
                                  opacity = 0.5,
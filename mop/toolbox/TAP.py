@@ -15,6 +15,9 @@ from shapely.geometry.polygon import Polygon
 
 from mop.toolbox import TAP_priority
 from mop.toolbox import mop_classes
+from mop.toolbox import pspl_tools
+from mop.toolbox import model_lightcurves
+from mop.toolbox import utilities
 import logging
 
 logger = logging.getLogger(__name__)
@@ -202,14 +205,58 @@ def TAP_telescope_class(sdss_i_mag):
 #   mag_now = ZP-2.5*np.log10(ml_model)
 #   return mag_now
 
-def TAP_mag_now(mulens):
-    lightcurve = ReducedDatum.objects.filter(target=mulens.target, data_type='lc_model')
+def TAP_model_mags_now(event_list):
+    """
+    Function to calculate the current magnitudes of a set of events from their PSPL model parameters,
+    in a single vectorized evaluation.
+
+    Parameters:
+        event_list  list    MicrolensingEvents
+
+    Returns:
+        model_mags  dict    Current model magnitude of each event, indexed by name, NaN where the
+                            model parameters of the event are not valid
+    """
     time_now = Time(datetime.datetime.now()).jd
 
-    if mulens.existing_model:
-        closest_mag = np.argmin(np.abs(lightcurve[0].value['lc_model_time']-time_now))
-        mag_now =  lightcurve[0].value['lc_model_magnitude'][closest_mag]
+    event_list = list(event_list)
+    if len(event_list) == 0:
+        return {}
+
+    (t0, u0, tE, fs, fb) = pspl_tools.event_parameter_arrays(
+        [{key: getattr(mulens, key, None) for key in ['t0', 'u0', 'tE', 'Source_magnitude', 'Blend_magnitude']}
+         for mulens in event_list]
+    )
+
+    valid = pspl_tools.valid_parameters(t0, u0, tE, fs, fb)[:, 0]
+    with np.errstate(all='ignore'):
+        mags = pspl_tools.model_magnitude(time_now, t0, u0, tE, fs, fb)[:, 0]
+    mags[~valid] = np.nan
+
+    return {mulens.name: float(mag) for mulens, mag in zip(event_list, mags)}
+
+def TAP_mag_now(mulens, model_mag=None):
+    """
+    Function to calculate the current magnitude of an event from its PSPL model parameters.
+    If the parameters are not valid, the current magnitude is instead read from the stored
+    model lightcurve, where available.  The current model magnitude may be given, if it has
+    already been calculated for a set of events by TAP_model_mags_now.
+    """
+    time_now = Time(datetime.datetime.now()).jd
+
+    if model_mag is None:
+        model_mag = TAP_model_mags_now([mulens])[mulens.name]
+
+    if np.isfinite(model_mag):
+        mag_now = float(model_mag)
+
+    elif mulens.existing_model:
+        mag_now = float(model_lightcurves.model_magnitude_at(mulens.existing_model.value, time_now))
+
+    else:
+        mag_now = None
 
+    if mag_now is not None and np.isfinite(mag_now):
         mulens.Mag_now = round(mag_now,3)
         if 'Mag_now' in mulens.extras.keys():
             mulens.extras['Mag_now'].value = round(mag_now,3)
@@ -292,13 +339,13 @@ def TAP_time_last_datapoint(target):
 
     # If there is existing photometry for this object, identify the most recent datapoint
     if datasets.count() > 0:
-        time = [Time(i.timestamp, format='datetime').jd for i in datasets if i.data_type == 'photometry']
+        timestamps = [i.timestamp for i in datasets if i.data_type == 'photometry']
 
         # It's apparently possible for targets to get ingested with a single, zero-length dataset array,
-        # in which case this exception handling is needed
-        if len(time) > 0:
-            last_jd = time[-1]
-            last_ts = Time(last_jd, format='jd').to_datetime(timezone=TimezoneInfo())
+        # in which case this exception handling is needed.  Only the latest timestamp needs to be converted
+        if len(timestamps) > 0:
+            last_jd = utilities.datetimes_to_jd(timestamps[-1:])[0]
+            last_ts = utilities.jd_to_datetimes([last_jd], timezone=TimezoneInfo())[0]
         else:
             last_jd = None
             last_ts = None
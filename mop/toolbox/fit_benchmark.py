@@ -0,0 +1,354 @@
+from contextlib import contextmanager
+from mop.toolbox import fittools, fit_profiling, pspl_tools
+import numpy as np
+import functools
+import subprocess
+import datetime
+import platform
+import time
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Version of the benchmark report format
+REPORT_VERSION = 1
+
+# Passbands assigned to the synthetic datasets of each event, in the order they are used
+BENCHMARK_PASSBANDS = ['I', 'G', 'r_ZTF', 'g_ZTF', 'ip', 'gp', 'R', 'i_ZTF']
+
+# Default configuration of a synthetic event.  The blend_ratio is fb/fs, the noise is the photometric
+# uncertainty at baseline [mag], and datapoints are only taken during the first season_length days of
+# each year, mimicking the Bulge season
+DEFAULT_CASE = {
+    'ra': 270.0,
+    'dec': -29.0,
+    'start': 2460000.0,
+    'duration': 1000.0,
+    'season_length': 240.0,
+    't0': None,
+    'u0': 0.1,
+    'tE': 30.0,
+    'baseline_mag': 17.0,
+    'blend_ratio': 0.0,
+    'noise': 0.01,
+    'ndata': 1000,
+    'ndatasets': 1
+}
+
+# Standard benchmark cases, spanning the range of events fitted by MOP.  Each case overrides
+# the DEFAULT_CASE
+BENCHMARK_CASES = [
+    {'name': 'sparse', 'ndata': 200},
+    {'name': 'single_survey', 'ndata': 1000},
+    {'name': 'dense_survey', 'ndata': 5000},
+    {'name': 'multi_survey', 'ndata': 2000, 'ndatasets': 4},
+    {'name': 'many_datasets', 'ndata': 4000, 'ndatasets': 8},
+    {'name': 'blended', 'ndata': 1000, 'ndatasets': 2, 'blend_ratio': 3.0},
+    {'name': 'high_magnification', 'ndata': 2000, 'u0': 0.005, 'tE': 20.0},
+    {'name': 'long_tE', 'ndata': 2000, 'tE': 300.0, 'duration': 3000.0},
+    {'name': 'noisy', 'ndata': 1000, 'noise': 0.1}
+]
+
+# Functions of the fitting pipeline that are timed individually
+TIMED_STAGES = ['fit_pspl_omega2', 'gather_model_parameters', 'generate_model_lightcurve']
+
+def benchmark_case(name):
+    """Function to return the complete configuration of the named standard benchmark case"""
+
+    for case in BENCHMARK_CASES:
+        if case['name'] == name:
+            config = dict(DEFAULT_CASE)
+            config.update(case)
+            return config
+
+    raise ValueError('Unknown benchmark case ' + name)
+
+def synthetic_event(config, rng):
+    """
+    Function to synthesise the lightcurves of a PSPL microlensing event.  The datapoints are divided
+    evenly between the datasets, each of which has its own baseline magnitude, and are drawn at random
+    times within the observing seasons.  The uncertainty of each datapoint scales with the square root
+    of the flux, and the magnitudes are scattered by that uncertainty.
+
+    Parameters:
+        config      dict                Event configuration, see DEFAULT_CASE
+        rng         numpy Generator     Random number generator
+
+    Returns:
+        datasets    dict    Lightcurve arrays of (time, mag, mag_error), indexed by passband
+        truth       dict    Model parameters of the event
+    """
+
+    t0 = config['t0'] if config['t0'] is not None else config['start'] + config['duration'] / 2.0
+    nseasons = int(np.ceil(config['duration'] / 365.25))
+    season_length = min(config['season_length'], 365.25)
+
+    datasets = {}
+    for i, passband in enumerate(BENCHMARK_PASSBANDS[0:config['ndatasets']]):
+        ndata = config['ndata'] // config['ndatasets']
+
+        # Times are drawn within the concatenated seasons, then mapped onto the calendar
+        x = np.sort(rng.uniform(0.0, nseasons * season_length, ndata))
+        t = config['start'] + (x // season_length) * 365.25 + x % season_length
+        t = t[t < config['start'] + config['duration']]
+
+        baseline_mag = config['baseline_mag'] + 0.5 * i
+        fs = fittools.mag_to_flux(baseline_mag) / (1.0 + config['blend_ratio'])
+        fb = fs * config['blend_ratio']
+        mags = pspl_tools.model_magnitude(t, t0, config['u0'], config['tE'], fs, fb)
+        errs = config['noise'] * 10**(0.2 * (mags - baseline_mag))
+        mags = mags + rng.normal(0.0, 1.0, len(t)) * errs
+
+        datasets[passband] = np.column_stack((t, mags, errs))
+
+    truth = {'t0': t0, 'u0': config['u0'], 'tE': config['tE'],
+             'Baseline_magnitude': config['baseline_mag'],
+             'Source_magnitude': fittools.flux_to_mag(fittools.mag_to_flux(config['baseline_mag'])
+                                                      / (1.0 + config['blend_ratio']))}
+
+    return datasets, truth
+
+@contextmanager
+def instrument_fit_pipeline(record):
+    """
+    Context manager which records the time spent in each of the TIMED_STAGES, and the number of
+    evaluations of the objective function made by the fitting engines, while the fit pipeline runs.
+    The record is a dictionary to which the total time [s] and number of calls of each stage and the
+    number of evaluations 'nfev' are added.  The functions are restored on exit.
+    """
+
+    def timed(name, function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            t = time.perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                record[name]['time'] += time.perf_counter() - t
+                record[name]['calls'] += 1
+        return wrapper
+
+    def counted_trf_fit(function):
+        @functools.wraps(function)
+        def wrapper(self, *args, **kwargs):
+            try:
+                return function(self, *args, **kwargs)
+            finally:
+                record['nfev'] += self.nfev
+        return wrapper
+
+    def counted_least_squares(function):
+        @functools.wraps(function)
+        def wrapper(*args, **kwargs):
+            result = function(*args, **kwargs)
+            record['nfev'] += result['nfev']
+            return result
+        return wrapper
+
+    originals = {name: getattr(fittools, name) for name in TIMED_STAGES + ['least_squares']}
+    original_trf_fit = fittools.BudgetTRFfit.fit
+
+    for name in TIMED_STAGES:
+        record[name] = {'time': 0.0, 'calls': 0}
+        setattr(fittools, name, timed(name, originals[name]))
+    record['nfev'] = 0
+    fittools.least_squares = counted_least_squares(originals['least_squares'])
+    fittools.BudgetTRFfit.fit = counted_trf_fit(original_trf_fit)
+
+    try:
+        yield record
+    finally:
+        for name, function in originals.items():
+            setattr(fittools, name, function)
+        fittools.BudgetTRFfit.fit = original_trf_fit
+
+def run_benchmark_case(config, seed=0, repeats=1, fit_options={}):
+    """
+    Function to fit a synthetic event repeatedly, recording the wall time of each of the TIMED_STAGES
+    and the profile of the stages of the fit pipeline, the number of evaluations of the objective function, and the recovery of the model parameters.
+    Each repeat draws a new realisation of the event's photometry from the seeded random number
+    generator, so the results are reproducible.
+
+    Parameters:
+        config      dict    Event configuration, see DEFAULT_CASE
+        seed        int     Seed of the random number generator
+        repeats     int     Number of realisations of the event to fit
+        fit_options dict    Keyword arguments passed to fit_pspl_omega2
+
+    Returns:
+        result      dict    Configuration, individual runs and summary of the case
+    """
+
+    rng = np.random.default_rng(seed)
+
+    runs = []
+    for i in range(repeats):
+        (datasets, truth) = synthetic_event(config, rng)
+
+        record = {}
+        profile = fit_profiling.FitProfile()
+        with instrument_fit_pipeline(record), fit_profiling.active_profile(profile):
+            try:
+                (model_params, model_lightcurve) = fittools.fit_pspl_omega2(config['ra'], config['dec'],
+                                                                            datasets, **fit_options)
+                error = None
+            except Exception as e:
+                logger.warning('FIT_BENCHMARK: fit of case ' + str(config.get('name')) + ' failed: ' + repr(e))
+                (model_params, model_lightcurve) = ({}, None)
+                error = repr(e)
+
+        run = {
+            'ndata': int(sum([len(lc) for lc in datasets.values()])),
+            'wall_time': record['fit_pspl_omega2']['time'],
+            'stages': {name: record[name] for name in TIMED_STAGES},
+            'profile': profile.timings,
+            'nfev': record['nfev'],
+            'success': bool(error is None and np.isfinite(model_params.get('tE', np.nan))),
+            'error': error,
+            'red_chi2': _float(model_params.get('red_chi2')),
+            'model_lightcurve_npoints': len(model_lightcurve.lightcurve_magnitude) if model_lightcurve else 0,
+            'recovery': parameter_recovery(model_params, truth)
+        }
+        runs.append(run)
+
+    return {'name': config.get('name'), 'config': config, 'seed': seed, 'fit_options': fit_options,
+            'runs': runs, 'summary': summarize_runs(runs)}
+
+def parameter_recovery(model_params, truth):
+    """Function to compare fitted model parameters with their true values, returning the offset of
+    each fitted parameter from the truth, and that offset in units of its fitted uncertainty"""
+
+    recovery = {}
+    for key, value in truth.items():
+        fitted = _float(model_params.get(key))
+        error_key = key + '_error' if key in ['t0', 'u0', 'tE'] else key.replace('magnitude', 'mag_error')
+        uncertainty = _float(model_params.get(error_key))
+        offset = fitted - value if fitted is not None else None
+        sigma = offset / uncertainty if offset is not None and uncertainty else None
+        recovery[key] = {'true': float(value), 'fitted': fitted, 'offset': offset,
+                         'sigma': _float(sigma)}
+
+    return recovery
+
+def summarize_runs(runs):
+    """Function to summarize the repeated runs of a benchmark case by the median of each measurement"""
+
+    def median(values):
+        values = [v for v in values if v is not None]
+        return float(np.median(values)) if len(values) > 0 else None
+
+    summary = {
+        'nruns': len(runs),
+        'success_rate': float(np.mean([run['success'] for run in runs])),
+        'wall_time': median([run['wall_time'] for run in runs]),
+        'nfev': median([run['nfev'] for run in runs]),
+        'stages': {name: median([run['stages'][name]['time'] for run in runs]) for name in TIMED_STAGES},
+        'abs_sigma': {}
+    }
+    for key in ['t0', 'u0', 'tE']:
+        summary['abs_sigma'][key] = median([abs(run['recovery'][key]['sigma'])
+                                            for run in runs if run['recovery'][key]['sigma'] is not None])
+
+    return summary
+
+def run_benchmark(case_names=None, seed=0, repeats=1, fit_options={}):
+    """
+    Function to run the benchmark suite, returning a report that can be stored as JSON and compared
+    between versions of the code.
+
+    Parameters:
+        case_names  list    Names of the BENCHMARK_CASES to run, default all
+        seed        int     Seed of the random number generator
+        repeats     int     Number of realisations of each case to fit
+        fit_options dict    Keyword arguments passed to fit_pspl_omega2
+
+    Returns:
+        report      dict    Benchmark report
+    """
+
+    if not case_names:
+        case_names = [case['name'] for case in BENCHMARK_CASES]
+
+    report = {
+        'version': REPORT_VERSION,
+        'created': datetime.datetime.utcnow().isoformat(),
+        'commit': git_commit(),
+        'platform': {'python': platform.python_version(), 'numpy': np.__version__,
+                     'machine': platform.machine(), 'processor': platform.processor()},
+        'seed': seed,
+        'repeats': repeats,
+        'fit_options': fit_options,
+        'cases': []
+    }
+
+    for name in case_names:
+        logger.info('FIT_BENCHMARK: running case ' + name)
+        result = run_benchmark_case(benchmark_case(name), seed=seed, repeats=repeats, fit_options=fit_options)
+        logger.info('FIT_BENCHMARK: case ' + name + ' summary ' + repr(result['summary']))
+        report['cases'].append(result)
+
+    return report
+
+def compare_reports(baseline, report):
+    """
+    Function to compare the summaries of two benchmark reports, case by case.
+
+    Returns:
+        comparison  list    For each case present in both reports, a dictionary of the baseline and new
+                            median wall time and evaluations, their ratios, and the change in success rate
+    """
+
+    baseline_cases = {case['name']: case['summary'] for case in baseline['cases']}
+
+    comparison = []
+    for case in report['cases']:
+        if case['name'] not in baseline_cases:
+            continue
+        old = baseline_cases[case['name']]
+        new = case['summary']
+        comparison.append({
+            'name': case['name'],
+            'wall_time': [old['wall_time'], new['wall_time']],
+            'wall_time_ratio': _ratio(new['wall_time'], old['wall_time']),
+            'nfev': [old['nfev'], new['nfev']],
+            'nfev_ratio': _ratio(new['nfev'], old['nfev']),
+            'success_rate_change': new['success_rate'] - old['success_rate']
+        })
+
+    return comparison
+
+def write_report(report, file_path):
+    """Function to write a benchmark report as JSON, with sorted keys so that reports can be diffed"""
+
+    with open(file_path, 'w') as f:
+        json.dump(report, f, indent=2, sort_keys=True, default=_float)
+        f.write('\n')
+
+def read_report(file_path):
+    """Function to read a benchmark report"""
+
+    with open(file_path, 'r') as f:
+        return json.load(f)
+
+def git_commit():
+    """Function to return the hash of the current commit of the code, if available"""
+
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], capture_output=True, text=True,
+                              check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+def _ratio(a, b):
+    return a / b if a is not None and b else None
+
+def _float(value):
+    """Function to convert numerical values to JSON-compatible floats, with None for missing values"""
+
+    try:
+        value = float(value)
+    except (TypeError, ValueError):
+        return None
+
+    return value if np.isfinite(value) else None
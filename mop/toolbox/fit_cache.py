@@ -0,0 +1,201 @@
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Count, F, Sum
+from django.utils import timezone
+from mop.models import FitResultCache
+from mop.toolbox import fittools, pspl_tools
+import numpy as np
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Version of the fitting code.  This should be incremented whenever a change to the fitting code
+# would change the results of a fit, so that cached results from earlier versions are not re-used
+CACHE_VERSION = 4
+
+# Fitting engines, which are distinguished in the cache since their results may differ slightly
+FITTER_TRF = 'trf'
+FITTER_LINEAR_FLUXES = 'trf_linear_fluxes'
+FITTER_BATCH = 'batch'
+
+# Default limits on the number of entries in the cache, and their total size [bytes]
+MAX_ENTRIES = 5000
+MAX_SIZE = 250 * 1024 * 1024
+
+def fit_cache_key(datasets, emag_limit=None, fitter=FITTER_TRF, baseline_bin_size=None, warm_start=None,
+                  max_nfev=None):
+    """
+    Function to calculate the key of the cached result of a model fit, from the fingerprint of the
+    photometry to be fitted, before it is cleaned, and the configuration of the fit.
+
+    Parameters:
+        datasets    dict    Lightcurve arrays indexed by passband, as returned by repackage_lightcurves
+        emag_limit  float   Limit on the photometric uncertainty of datapoints included in the fit
+        fitter      str     Fitting engine used, one of the FITTER_* values
+        baseline_bin_size float Width of the bins for baseline photometry [days], if binned
+        warm_start  dict    Parameters of the previous fit from which the fit is seeded, if any
+        max_nfev    int     Maximum number of objective function evaluations allowed, if limited
+
+    Returns:
+        key         str     Hexadecimal SHA-256 digest
+    """
+
+    fit_config = fittools.fit_configuration(emag_limit=emag_limit)
+    fit_config.update({
+        'fitter': fitter,
+        't0_margin': fittools.PSPL_T0_MARGIN,
+        'u0_bounds': fittools.PSPL_U0_BOUNDS,
+        'tE_bounds': fittools.PSPL_TE_BOUNDS,
+        'cleaning': [fittools.CLEAN_NSIGMA, fittools.CLEAN_WINDOW, fittools.CLEAN_MAX_SPAN],
+        'seed_grid': [pspl_tools.GRID_U0_VALUES, pspl_tools.GRID_TE_VALUES, pspl_tools.GRID_T0_OFFSETS,
+                      pspl_tools.GRID_NT0, pspl_tools.GRID_REFINE_FACTORS,
+                      pspl_tools.GRID_REFINE_T0_OFFSETS, pspl_tools.GRID_MAX_POINTS],
+        'residual_tests': sorted(getattr(settings, 'FIT_RESIDUAL_TESTS', fittools.RESIDUAL_TESTS))
+                          if getattr(settings, 'FIT_RESIDUAL_STATISTICS', False) else [],
+        'version': CACHE_VERSION
+    })
+    if baseline_bin_size:
+        fit_config['baseline_bin_size'] = baseline_bin_size
+        fit_config['baseline_window'] = [fittools.BASELINE_WINDOW, fittools.MIN_BASELINE_HALF_WINDOW]
+    if warm_start:
+        fit_config['warm_start_bounds'] = warm_start_bounds(warm_start)
+    if max_nfev:
+        fit_config['max_nfev'] = int(max_nfev)
+
+    return fittools.photometry_fingerprint(datasets, fit_config=fit_config)
+
+def warm_start_bounds(warm_start):
+    """
+    Function to calculate the boundaries of t0, u0 and tE to which a fit seeded from a previous fit is
+    narrowed.  These are the boundaries before they are limited to the default boundaries of the
+    fit, which are fixed by the photometry and the rest of the fit configuration.
+
+    Parameters:
+        warm_start  dict    Parameters and uncertainties of the previous fit
+
+    Returns:
+        bounds      list    [lower, upper] boundaries of t0, u0 and tE
+    """
+
+    unbounded = {key: [key, [-np.inf, np.inf]] for key in ['t0', 'u0', 'tE']}
+    bounds = fittools.warm_start_boundaries(warm_start, unbounded)
+
+    return [[float(bounds[key][0]), float(bounds[key][1])] for key in ['t0', 'u0', 'tE']]
+
+def lookup_fit(key):
+    """
+    Function to retrieve the cached result of a model fit, recording its use.
+
+    Parameters:
+        key     str     Cache key, as returned by fit_cache_key
+
+    Returns:
+        (model_params, model_lightcurve) or None if the result is not cached.  model_lightcurve is
+        a tuple of the arrays of model timestamps and magnitudes, or None if no model lightcurve
+        could be generated.
+    """
+
+    try:
+        entry = FitResultCache.objects.get(key=key)
+    except FitResultCache.DoesNotExist:
+        return None
+
+    FitResultCache.objects.filter(pk=entry.pk).update(last_used=timezone.now(), hits=F('hits') + 1)
+
+    model_params = json.loads(entry.model_params, object_hook=_from_json)
+    model_lightcurve = None
+    if entry.model_lightcurve:
+        lc = json.loads(entry.model_lightcurve)
+        model_lightcurve = (np.array(lc['time']), np.array(lc['mag']))
+
+    logger.info('FIT_CACHE: Found cached fit for ' + entry.target.name)
+
+    return model_params, model_lightcurve
+
+def store_fit(key, target, model_params, model_lightcurve=None):
+    """
+    Function to add the result of a model fit to the cache, evicting the least recently used
+    entries if the cache exceeds its configured size.
+
+    Parameters:
+        key                 str     Cache key, as returned by fit_cache_key
+        target              Target  Event that was fitted
+        model_params        dict    Fitted model parameters, as returned by fit_pspl_omega2
+        model_lightcurve    tuple   Optional arrays of model timestamps and magnitudes
+    """
+
+    params_json = json.dumps(model_params, default=_to_json)
+    lc_json = ''
+    if model_lightcurve is not None:
+        lc_json = json.dumps({
+            'time': np.asarray(model_lightcurve[0], dtype=float).tolist(),
+            'mag': np.asarray(model_lightcurve[1], dtype=float).tolist()
+        })
+
+    now = timezone.now()
+    FitResultCache.objects.update_or_create(
+        key=key,
+        defaults={
+            'target': target,
+            'model_params': params_json,
+            'model_lightcurve': lc_json,
+            'size': len(params_json) + len(lc_json),
+            'created': now,
+            'last_used': now
+        }
+    )
+
+    evict_fits()
+
+def evict_fits(max_entries=None, max_size=None):
+    """
+    Function to evict the least recently used entries from the fit cache, until it holds no more
+    than max_entries, with a total size of no more than max_size bytes.  The limits default to the
+    FIT_CACHE_MAX_ENTRIES and FIT_CACHE_MAX_SIZE settings.
+
+    Returns:
+        nevicted    int     Number of entries evicted
+    """
+
+    if max_entries is None:
+        max_entries = getattr(settings, 'FIT_CACHE_MAX_ENTRIES', MAX_ENTRIES)
+    if max_size is None:
+        max_size = getattr(settings, 'FIT_CACHE_MAX_SIZE', MAX_SIZE)
+
+    with transaction.atomic():
+        # Entries are retained in order of most recent use, until either limit is reached
+        usage = FitResultCache.objects.aggregate(nentries=Count('pk'), total_size=Sum('size'))
+        if usage['nentries'] <= max_entries and (usage['total_size'] or 0) <= max_size:
+            return 0
+
+        evict = []
+        nentries = 0
+        total_size = 0
+        for (pk, size) in FitResultCache.objects.order_by('-last_used').values_list('pk', 'size'):
+            nentries += 1
+            total_size += size
+            if nentries > max_entries or total_size > max_size:
+                evict.append(pk)
+
+        nevicted, _ = FitResultCache.objects.filter(pk__in=evict).delete()
+
+    logger.info('FIT_CACHE: Evicted ' + str(nevicted) + ' cached fits')
+
+    return nevicted
+
+def _to_json(value):
+    """Function to serialize the numpy types included in model parameters"""
+
+    if isinstance(value, np.ndarray):
+        return {'__ndarray__': value.tolist()}
+    if isinstance(value, np.generic):
+        return value.item()
+    raise TypeError('Cannot serialize ' + repr(type(value)))
+
+def _from_json(obj):
+    """Function to restore the numpy arrays included in model parameters"""
+
+    if list(obj.keys()) == ['__ndarray__']:
+        return np.array(obj['__ndarray__'])
+    return obj
@@ -0,0 +1,184 @@
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connection
+from django.utils import timezone
+from mop.models import FitTiming
+import numpy as np
+import contextvars
+import datetime
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Stages of the fit pipeline, in the order in which they run
+STAGES = ['data_load', 'data_clean', 'data_reduction', 'telescope_build', 'model_1', 'model_2',
+          'ephemeris', 'model_parallax', 'residual_stats', 'lightcurve_generation', 'db_write']
+
+# Percentiles of the time taken by each stage reported by default
+PERCENTILES = [50, 90, 99]
+
+# Profile of the fit currently running in this process or thread, if any
+_active_profile = contextvars.ContextVar('fit_profile', default=None)
+
+class FitProfile(object):
+    """
+    Record of the wall-clock time spent in each stage of the model fit of a single event, and the number
+    of database queries made during each stage.  The time of a stage excludes that of any stages nested
+    within it, so that the timings of all stages add up to the total time profiled.
+    """
+
+    def __init__(self):
+        self.timings = {}
+        self.queries = {}
+        self._stack = []
+
+    @contextmanager
+    def stage(self, name):
+        """Context manager to time a stage of the fit, adding to any time already spent in it"""
+
+        nqueries = [0]
+        def count_queries(execute, sql, params, many, context):
+            nqueries[0] += 1
+            return execute(sql, params, many, context)
+
+        self._stack.append(name)
+        t = time.perf_counter()
+        try:
+            with connection.execute_wrapper(count_queries):
+                yield self
+        finally:
+            elapsed = time.perf_counter() - t
+            self._stack.pop()
+            self._add(name, elapsed, nqueries[0])
+
+            # The time and queries of a nested stage are removed from the stage enclosing it
+            if len(self._stack) > 0:
+                self._add(self._stack[-1], -elapsed, -nqueries[0])
+
+    def _add(self, name, elapsed, nqueries):
+        self.timings[name] = self.timings.get(name, 0.0) + elapsed
+        self.queries[name] = self.queries.get(name, 0) + nqueries
+
+    def update(self, timings, queries={}):
+        """Method to add the stage timings of part of the fit profiled elsewhere, for example by a
+        worker process"""
+
+        for name, elapsed in timings.items():
+            self._add(name, elapsed, queries.get(name, 0))
+
+    def total(self):
+        """Method to return the total time profiled [s]"""
+
+        return float(sum(self.timings.values()))
+
+    def summary(self):
+        """Method to describe the profile in a single line"""
+
+        return ', '.join([name + ' ' + '{:.3f}'.format(self.timings[name]) + 's'
+                          for name in sorted(self.timings.keys(), key=_stage_order)]) \
+               + ', total ' + '{:.3f}'.format(self.total()) + 's'
+
+@contextmanager
+def active_profile(profile):
+    """Context manager which makes a FitProfile the active profile, in which the stages of the fit
+    pipeline timed by fit_stage are recorded"""
+
+    token = _active_profile.set(profile)
+    try:
+        yield profile
+    finally:
+        _active_profile.reset(token)
+
+@contextmanager
+def fit_stage(name):
+    """Context manager to time a stage of the fit pipeline in the active FitProfile.  If no profile is
+    active, the stage is not timed"""
+
+    profile = _active_profile.get()
+    if profile is None:
+        yield None
+    else:
+        with profile.stage(name):
+            yield profile
+
+def store_fit_timing(target, profile, fit_status='', cached=False, ndata=0):
+    """
+    Function to record the profile of a model fit in the database, unless disabled by the
+    FIT_PROFILING setting.
+
+    Parameters:
+        target      Target      Event that was fitted
+        profile     FitProfile  Profile of the fit
+        fit_status  str         Outcome of the fit
+        cached      bool        True if the fit result was taken from the fit cache
+        ndata       int         Number of datapoints fitted
+
+    Returns:
+        timing      FitTiming or None
+    """
+
+    if not getattr(settings, 'FIT_PROFILING', True):
+        return None
+
+    return FitTiming.objects.create(
+        target=target,
+        fit_status=fit_status,
+        cached=cached,
+        ndata=ndata,
+        total=profile.total(),
+        timings=json.dumps(profile.timings),
+        queries=json.dumps(profile.queries)
+    )
+
+def stage_percentiles(since=None, percentiles=PERCENTILES, cached=False):
+    """
+    Function to calculate percentiles of the time taken by each stage of the model fits recorded
+    since a given time.  Fits in which a stage did not run do not contribute to its percentiles.
+
+    Parameters:
+        since       datetime    Earliest time of the fits included, default all
+        percentiles list        Percentiles to calculate
+        cached      bool        Switch to include fits whose results were taken from the fit cache
+
+    Returns:
+        statistics  dict    For each stage and the total, the number of fits, the mean time and each
+                            percentile [s], keyed as 'p50' etc.
+    """
+
+    qs = FitTiming.objects.all()
+    if since:
+        qs = qs.filter(created__gte=since)
+    if not cached:
+        qs = qs.filter(cached=False)
+
+    stage_times = {}
+    for (timings, total) in qs.values_list('timings', 'total'):
+        for name, elapsed in json.loads(timings).items():
+            stage_times.setdefault(name, []).append(elapsed)
+        stage_times.setdefault('total', []).append(total)
+
+    statistics = {}
+    for name in sorted(stage_times.keys(), key=_stage_order):
+        values = np.array(stage_times[name])
+        statistics[name] = {'nfits': len(values), 'mean': float(values.mean())}
+        for p, value in zip(percentiles, np.percentile(values, percentiles)):
+            statistics[name]['p' + str(p)] = float(value)
+
+    return statistics
+
+def prune_fit_timings(max_age_days):
+    """Function to delete the profiles of model fits older than max_age_days, returning the number deleted"""
+
+    cutoff = timezone.now() - datetime.timedelta(days=max_age_days)
+    (ndeleted, _) = FitTiming.objects.filter(created__lt=cutoff).delete()
+
+    return ndeleted
+
+def _stage_order(name):
+    """Function to sort stage names into the order of the pipeline, followed by any others"""
+
+    if name in STAGES:
+        return (STAGES.index(name), name)
+    return (len(STAGES), name)
@@ -0,0 +1,187 @@
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from mop.models import FitJob
+import datetime
+import os
+import socket
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Default duration of the lease taken by a worker on a fit job [s]
+LEASE_TIME = 1800
+
+# Delay before a failed fit job is retried [s], which doubles with each consecutive failure up
+# to MAX_BACKOFF.  After MAX_FAILURES consecutive failures the job is marked as failed, and is
+# only retried if the event is queued again
+RETRY_BACKOFF = 3600
+MAX_BACKOFF = 86400
+MAX_FAILURES = 5
+
+def worker_id():
+    """Function to return an identifier for the current fit worker process, unique across pods"""
+
+    return socket.gethostname() + ':' + str(os.getpid())
+
+def enqueue_fit(target, reason='', priority=0):
+    """
+    Function to add a Target to the queue of events to be fitted.  If a job already exists for
+    this Target it is re-queued, unless it is currently held by a worker, in which case it is
+    flagged to be fitted again once the current fit completes.  Any back-off applied after previous
+    failed fits is retained, so that new data do not trigger immediate retries of a failing fit.
+
+    Parameters:
+        target      Target  Event to be fitted
+        reason      str     Reason for the fit, for logging
+        priority    int     Jobs with higher priority are claimed first
+
+    Returns:
+        job         FitJob
+    """
+
+    with transaction.atomic():
+        job, created = FitJob.objects.select_for_update().get_or_create(
+            target=target,
+            defaults={'reason': reason[0:200], 'priority': priority}
+        )
+
+        if not created:
+            if job.status == FitJob.STATUS_RUNNING:
+                job.requeued = True
+                job.priority = max(job.priority, priority)
+            elif job.status == FitJob.STATUS_QUEUED:
+                job.priority = max(job.priority, priority)
+            else:
+                job.status = FitJob.STATUS_QUEUED
+                job.enqueued = timezone.now()
+                job.priority = priority
+            job.reason = reason[0:200]
+            job.save()
+
+    logger.info('FIT_QUEUE: Queued model fit for ' + target.name + ': ' + reason)
+
+    return job
+
+def claim_fit_jobs(worker, batch_size=10, lease_time=LEASE_TIME):
+    """
+    Function to claim a batch of fit jobs for a worker.  Jobs that are queued and not waiting to be
+    retried, or whose lease has expired because their worker stopped sending heartbeats, are available
+    to be claimed.
+    The rows are locked only for the duration of this short transaction, and rows locked by other
+    workers are skipped, so that several workers can claim jobs concurrently.
+
+    Parameters:
+        worker      str     Identifier of the worker claiming the jobs
+        batch_size  int     Maximum number of jobs to claim
+        lease_time  int     Duration of the lease [s]
+
+    Returns:
+        jobs        list    Claimed FitJobs, with their Targets
+    """
+
+    now = timezone.now()
+
+    with transaction.atomic():
+        qs = FitJob.objects.select_for_update(skip_locked=True, of=('self',)).select_related('target').filter(
+            Q(status=FitJob.STATUS_QUEUED, retry_after__isnull=True)
+            | Q(status=FitJob.STATUS_QUEUED, retry_after__lte=now)
+            | Q(status=FitJob.STATUS_RUNNING, lease_expires__lt=now)
+        ).order_by('-priority', 'enqueued')[0:batch_size]
+
+        jobs = list(qs)
+        for job in jobs:
+            if job.status == FitJob.STATUS_RUNNING:
+                logger.warning('FIT_QUEUE: Lease on ' + job.target.name + ' held by ' + job.worker
+                               + ' expired, reclaiming')
+            job.status = FitJob.STATUS_RUNNING
+            job.worker = worker
+            job.heartbeat = now
+            job.lease_expires = now + datetime.timedelta(seconds=lease_time)
+            job.attempts += 1
+            job.requeued = False
+            job.save()
+
+    logger.info('FIT_QUEUE: Worker ' + worker + ' claimed ' + str(len(jobs)) + ' fit jobs')
+
+    return jobs
+
+def heartbeat(jobs, worker, lease_time=LEASE_TIME):
+    """
+    Function to extend the lease of a worker on a set of jobs that it is still processing.
+
+    Returns:
+        nupdated    int     Number of jobs for which the lease was extended.  Jobs whose lease has
+                            been taken over by another worker are not updated.
+    """
+
+    now = timezone.now()
+    nupdated = FitJob.objects.filter(
+        pk__in=[job.pk for job in jobs], worker=worker, status=FitJob.STATUS_RUNNING
+    ).update(heartbeat=now, lease_expires=now + datetime.timedelta(seconds=lease_time))
+
+    return nupdated
+
+def complete_fit_job(job, worker):
+    """Function to record that a worker has completed a fit job.  If the job was re-queued
+    while it was being processed, it returns to the queue"""
+
+    _release_fit_job(job, worker, FitJob.STATUS_DONE, fit_status='ok')
+
+def fail_fit_job(job, worker, error='', fit_status='failed'):
+    """
+    Function to record that a fit job failed, together with the error raised.  The job is
+    queued to be retried after a back-off that doubles with each consecutive failure, until
+    MAX_FAILURES is reached, after which it is marked as failed.
+
+    Parameters:
+        job         FitJob  Job that failed
+        worker      str     Identifier of the worker holding the job
+        error       str     Description of the error
+        fit_status  str     Outcome of the fit, e.g. 'failed', 'timeout' or 'iteration_limit'
+    """
+
+    _release_fit_job(job, worker, FitJob.STATUS_FAILED, error=error, fit_status=fit_status)
+    logger.error('FIT_QUEUE: Fit failed for ' + job.target.name + ' (' + fit_status + '): ' + error)
+
+def retry_delay(failures):
+    """Function to return the back-off before a job that has failed a number of consecutive
+    times is retried"""
+
+    return datetime.timedelta(seconds=min(RETRY_BACKOFF * 2**max(failures - 1, 0), MAX_BACKOFF))
+
+def _release_fit_job(job, worker, status, error='', fit_status=''):
+
+    with transaction.atomic():
+        try:
+            current = FitJob.objects.select_for_update().get(pk=job.pk)
+        except FitJob.DoesNotExist:
+            return
+
+        # Only the worker holding the lease may release the job
+        if current.worker != worker:
+            logger.warning('FIT_QUEUE: Job for ' + job.target.name + ' is no longer held by ' + worker)
+            return
+
+        if status == FitJob.STATUS_FAILED:
+            current.failures += 1
+            current.retry_after = timezone.now() + retry_delay(current.failures)
+            if current.failures < MAX_FAILURES:
+                status = FitJob.STATUS_QUEUED
+            logger.info('FIT_QUEUE: Job for ' + job.target.name + ' has failed ' + str(current.failures)
+                        + ' times, next retry after ' + current.retry_after.isoformat())
+        else:
+            current.failures = 0
+            current.retry_after = None
+
+        if current.requeued:
+            current.status = FitJob.STATUS_QUEUED
+            current.enqueued = timezone.now()
+            current.requeued = False
+        else:
+            current.status = status
+        current.worker = ''
+        current.lease_expires = None
+        current.last_error = error
+        current.fit_status = fit_status
+        current.save()
@@ -0,0 +1,198 @@
+from mop.toolbox import fittools, fit_profiling
+import multiprocessing
+from multiprocessing import connection
+import datetime
+import os
+import signal
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Fit status values reported in the results of each fit
+FIT_OK = 'ok'
+FIT_FAILED = 'failed'
+FIT_TIMEOUT = 'timeout'
+FIT_ITERATION_LIMIT = 'iteration_limit'
+
+def build_fit_job(mulens, warm_start=False, linear_fluxes=False, max_nfev=None, baseline_bin_size=None,
+                  speculative_noblend=False):
+    """Function to package the data required to fit a single event into a form that can be passed
+    to a worker process.  Only plain Python and numpy types are included, so that worker processes
+    never need to access the database.
+
+    Parameters:
+        mulens          MicrolensingEvent   Event with its reduced data already loaded.  The fit uses its
+                                            cleaned lightcurves
+        warm_start      bool                Switch to seed the fit from the previously stored model
+        linear_fluxes   bool                Switch to solve for the fluxes analytically during the fit
+        max_nfev        int                 Optional maximum number of objective function evaluations
+        baseline_bin_size float             Optional width of the bins for baseline photometry [days]
+        speculative_noblend bool            Switch to fit the model without blending in parallel with the
+                                            blended model
+
+    Returns:
+        job             dict                Event name, coordinates, dictionary of lightcurve arrays
+                                            and the fit options
+    """
+
+    job = {
+        'name': mulens.name,
+        'ra': float(mulens.ra),
+        'dec': float(mulens.dec),
+        'datasets': mulens.get_clean_datasets(),
+        'ndata': int(mulens.ndata),
+        'warm_start': mulens.get_warm_start_parameters() if warm_start else None,
+        'linear_fluxes': linear_fluxes,
+        'max_nfev': max_nfev,
+        'baseline_bin_size': baseline_bin_size,
+        'speculative_noblend': speculative_noblend
+    }
+
+    return job
+
+def fit_worker(job):
+    """Function to fit a PSPL model to the lightcurve data of a single event.
+    This function is designed to run in a worker process, and must not access the database.
+
+    Parameters:
+        job     dict    Fit job, as produced by build_fit_job
+
+    Returns:
+        result  dict    Event name, fit status, fitted model parameters, model lightcurve arrays,
+                        the time taken for the fit and the time taken by each of its stages.
+                        If the fit fails, model_params is None.
+    """
+
+    t1 = datetime.datetime.utcnow()
+
+    result = {'name': job['name'], 'fit_status': FIT_FAILED, 'model_params': None, 'model_lightcurve': None}
+    profile = fit_profiling.FitProfile()
+
+    try:
+        with fit_profiling.active_profile(profile):
+            (model_params, model_telescope) = fittools.fit_pspl_omega2(
+                job['ra'], job['dec'], job['datasets'], warm_start=job.get('warm_start'),
+                linear_fluxes=job.get('linear_fluxes', False), max_nfev=job.get('max_nfev'),
+                baseline_bin_size=job.get('baseline_bin_size'),
+                speculative_noblend=job.get('speculative_noblend', False))
+
+        # The pyLIMA telescope object is replaced by the timeseries arrays it holds,
+        # so that the result can be returned to the parent process
+        if model_telescope:
+            result['model_lightcurve'] = (
+                model_telescope.lightcurve_magnitude['time'].value,
+                model_telescope.lightcurve_magnitude['mag'].value
+            )
+        result['model_params'] = model_params
+        result['fit_status'] = FIT_OK
+
+    except fittools.FitBudgetExceeded as e:
+        result['fit_status'] = FIT_ITERATION_LIMIT
+        logger.warning('FIT_WORKER: Fit budget exceeded for ' + job['name'] + ' with '
+                       + str(job.get('ndata')) + ' datapoints: ' + str(e))
+
+    except Exception as e:
+        logger.error('FIT_WORKER: Fit failed for ' + job['name'] + ': ' + repr(e))
+
+    result['fit_time'] = datetime.datetime.utcnow() - t1
+    result['timings'] = profile.timings
+
+    return result
+
+def run_parallel_fits(jobs, cores, time_budget=None):
+    """Function to distribute a set of fit jobs over a number of worker processes.
+    Results are yielded as each fit completes, so that the calling process can store them while
+    the remaining fits are still running.
+
+    Each fit runs in its own subprocess.  If a time budget is given, a watchdog terminates any fit
+    still running after that time, and a result with fit_status 'timeout' is returned for it, so that a
+    single pathological lightcurve cannot stall the whole set.
+
+    Parameters:
+        jobs        list    Fit jobs, as produced by build_fit_job
+        cores       int     Number of worker processes to use
+        time_budget float   Optional maximum wall-clock time allowed for each fit [s]
+
+    Returns:
+        Generator of results from fit_worker
+    """
+
+    ncores = max(1, min(cores, len(jobs)))
+    logger.info('FIT_WORKERS: Distributing ' + str(len(jobs)) + ' fits over ' + str(ncores) + ' processes')
+
+    # pyLIMA's fit objects start their own multiprocessing Manager, so the workers must be
+    # non-daemonic processes
+    ctx = multiprocessing.get_context()
+    queue = list(jobs)
+    running = {}
+
+    try:
+        while len(queue) > 0 or len(running) > 0:
+            while len(queue) > 0 and len(running) < ncores:
+                job = queue.pop(0)
+                (receiver, sender) = ctx.Pipe(duplex=False)
+                process = ctx.Process(target=_fit_process, args=(job, sender), daemon=False)
+                process.start()
+                sender.close()
+                running[receiver] = (process, job, time.monotonic())
+
+            # Wake at least once a second, or when the next fit reaches its time budget
+            timeout = 1.0
+            if time_budget:
+                next_deadline = min([start for (process, job, start) in running.values()]) + time_budget
+                timeout = min(timeout, max(next_deadline - time.monotonic(), 0.0))
+
+            for receiver in connection.wait(list(running.keys()), timeout=timeout):
+                (process, job, start) = running.pop(receiver)
+                try:
+                    result = receiver.recv()
+                except EOFError:
+                    logger.error('FIT_WORKERS: Worker process for ' + job['name'] + ' exited without a result')
+                    result = _failed_result(job, FIT_FAILED, start)
+                receiver.close()
+                process.join()
+                yield result
+
+            if time_budget:
+                now = time.monotonic()
+                for receiver, (process, job, start) in list(running.items()):
+                    if now - start > time_budget:
+                        logger.warning('FIT_WORKERS: Fit of ' + job['name'] + ' with ' + str(job.get('ndata'))
+                                       + ' datapoints exceeded the time budget of ' + str(time_budget)
+                                       + 's and was terminated')
+                        _kill_process_group(process)
+                        receiver.close()
+                        del running[receiver]
+                        yield _failed_result(job, FIT_TIMEOUT, start)
+
+    finally:
+        # Ensure that no worker processes are left behind if the caller stops early
+        for receiver, (process, job, start) in running.items():
+            _kill_process_group(process)
+            receiver.close()
+
+def _fit_process(job, sender):
+    """Function run in each worker process, returning the result of the fit through a pipe"""
+
+    # Each worker leads its own process group, so that the watchdog can terminate it together
+    # with the multiprocessing Manager process that pyLIMA starts for each fit
+    os.setpgrp()
+
+    sender.send(fit_worker(job))
+    sender.close()
+
+def _kill_process_group(process):
+    """Function to kill a worker process and any processes it has started"""
+
+    try:
+        os.killpg(process.pid, signal.SIGKILL)
+    except (ProcessLookupError, PermissionError):
+        process.kill()
+    process.join()
+
+def _failed_result(job, fit_status, start):
+    """Function to produce the result of a fit that did not complete"""
+
+    return {'name': job['name'], 'fit_status': fit_status, 'model_params': None,
+            'model_lightcurve': None, 'fit_time': datetime.timedelta(seconds=time.monotonic() - start)}
@@ -1,24 +1,141 @@
 import numpy as np
 from os import path
+import os
 from pyLIMA import event
 from pyLIMA import telescopes
-from pyLIMA import toolbox
 from pyLIMA.fits import TRF_fit
-from pyLIMA.fits import stats
 from pyLIMA.models import PSPL_model
-from pyLIMA.outputs import pyLIMA_plots
-from astropy import units as unit
 from astropy.time import Time
 from scipy import stats
+from scipy.optimize import least_squares
 import logging
 from datetime import datetime, timedelta
 from tom_dataproducts.models import ReducedDatum
 import json
+import hashlib
+import multiprocessing
+import psutil
+from collections import OrderedDict
+from django.conf import settings
 from django.db import connection
+from mop.toolbox import pspl_tools, model_lightcurves, utilities
+from mop.toolbox.fit_profiling import fit_stage
 
 
 logger = logging.getLogger(__name__)
 
+# Boundaries of the PSPL model parameters: t0 may lie up to PSPL_T0_MARGIN days after the last
+# datapoint, while u0 and tE are limited to fixed ranges
+PSPL_T0_MARGIN = 10.
+PSPL_U0_BOUNDS = [0.0, 2.0]
+PSPL_TE_BOUNDS = [1., 3000.]
+
+# Photometry within BASELINE_WINDOW tE of t0, or MIN_BASELINE_HALF_WINDOW days if greater, is fitted
+# at full resolution when the baseline is binned
+BASELINE_WINDOW = 5.0
+MIN_BASELINE_HALF_WINDOW = 60.0
+
+# Datapoints deviating by more than CLEAN_NSIGMA from the running median of CLEAN_WINDOW datapoints
+# are rejected as outliers, where those datapoints span no more than CLEAN_MAX_SPAN days
+CLEAN_NSIGMA = 5.0
+CLEAN_WINDOW = 7
+CLEAN_MAX_SPAN = 2.0
+
+# Normality tests applied to the normalized residuals of each fitted model, unless configured otherwise
+# by the FIT_RESIDUAL_TESTS setting: Shapiro-Wilk, Anderson-Darling and Kolmogorov-Smirnov
+RESIDUAL_TESTS = ['SW', 'AD', 'KS']
+
+class FitBudgetExceeded(Exception):
+    """Exception raised when a model fit exceeds its budget of objective function evaluations"""
+    pass
+
+class SpeculativeFit(object):
+    """Model fit started in a subprocess before it is known whether its result will be needed.
+    The result is collected with result(), or the fit abandoned with cancel(), which terminates the
+    subprocess together with any processes it has started.  The subprocess remains in the process
+    group of its parent, so that a fit worker terminated by the watchdog takes it with it.
+    Where processes are spawned rather than forked, the arguments of the fit must be picklable."""
+
+    def __init__(self, function, **kwargs):
+        ctx = multiprocessing.get_context()
+        (self.receiver, sender) = ctx.Pipe(duplex=False)
+
+        # pyLIMA's fit objects start their own multiprocessing Manager, so the subprocess must be non-daemonic
+        self.process = ctx.Process(target=_speculative_fit_process, args=(sender, function, kwargs), daemon=False)
+        self.process.start()
+        sender.close()
+
+    def result(self):
+        """Method to wait for the result of the fit, re-raising any exception raised by the fit"""
+
+        try:
+            (success, value) = self.receiver.recv()
+        except EOFError:
+            raise RuntimeError('Speculative fit process exited without a result')
+        finally:
+            self.receiver.close()
+            self.process.join()
+
+        if not success:
+            raise value
+
+        return value
+
+    def cancel(self):
+        """Method to abandon the fit, if it is still running"""
+
+        if self.process.is_alive():
+            try:
+                children = psutil.Process(self.process.pid).children(recursive=True)
+            except psutil.NoSuchProcess:
+                children = []
+            self.process.kill()
+            for child in children:
+                try:
+                    child.kill()
+                except psutil.NoSuchProcess:
+                    pass
+        self.process.join()
+        self.receiver.close()
+
+def available_cores():
+    """Function to return the number of cores available to this process"""
+
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+def _speculative_fit_process(sender, function, kwargs):
+    """Function run in the subprocess of a SpeculativeFit, returning the result through a pipe"""
+
+    try:
+        result = (True, function(**kwargs))
+    except Exception as e:
+        result = (False, e)
+
+    try:
+        sender.send(result)
+    except Exception as e:
+        sender.send((False, RuntimeError(repr(result[1]) + ' could not be returned: ' + repr(e))))
+    sender.close()
+
+class BudgetTRFfit(TRF_fit.TRFfit):
+    """pyLIMA TRF fit which counts the evaluations of its objective function, and raises
+    FitBudgetExceeded if more than max_nfev are made.  pyLIMA otherwise allows up to 50000."""
+
+    def __init__(self, model, max_nfev=None, **kwargs):
+        super().__init__(model, **kwargs)
+        self.max_nfev = max_nfev
+        self.nfev = 0
+
+    def objective_function(self, fit_process_parameters):
+        self.nfev += 1
+        if self.max_nfev and self.nfev > self.max_nfev:
+            raise FitBudgetExceeded('Fit exceeded ' + str(self.max_nfev) + ' evaluations')
+
+        return super().objective_function(fit_process_parameters)
+
 def chi2(params, fit):
 
     chi2 = np.sum(fit.residuals_LM(params)**2)
@@ -43,7 +160,8 @@ def mag_to_flux(mag):
 
     return flux
 
-def fit_pspl_omega2(ra, dec, datasets, emag_limit=None):
+def fit_pspl_omega2(ra, dec, datasets, emag_limit=None, warm_start=None, linear_fluxes=False, max_nfev=None,
+                    baseline_bin_size=None, speculative_noblend=False):
     """
     Fit photometry using pyLIMAv1.9 with a static PSPL TRF fit
     checking if blend is constrained, if so using a soft_l1 loss function
@@ -55,90 +173,95 @@ def fit_pspl_omega2(ra, dec, datasets, emag_limit=None):
     dec : float, Declination in degrees
     photometry : array containing all telescope passband light curves
     emag_limit : array, limit on the error
+    warm_start : dict, optional parameters of a previous fit to this event, used to seed
+                 the fit, as returned by MicrolensingEvent.get_warm_start_parameters
+    linear_fluxes : bool, switch to optimise only t0, u0 and tE, solving for the fluxes of
+                 each telescope analytically, rather than fitting all parameters with pyLIMA
+    max_nfev : int, optional maximum number of evaluations of the objective function allowed
+                 for each model fit, beyond which FitBudgetExceeded is raised
+    baseline_bin_size : float, optional width of the bins [days] into which the photometry outside
+                 the magnified part of the lightcurve is binned before fitting.  The reduction is
+                 recorded in the Fit_data_reduction of the model parameters.  See reduce_baseline
+    speculative_noblend : bool, switch to start the fit of model 2, without blending, in a subprocess
+                 in parallel with model 1, rather than after it.  Its result is discarded if model 1
+                 does not call for it.  This reduces the latency of the fit at the cost of a second core
 
     Returns
     -------
     to_return : list of arrays containing fit parameters, model_telescope and cost function
     """
     # Fit configuration
-    use_boundaries = True
     verbose = True
 
-    # Initialize the new event to be fitted:
-    current_event = event.Event(ra=ra, dec=dec)
-    current_event.name = 'MOP_to_fit'
-    if verbose: logger.info('FITTOOLS: established event')
-
-    # Using the lightcurves stored in the TOM for this target,
-    # create a list of PyLIMA telescopes, and associate them with the event:
-    tel_list = pylima_telescopes_from_datasets(datasets, emag_limit=emag_limit)
-    for tel in tel_list:
-        current_event.telescopes.append(tel)
-    if verbose: logger.info('FITTOOLS: appended ' + str(len(tel_list)) +' telescopes')
-
-    # The above function imposes a priority order on the list of lightcurves to model,
-    # so the reference dataset will always be the first one
-    current_event.find_survey('Tel_0')
-    current_event.check_event()
-
-    # MODEL 1: PSPL model without parallax
-    pspl = PSPL_model.PSPLmodel(current_event, parallax=['None', 0.])
-    pspl.define_model_parameters()
-    fit_tap = TRF_fit.TRFfit(pspl, loss_function='soft_l1')
-    if verbose: logger.info('FITTOOLS: Set model 1, static PSPL')
-    if use_boundaries:
-        delta_t0 = 10.
-        default_t0_lower = fit_tap.fit_parameters["t0"][1][0]
-        default_t0_upper = fit_tap.fit_parameters["t0"][1][1]
-        fit_tap.fit_parameters["t0"][1] = [default_t0_lower, default_t0_upper + delta_t0]
-        fit_tap.fit_parameters["tE"][1] = [1., 3000.]
-        fit_tap.fit_parameters["u0"][1] = [0.0, 2.0]
-        if verbose: logger.info('FITTOOLS: model 1 fit boundaries: t0: '
-                                + repr(fit_tap.fit_parameters["t0"][1])
-                                + ' tE: ' + repr(fit_tap.fit_parameters["tE"][1])
-                                + ' u0: ' + repr(fit_tap.fit_parameters["u0"][1]))
-    fit_tap.fit()
-    model1_params = gather_model_parameters(current_event, fit_tap)
-    if verbose: logger.info('FITTOOLS: model 1 fitted parameters ' + repr(model1_params))
-
-    # Evaluate the quality of the best-available model.
-    # If the fitted values of key parameters are at the boundaries of then they are considered to
-    # be unreliable, and the fit parameters are reset to nan
-    model1_params = evaluate_model(model1_params)
-    if verbose: logger.info('FITTOOLS: model 1 evaluated parameters ' + repr(model1_params))
+    data_reduction = None
+    if baseline_bin_size:
+        with fit_stage('data_reduction'):
+            (datasets, data_reduction) = reduce_baseline(datasets, baseline_bin_size, warm_start=warm_start,
+                                                         emag_limit=emag_limit)
+
+    # Initialize the new event to be fitted, using the lightcurves stored in the TOM for this target.
+    # A priority order is imposed on the list of lightcurves to model, so the reference dataset
+    # will always be the first one
+    with fit_stage('telescope_build'):
+        current_event = pylima_event_from_datasets(ra, dec, datasets, emag_limit=emag_limit)
+        tel_list = current_event.telescopes
+        if linear_fluxes:
+            lightcurves = select_lightcurves(datasets, emag_limit=emag_limit)
+    if verbose: logger.info('FITTOOLS: established event with ' + str(len(tel_list)) +' telescopes')
+
+    # The speculative fit of model 2 is given the event already prepared for model 1
+    speculative_fit = None
+    if speculative_noblend and available_cores() < 2:
+        if verbose: logger.info('FITTOOLS: Only one core available, fitting model 2 after model 1')
+    elif speculative_noblend:
+        if verbose: logger.info('FITTOOLS: Starting speculative fit of model 2, static PSPL without blending')
+        if linear_fluxes:
+            speculative_fit = SpeculativeFit(fit_static_pspl_linear_fluxes, lightcurves=lightcurves, blend=False,
+                                             warm_start=warm_start, max_nfev=max_nfev, verbose=verbose)
+        else:
+            speculative_fit = SpeculativeFit(fit_static_pspl, current_event=current_event,
+                                             blend_flux_parameter='noblend', warm_start=warm_start,
+                                             max_nfev=max_nfev, verbose=verbose)
 
-    # By default, we accept the results of this first model fit as our best model.
-    # Then we test whether the initial PSPL fit results indicate a low degree of
-    # blend flux.  If so, we attempt to refit the data without blending
-    best_model = model1_params
-    do_noblend_model = test_quality_of_model_fit(model1_params)
-    if verbose: logger.info('FITTOOLS: fit no-blend model? ' + repr(do_noblend_model))
+    try:
+        # MODEL 1: PSPL model without parallax
+        if verbose: logger.info('FITTOOLS: Set model 1, static PSPL')
+        with fit_stage('model_1'):
+            if linear_fluxes:
+                model1_params = fit_static_pspl_linear_fluxes(lightcurves, warm_start=warm_start,
+                                                              max_nfev=max_nfev, verbose=verbose)
+            else:
+                model1_params = fit_static_pspl(current_event, warm_start=warm_start,
+                                                max_nfev=max_nfev, verbose=verbose)
+        if verbose: logger.info('FITTOOLS: model 1 evaluated parameters ' + repr(model1_params))
+
+        # By default, we accept the results of this first model fit as our best model.
+        # Then we test whether the initial PSPL fit results indicate a low degree of
+        # blend flux.  If so, we attempt to refit the data without blending
+        best_model = model1_params
+        do_noblend_model = test_quality_of_model_fit(model1_params)
+        if verbose: logger.info('FITTOOLS: fit no-blend model? ' + repr(do_noblend_model))
+
+        # MODEL 2: PSPL model without blending or parallax
+        if do_noblend_model:
+            if verbose: logger.info('FITTOOLS: Set model 2, static PSPL without blending')
+            with fit_stage('model_2'):
+                if speculative_fit:
+                    model2_params = speculative_fit.result()
+                elif linear_fluxes:
+                    model2_params = fit_static_pspl_linear_fluxes(lightcurves, blend=False, warm_start=warm_start,
+                                                                  max_nfev=max_nfev, verbose=verbose)
+                else:
+                    model2_params = fit_static_pspl(current_event, blend_flux_parameter='noblend',
+                                                    warm_start=warm_start, max_nfev=max_nfev, verbose=verbose)
+            if verbose: logger.info('FITTOOLS: model 2 evaluated parameters ' + repr(model2_params))
+
+    finally:
+        # The speculative fit is abandoned if it was not needed, or if model 1 failed
+        if speculative_fit:
+            speculative_fit.cancel()
 
-    # MODEL 2: PSPL model without blending or parallax
     if do_noblend_model:
-        pspl2 = PSPL_model.PSPLmodel(current_event, parallax=['None', 0.],
-                                    blend_flux_parameter='noblend')
-        pspl2.define_model_parameters()
-        fit_tap2 = TRF_fit.TRFfit(pspl2, loss_function='soft_l1')
-        if verbose: logger.info('FITTOOLS: Set model 2, static PSPL without blending')
-        if use_boundaries:
-            fit_tap2.fit_parameters["t0"][1] = [default_t0_lower, default_t0_upper + delta_t0]
-            fit_tap2.fit_parameters["tE"][1] = [1., 3000.]
-            fit_tap2.fit_parameters["u0"][1] = [0.0, 2.0]
-            if verbose: logger.info('FITTOOLS: model 2 fit boundaries: t0: '
-                                + repr(fit_tap2.fit_parameters["t0"][1])
-                                + ' tE: ' + repr(fit_tap2.fit_parameters["tE"][1])
-                                + ' u0: ' + repr(fit_tap2.fit_parameters["u0"][1]))
-        fit_tap2.fit()
-        model2_params = gather_model_parameters(current_event, fit_tap2)
-        # default null as in the former implementation
-        model2_params['Blend_magnitude'] = np.nan
-        if verbose: logger.info('FITTOOLS: model 2 fitted parameters ' + repr(model2_params))
-
-        # Evaluate the quality of this model
-        model2_params = evaluate_model(model2_params)
-        if verbose: logger.info('FITTOOLS: model 2 evaluated parameters ' + repr(model2_params))
-
         # Decide which fit to accept based on the fitted chi2 in each case.
         # Ordinarily, model1 (with blending, parallax) should produce a lower chi2 because it has more parameters.
         # This test is designed to require evidence that these extra parameters are justified.
@@ -159,9 +282,13 @@ def fit_pspl_omega2(ra, dec, datasets, emag_limit=None):
         else:
             if verbose: logger.info('FITTOOLS: Using model 2 (no blending or parallax) as best-fit model')
 
+    # Record any reduction of the data fitted, replacing that of any previous fit
+    best_model['Fit_data_reduction'] = json.dumps(data_reduction) if data_reduction else ''
+
     # Generate the model lightcurve timeseries with the fitted parameters
     if not np.isnan(best_model['tE']):
-        model_telescope = generate_model_lightcurve(current_event,best_model)
+        with fit_stage('lightcurve_generation'):
+            model_telescope = generate_model_lightcurve(current_event,best_model)
         if verbose: logger.info('FITTOOLS: generated model lightcurve')
     else:
         model_telescope = None
@@ -170,6 +297,464 @@ def fit_pspl_omega2(ra, dec, datasets, emag_limit=None):
     return best_model, model_telescope
 
 
+def fit_static_pspl(current_event, blend_flux_parameter='fblend', warm_start=None, max_nfev=None, verbose=False):
+    """
+    Function to perform a TRF fit of a static PSPL model to a pyLIMA event, with or without blend flux.
+
+    By default, the fit starts from the best point of a coarse grid search within wide parameter
+    boundaries (see grid_search_guess).
+    If the parameters of a previous fit are given as a warm_start, the fit is instead seeded from
+    those parameters, and the boundaries are narrowed around them.  Should the warm-started fit fail
+    the evaluation of the model, the fit is repeated from a cold start.
+
+    Parameters
+    ----------
+    current_event : pyLIMA event, with telescopes and lightcurve data already set
+    blend_flux_parameter : str, pyLIMA blend flux parameterization, 'fblend' or 'noblend'
+    warm_start : dict, optional parameters of a previous fit to this event
+    max_nfev : int, optional maximum number of evaluations of the objective function
+    verbose : bool, switch for logging output
+
+    Returns
+    -------
+    model_params : dict of fitted and evaluated model parameters
+    """
+
+    pspl = PSPL_model.PSPLmodel(current_event, parallax=['None', 0.],
+                                blend_flux_parameter=blend_flux_parameter)
+    pspl.define_model_parameters()
+    fit_tap = BudgetTRFfit(pspl, max_nfev=max_nfev, loss_function='soft_l1')
+
+    # Default fit boundaries
+    default_t0_lower = fit_tap.fit_parameters["t0"][1][0]
+    default_t0_upper = fit_tap.fit_parameters["t0"][1][1]
+    fit_tap.fit_parameters["t0"][1] = [default_t0_lower, default_t0_upper + PSPL_T0_MARGIN]
+    fit_tap.fit_parameters["tE"][1] = list(PSPL_TE_BOUNDS)
+    fit_tap.fit_parameters["u0"][1] = list(PSPL_U0_BOUNDS)
+
+    if warm_start:
+        for key, bounds in warm_start_boundaries(warm_start, fit_tap.fit_parameters).items():
+            fit_tap.fit_parameters[key][1] = bounds
+        fit_tap.model_parameters_guess = [
+            float(np.clip(warm_start[key], fit_tap.fit_parameters[key][1][0], fit_tap.fit_parameters[key][1][1]))
+            for key in ['t0', 'u0', 'tE']
+        ]
+        if verbose: logger.info('FITTOOLS: warm start from ' + repr(fit_tap.model_parameters_guess))
+    else:
+        bounds = np.array([fit_tap.fit_parameters[key][1] for key in ['t0', 'u0', 'tE']], dtype=float)
+        guess = grid_search_guess(pylima_event_lightcurves(current_event), bounds,
+                                  blend=(blend_flux_parameter != 'noblend'))
+        fit_tap.model_parameters_guess = [float(x) for x in guess]
+        if verbose: logger.info('FITTOOLS: grid search start from ' + repr(fit_tap.model_parameters_guess))
+
+    if verbose: logger.info('FITTOOLS: ' + blend_flux_parameter + ' model fit boundaries: t0: '
+                            + repr(fit_tap.fit_parameters["t0"][1])
+                            + ' tE: ' + repr(fit_tap.fit_parameters["tE"][1])
+                            + ' u0: ' + repr(fit_tap.fit_parameters["u0"][1]))
+
+    fit_tap.fit()
+    model_params = gather_model_parameters(current_event, fit_tap)
+    if blend_flux_parameter == 'noblend':
+        # default null as in the former implementation
+        model_params['Blend_magnitude'] = np.nan
+    if verbose: logger.info('FITTOOLS: ' + blend_flux_parameter + ' model fitted parameters ' + repr(model_params))
+
+    # Evaluate the quality of the best-available model.
+    # If the fitted values of key parameters are at the boundaries of then they are considered to
+    # be unreliable, and the fit parameters are reset to nan
+    model_params = evaluate_model(model_params)
+
+    if warm_start and np.isnan(model_params['tE']):
+        if verbose: logger.info('FITTOOLS: warm-started fit failed evaluation, repeating from a cold start')
+        model_params = fit_static_pspl(current_event, blend_flux_parameter=blend_flux_parameter,
+                                       warm_start=None, max_nfev=max_nfev, verbose=verbose)
+
+    return model_params
+
+def grid_search_guess(lightcurves, bounds, blend=True):
+    """
+    Function to choose the starting point of a fit of a static PSPL model to a single event, by evaluating
+    the cost of the model over a coarse grid of (t0, u0, tE), with the fluxes of each telescope solved
+    linearly at each grid point, and then over a finer grid around its best point.  Seeding the fit from
+    the best point of the grid avoids a poor start
+    within the wide default boundaries, from which the fit can take many iterations to converge, or
+    converge on a boundary.  Dense lightcurves are thinned before the search, since the grid is coarse.
+
+    Parameters
+    ----------
+    lightcurves : list of (time, mag, mag_error) arrays for each telescope, the reference dataset first
+    bounds : array of the boundaries of t0, u0 and tE, shape (3, 2)
+    blend : bool, switch to include the blend flux in the model
+
+    Returns
+    -------
+    guess : array of the starting values of t0, u0 and tE
+    """
+
+    packed = pspl_tools.pack_lightcurves([pspl_tools.thin_lightcurves(lightcurves, pspl_tools.GRID_MAX_POINTS)])
+
+    bounds = np.asarray(bounds, dtype=float)[np.newaxis]
+    guess = pspl_tools.batch_initial_guess(packed, bounds, blend=blend,
+                                           u0_values=pspl_tools.GRID_U0_VALUES,
+                                           tE_values=pspl_tools.GRID_TE_VALUES,
+                                           t0_offsets=pspl_tools.GRID_T0_OFFSETS,
+                                           nt0=pspl_tools.GRID_NT0)
+
+    # The search is then repeated on a finer grid centered on the best point of the coarse grid
+    packed['peak_time'] = guess[:, 0]
+    scale = np.array(pspl_tools.GRID_REFINE_FACTORS)
+    guess = pspl_tools.batch_initial_guess(packed, bounds, blend=blend,
+                                           u0_values=guess[0, 1] * scale,
+                                           tE_values=guess[0, 2] * scale,
+                                           t0_offsets=pspl_tools.GRID_REFINE_T0_OFFSETS)
+
+    return guess[0]
+
+def pylima_event_lightcurves(current_event):
+    """Function to extract the lightcurves of the telescopes of a pyLIMA event, as a list of arrays
+    of (time, mag, mag_error) in the order of the telescopes"""
+
+    lightcurves = []
+    for tel in current_event.telescopes:
+        lc = tel.lightcurve_magnitude
+        lightcurves.append(np.c_[lc['time'].value, lc['mag'].value, lc['err_mag'].value])
+
+    return lightcurves
+
+def warm_start_boundaries(warm_start, fit_parameters, nsigma=10.0):
+    """
+    Function to calculate narrowed boundaries for the t0, u0 and tE parameters of a fit, centered on
+    the parameters of a previous fit.  The boundaries span nsigma times the previous fit uncertainty
+    either side of the previous value, subject to a minimum width, and never extend beyond the
+    default boundaries of the fit.
+
+    Parameters
+    ----------
+    warm_start : dict, parameters and uncertainties of a previous fit
+    fit_parameters : dict, pyLIMA fit_parameters holding the default boundaries
+    nsigma : float, number of standard deviations either side of the previous value
+
+    Returns
+    -------
+    bounds : dict of [lower, upper] boundaries for t0, u0 and tE
+    """
+
+    # Minimum half-width of the boundaries, to allow for modest evolution of the model
+    # as new data arrive
+    min_halfwidth = {
+        't0': max(1.0, 0.1 * warm_start['tE']),
+        'u0': max(0.05, 0.5 * warm_start['u0']),
+        'tE': 0.3 * warm_start['tE']
+    }
+
+    bounds = {}
+    for key in ['t0', 'u0', 'tE']:
+        error = warm_start.get(key + '_error', np.nan)
+        if not np.isfinite(error):
+            error = 0.0
+        halfwidth = max(nsigma * error, min_halfwidth[key])
+        lower = max(warm_start[key] - halfwidth, fit_parameters[key][1][0])
+        upper = min(warm_start[key] + halfwidth, fit_parameters[key][1][1])
+
+        # Revert to the default boundaries if the previous value lies outside them
+        if lower >= upper:
+            lower = fit_parameters[key][1][0]
+            upper = fit_parameters[key][1][1]
+        bounds[key] = [lower, upper]
+
+    return bounds
+
+def fit_pspl_batch(jobs, emag_limit=None, batch_size=500, verbose=False):
+    """
+    Function to fit static PSPL models to the lightcurves of many events together, as a faster
+    alternative to fitting each event in turn with fit_pspl_omega2.  The lightcurves of up to batch_size
+    events are packed into arrays and fitted simultaneously with pspl_tools.fit_pspl_batch_arrays,
+    which optimises (t0, u0, tE) while solving for the flux parameters of each telescope analytically.
+
+    The same strategy is applied as in fit_pspl_omega2: a model with blending is fitted first, and for
+    those events where the blend flux is poorly constrained, a model without blending is also fitted and
+    adopted unless the model with blending is significantly better.
+
+    Parameters
+    ----------
+    jobs : list of fit jobs, as produced by fit_workers.build_fit_job
+    emag_limit : float, optional limit on the photometric uncertainty of datapoints to include
+    batch_size : int, maximum number of events to fit simultaneously
+    verbose : bool, switch for logging output
+
+    Returns
+    -------
+    results : list of dicts of the event name, model parameters and model lightcurve arrays for each job,
+              in the same form as returned by fit_workers.fit_worker
+    """
+
+    results = []
+    for i in range(0, len(jobs), batch_size):
+        results += fit_pspl_batch_chunk(jobs[i:i+batch_size], emag_limit=emag_limit, verbose=verbose)
+
+    return results
+
+def fit_pspl_batch_chunk(jobs, emag_limit=None, verbose=False):
+    """Function to fit static PSPL models to a set of events simultaneously.  See fit_pspl_batch."""
+
+    t1 = datetime.utcnow()
+
+    # Select the lightcurve data to be fitted, with the reference dataset first for each event
+    event_lightcurves = [select_lightcurves(job['datasets'], emag_limit=emag_limit) for job in jobs]
+
+    # Model 1 with blending, applied to all events
+    model1 = fit_pspl_batch_model(event_lightcurves, blend=True)
+    best_models = list(model1)
+
+    # Model 2 without blending, for those events where the blend flux is not well constrained
+    noblend_index = [i for i, params in enumerate(model1)
+                     if params is not None and test_quality_of_model_fit(params)]
+    if verbose: logger.info('FITTOOLS: batch fitting no-blend models for ' + str(len(noblend_index))
+                            + ' of ' + str(len(jobs)) + ' events')
+
+    if len(noblend_index) > 0:
+        model2 = fit_pspl_batch_model([event_lightcurves[i] for i in noblend_index], blend=False)
+
+        for i, model2_params in zip(noblend_index, model2):
+            if model2_params is None:
+                continue
+            delta_chi2 = model2_params['chi2'] - model1[i]['chi2']
+            dchi2_threshold = stats.chi2.ppf(0.9973, len(event_lightcurves[i]))
+            if not delta_chi2 >= dchi2_threshold:
+                best_models[i] = model2_params
+
+    results = []
+    for job, lightcurves, model_params in zip(jobs, event_lightcurves, best_models):
+        result = {'name': job['name'], 'model_params': model_params, 'model_lightcurve': None}
+
+        # Batch fits always use the full photometry
+        if model_params is not None:
+            model_params['Fit_data_reduction'] = ''
+
+        if model_params is not None and not np.isnan(model_params['tE']):
+            (t0, u0, tE, fs, fb) = pspl_tools.event_parameters(model_params)
+            model_time = pspl_tools.adaptive_time_grid(
+                t0, u0, tE, fs, fb, data_times=np.concatenate([lc[:, 0] for lc in lightcurves]),
+                tolerance=getattr(settings, 'MODEL_LIGHTCURVE_TOLERANCE', 0.001))
+            magnitude = pspl_tools.model_magnitude(model_time, t0, u0, tE, fs, fb)
+            mask = np.isfinite(magnitude)
+            result['model_lightcurve'] = (model_time[mask], magnitude[mask])
+
+        results.append(result)
+
+    if verbose: logger.info('FITTOOLS: batch fitted ' + str(len(jobs)) + ' events in '
+                            + str(datetime.utcnow() - t1))
+
+    return results
+
+def fit_pspl_batch_model(event_lightcurves, blend=True):
+    """
+    Function to fit a static PSPL model, with or without blend flux, to the lightcurves of a set of events
+    simultaneously, and to gather and evaluate the model parameters of each event.
+
+    Parameters
+    ----------
+    event_lightcurves : list of lists of (time, mag, mag_error) arrays for each telescope of each event
+    blend : bool, switch to include the blend flux in the model
+
+    Returns
+    -------
+    model_params : list of dicts of the model parameters of each event, or None for events with
+                   insufficient data
+    """
+
+    nflux = 2 if blend else 1
+    valid = [len(lcs) > 0 and np.sum([len(lc) for lc in lcs]) > 3 + nflux * len(lcs)
+             for lcs in event_lightcurves]
+    fit_lightcurves = [lcs for lcs, ok in zip(event_lightcurves, valid) if ok]
+
+    model_params = [None] * len(event_lightcurves)
+    if len(fit_lightcurves) == 0:
+        return model_params
+
+    packed = pspl_tools.pack_lightcurves(fit_lightcurves)
+    bounds = np.array([default_pspl_boundaries(lcs) for lcs in fit_lightcurves])
+
+    guess = pspl_tools.batch_initial_guess(packed, bounds, blend=blend)
+    fit = pspl_tools.fit_pspl_batch_arrays(packed, bounds, guess, blend=blend)
+
+    j = 0
+    for i, ok in enumerate(valid):
+        if not ok:
+            continue
+        lcs = fit_lightcurves[j]
+
+        params = linear_flux_model_parameters(lcs, fit['t0'][j], fit['u0'][j], fit['tE'][j],
+                                              fit['fs'][j], fit['fb'][j], bounds[j], blend=blend)
+
+        model_params[i] = evaluate_model(params)
+        j += 1
+
+    return model_params
+
+def select_lightcurves(datasets, emag_limit=None):
+    """Function to select the lightcurve data of an event to be fitted, returning a list of
+    arrays of (time, mag, mag_error) for each non-empty dataset, with the reference dataset first"""
+
+    lightcurves = []
+    for name in order_datasets(datasets):
+        photometry = datasets[name]
+        lc = photometry[photometry_mask(photometry, emag_limit=emag_limit)].astype(float)
+        if len(lc) > 0:
+            lightcurves.append(lc[:, 0:3])
+
+    return lightcurves
+
+def default_pspl_boundaries(lightcurves):
+    """Function to return the default boundaries of the t0, u0 and tE parameters of a PSPL fit
+    to a set of lightcurves, as an array of shape (3, 2), matching those applied to fits with pyLIMA"""
+
+    bounds = np.array([
+        [min([lc[:, 0].min() for lc in lightcurves]), max([lc[:, 0].max() for lc in lightcurves]) + PSPL_T0_MARGIN],
+        PSPL_U0_BOUNDS,
+        PSPL_TE_BOUNDS
+    ])
+
+    return bounds
+
+def linear_flux_fit_parameters(lightcurves, bounds, blend=True):
+    """Function to describe the parameters of a PSPL model fitted with analytic fluxes, following
+    pyLIMA's conventions for the fit_parameters dictionary of index and boundaries of each parameter"""
+
+    fit_parameters = OrderedDict()
+    for i, key in enumerate(['t0', 'u0', 'tE']):
+        fit_parameters[key] = [i, tuple(bounds[i])]
+    for k, lc in enumerate(lightcurves):
+        max_flux = pspl_tools.mag_to_flux(lc[:, 1]).max()
+        fit_parameters['fsource_Tel_' + str(k)] = [len(fit_parameters), (0.0, max_flux)]
+        if blend:
+            fit_parameters['fblend_Tel_' + str(k)] = [len(fit_parameters), (-max_flux, max_flux)]
+
+    return fit_parameters
+
+def linear_flux_model_parameters(lightcurves, t0, u0, tE, fs, fb, bounds, blend=True):
+    """
+    Function to gather the model parameters of a PSPL model fitted with analytic fluxes, in the same
+    form as gather_model_parameters, including the covariance of the flux parameters.
+
+    Parameters
+    ----------
+    lightcurves : list of (time, mag, mag_error) arrays for each telescope, the reference dataset first
+    t0, u0, tE : float, fitted PSPL parameters
+    fs, fb : arrays of the source and blend flux for each telescope
+    bounds : array of the boundaries of t0, u0 and tE, shape (3, 2)
+    blend : bool, switch indicating whether the blend flux was fitted
+
+    Returns
+    -------
+    model_params : dict of model parameters
+    """
+
+    fit_parameters = linear_flux_fit_parameters(lightcurves, bounds, blend=blend)
+    best_model = [t0, u0, tE]
+    for k in range(len(lightcurves)):
+        best_model.append(fs[k])
+        if blend:
+            best_model.append(fb[k])
+
+    covariance = pspl_tools.pspl_covariance(lightcurves, t0, u0, tE, fs, fb, blend=blend)
+
+    chi2 = 0.0
+    with fit_stage('residual_stats'):
+        for k, lc in enumerate(lightcurves):
+            flux = pspl_tools.mag_to_flux(lc[:, 1])
+            flux_err = lc[:, 2] * flux * np.log(10.0) / 2.5
+            chi = (flux - pspl_tools.model_flux(lc[:, 0], t0, u0, tE, fs[k], fb[k])) / flux_err
+            chi2 += np.sum(chi**2)
+            if k == 0:
+                normalized_residuals = chi
+    ndata = np.sum([len(lc) for lc in lightcurves])
+
+    model_params = model_parameters_from_fit(list(fit_parameters.keys()), best_model, covariance,
+                                             chi2, ndata, fit_parameters, normalized_residuals)
+    if not blend:
+        model_params['Blend_magnitude'] = np.nan
+
+    return model_params
+
+def fit_static_pspl_linear_fluxes(lightcurves, blend=True, warm_start=None, max_nfev=None, verbose=False):
+    """
+    Function to fit a static PSPL model, with or without blend flux, in which only t0, u0 and tE are
+    optimised by TRF, while the source and blend fluxes of every telescope are solved by weighted
+    linear least squares at each step.  The dimension of the non-linear problem is therefore independent
+    of the number of datasets.  The boundaries, loss function, grid search seeding and warm start follow
+    fit_static_pspl.
+
+    Parameters
+    ----------
+    lightcurves : list of (time, mag, mag_error) arrays for each telescope, the reference dataset first
+    blend : bool, switch to include the blend flux in the model
+    warm_start : dict, optional parameters of a previous fit to this event
+    max_nfev : int, optional maximum number of evaluations of the objective function
+    verbose : bool, switch for logging output
+
+    Returns
+    -------
+    model_params : dict of fitted and evaluated model parameters
+    """
+
+    packed = pspl_tools.pack_lightcurves([lightcurves])
+    ntel = len(lightcurves)
+    time = packed['time']
+    flux = packed['flux']
+    weight = packed['weight']
+    tel = packed['tel']
+    sigma_inv = np.sqrt(weight)
+
+    bounds = default_pspl_boundaries(lightcurves)
+    if warm_start:
+        fit_parameters = linear_flux_fit_parameters(lightcurves, bounds, blend=blend)
+        for i, (key, key_bounds) in enumerate(warm_start_boundaries(warm_start, fit_parameters).items()):
+            bounds[i] = key_bounds
+        guess = np.clip([warm_start[key] for key in ['t0', 'u0', 'tE']], bounds[:, 0], bounds[:, 1])
+        if verbose: logger.info('FITTOOLS: warm start from ' + repr(guess))
+    else:
+        guess = grid_search_guess(lightcurves, bounds, blend=blend)
+        if verbose: logger.info('FITTOOLS: grid search start from ' + repr(guess))
+
+    def model(p):
+        A, dA = pspl_tools.magnification_derivatives(time, p[0], p[1], p[2])
+        (fs, fb) = pspl_tools.solve_linear_fluxes(A, flux, weight, tel, ntel, blend=blend)
+        return A, dA, fs, fb
+
+    def residuals(p):
+        (A, dA, fs, fb) = model(p)
+        fit_flux = fs[0, tel[0]] * A[0] + fb[0, tel[0]]
+        return np.nan_to_num((flux[0] - fit_flux) * sigma_inv[0], nan=1e10)
+
+    def jacobian(p):
+        (A, dA, fs, fb) = model(p)
+        fs_pt = np.take_along_axis(fs, tel, axis=1)
+        J = [pspl_tools.project_flux_basis(-fs_pt * np.nan_to_num(d) * sigma_inv, np.nan_to_num(A) * sigma_inv,
+                                           sigma_inv, tel, ntel, blend=blend)[0] for d in dA]
+        return np.stack(J, axis=-1)
+
+    scaling = (bounds[:, 1] - bounds[:, 0]) / 2.0
+    trf_fit = least_squares(residuals, guess, jac=jacobian, method='trf', bounds=(bounds[:, 0], bounds[:, 1]),
+                            loss='soft_l1', x_scale=scaling, xtol=10**-10, ftol=10**-10, gtol=10**-10,
+                            max_nfev=max_nfev if max_nfev else 50000)
+    if trf_fit['status'] == 0:
+        raise FitBudgetExceeded('Fit exceeded ' + str(trf_fit['nfev']) + ' evaluations')
+    (t0, u0, tE) = trf_fit['x']
+    (A, dA, fs, fb) = model(trf_fit['x'])
+    if verbose: logger.info('FITTOOLS: linear-flux ' + ('fblend' if blend else 'noblend') + ' fit completed in '
+                            + str(trf_fit['nfev']) + ' evaluations')
+
+    model_params = linear_flux_model_parameters(lightcurves, t0, u0, tE, fs[0], fb[0], bounds, blend=blend)
+    model_params = evaluate_model(model_params)
+
+    if warm_start and np.isnan(model_params['tE']):
+        if verbose: logger.info('FITTOOLS: warm-started fit failed evaluation, repeating from a cold start')
+        model_params = fit_static_pspl_linear_fluxes(lightcurves, blend=blend, warm_start=None,
+                                                     max_nfev=max_nfev, verbose=verbose)
+
+    return model_params
+
 def repackage_lightcurves(qs):
     """Function to sort through a QuerySet of the ReducedDatums for a given event and repackage the data as a
      dictionary of individual lightcurves in PyLIMA-compatible format for different facilities.
@@ -178,22 +763,27 @@ def repackage_lightcurves(qs):
 
     datasets = {}
 
-    for rd in qs:
-        if rd.data_type == 'photometry' and rd.source_name != 'Interferometry_predictor':
-            # Identify different lightcurves from the filter label given
-            passband = rd.value['filter']
-            if passband in datasets.keys():
-                lc = datasets[passband]
-            else:
-                lc = []
+    photometry = [rd for rd in qs
+                  if rd.data_type == 'photometry' and rd.source_name != 'Interferometry_predictor']
 
-            # Append the datapoint to the corresponding dataset
-            try:
-                lc.append([Time(rd.timestamp).jd, rd.value['magnitude'], rd.value['error']])
-            except:
-                lc.append([Time(rd.timestamp).jd, rd.value['magnitude'], 1.0])
+    # The timestamps of all datapoints are converted together
+    time = utilities.datetimes_to_jd([rd.timestamp for rd in photometry]).tolist()
+
+    for jd, rd in zip(time, photometry):
+        # Identify different lightcurves from the filter label given
+        passband = rd.value['filter']
+        if passband in datasets.keys():
+            lc = datasets[passband]
+        else:
+            lc = []
+
+        # Append the datapoint to the corresponding dataset
+        try:
+            lc.append([jd, rd.value['magnitude'], rd.value['error']])
+        except:
+            lc.append([jd, rd.value['magnitude'], 1.0])
 
-            datasets[passband] = lc
+        datasets[passband] = lc
 
     # Count the total number of datapoints available, and convert the
     # accumulated lightcurves into numpy arrays:
@@ -204,14 +794,64 @@ def repackage_lightcurves(qs):
 
     return datasets, ndata
 
-def pylima_telescopes_from_datasets(datasets, emag_limit=None):
-    """Function to convert the dictionary of datasets retrieved from MOP of the lightcurves for this object,
-    and convert them into PyLIMA Telescope objects.
-    This function returns a list of Telescope objects containing the lightcurve data, applying an
-    order of preference, so that prioritized datasets occur at the start of the list.
+def fit_configuration(emag_limit=None):
+    """Function to describe the configuration of the model fit applied to an event's lightcurve.
+    This is combined with the photometry into the fingerprint of each fit, so that any change to the
+    configuration invalidates previous fits"""
+
+    fit_config = {
+        'model': 'PSPL_omega2',
+        'emag_limit': emag_limit
+    }
+
+    return fit_config
+
+def clean_configuration(nsigma=CLEAN_NSIGMA, window=CLEAN_WINDOW, max_span=CLEAN_MAX_SPAN):
+    """Function to describe the configuration of the cleaning applied to an event's lightcurves.
+    This is combined with the photometry into the fingerprint of its cleaned lightcurves"""
+
+    clean_config = {
+        'clean': 'clean_datasets',
+        'nsigma': nsigma,
+        'window': window,
+        'max_span': max_span
+    }
+
+    return clean_config
+
+def photometry_fingerprint(datasets, fit_config=None):
+    """Function to calculate a content hash of the per-passband lightcurve arrays returned by
+    repackage_lightcurves, together with the configuration of the model fit.
+    Two sets of photometry produce the same fingerprint only if they contain identical datapoints,
+    regardless of the order in which they were retrieved from the database.
+
+    Parameters:
+        datasets    dict    Lightcurve arrays indexed by passband
+        fit_config  dict    Fit configuration, as returned by fit_configuration
+
+    Returns:
+        fingerprint str     Hexadecimal SHA-256 digest
     """
 
-    # Sort the available datasets into order, giving preference to main survey datasets
+    if not fit_config:
+        fit_config = fit_configuration()
+
+    digest = hashlib.sha256()
+    digest.update(json.dumps(fit_config, sort_keys=True).encode('utf-8'))
+
+    for passband in sorted(datasets.keys()):
+        lc = np.array(datasets[passband], dtype=float)
+        if len(lc) > 0:
+            lc = lc[np.lexsort(lc.T[::-1])]
+        digest.update(passband.encode('utf-8'))
+        digest.update(np.ascontiguousarray(lc).tobytes())
+
+    return digest.hexdigest()
+
+def order_datasets(datasets):
+    """Function to sort the names of the datasets available for an event into order of preference,
+    giving preference to main survey datasets, so that the first dataset is used as the reference"""
+
     priority_order = ['I', 'ip', 'i_ZTF', 'r_ZTF', 'R', 'g_ZTF', 'gp', 'G']
 
     dataset_order = []
@@ -224,21 +864,257 @@ def pylima_telescopes_from_datasets(datasets, emag_limit=None):
         if name not in dataset_order:
             dataset_order.append(name)
 
-    # Loop over all available datasets and create a telescope object for each one
-    tel_list = []
-    for idx, name in enumerate(dataset_order):
-        photometry = datasets[name]
+    return dataset_order
 
-        # Enabling optional filtering for datapoints of low photometric precision
-        if emag_limit:
+def photometry_mask(photometry, emag_limit=None):
+    """Function to select the datapoints of a lightcurve array to be included in a model fit,
+    enabling optional filtering for datapoints of low photometric precision"""
 
-            mask = (np.abs(photometry[:, -2].astype(float)) < emag_limit)
+    if emag_limit:
 
-        else:
+        mask = (np.abs(photometry[:, -2].astype(float)) < emag_limit)
+
+    else:
+
+        mask = (np.abs(photometry[:, -2].astype(float)) < 99.0)
+
+    return mask
+
+def clean_lightcurve(lc, nsigma=CLEAN_NSIGMA, window=CLEAN_WINDOW, max_span=CLEAN_MAX_SPAN):
+    """
+    Function to identify the valid datapoints of a lightcurve array of (time, mag, mag_error).
+    Datapoints are rejected if:
+    - any of their values are not finite, their uncertainty is not positive, or their magnitude or
+      uncertainty takes a placeholder value of 99 or more
+    - they duplicate the timestamp of another datapoint, in which case that with the smallest
+      uncertainty is retained
+    - they deviate from the running median of the surrounding window of datapoints by more than nsigma
+      times their uncertainty, combined with the robust scatter of the lightcurve about its running median.
+      Only windows spanning no more than max_span days are considered, so that sparsely-sampled
+      lightcurves are not clipped.  Since a genuine peak may be sharper than the running median,
+      datapoints brighter than the median are only rejected if neither neighbouring datapoint is
+      also significantly brighter.
+
+    Parameters:
+        lc          array   Lightcurve
+        nsigma      float   Rejection threshold
+        window      int     Odd number of datapoints in the running median
+        max_span    float   Maximum time span of the running median window [days]
+
+    Returns:
+        mask        array   Boolean array, True for the datapoints to be retained
+        rejected    dict    Number of datapoints rejected as invalid, duplicates and outliers
+    """
+
+    lc = np.asarray(lc, dtype=float)[:, 0:3]
+    mask = np.zeros(len(lc), dtype=bool)
+    with np.errstate(invalid='ignore'):
+        valid = np.isfinite(lc).all(axis=1) & (lc[:, 2] > 0.0) & (lc[:, 1] < 99.0) & (lc[:, 2] < 99.0)
+
+    # Sort the valid datapoints by time, then by uncertainty, retaining the first of any
+    # datapoints with the same timestamp
+    order = np.lexsort((lc[:, 2], lc[:, 0]))
+    order = order[valid[order]]
+    order = order[np.r_[True, np.diff(lc[order, 0]) > 0.0]]
+    mask[order] = True
+    rejected = {'invalid': int((~valid).sum()), 'duplicate': int(valid.sum() - len(order)), 'outlier': 0}
+
+    half = window // 2
+    if len(order) < window:
+        return mask, rejected
+
+    (time, mags, errs) = lc[order].T
+    mag_windows = np.lib.stride_tricks.sliding_window_view(np.pad(mags, half, mode='edge'), window)
+    time_windows = np.lib.stride_tricks.sliding_window_view(np.pad(time, half, mode='edge'), window)
+    residuals = mags - np.median(mag_windows, axis=1)
+    local = (time_windows[:, -1] - time_windows[:, 0]) <= max_span
+
+    if local.sum() < window:
+        return mask, rejected
+
+    scatter = 1.4826 * np.median(np.abs(residuals[local] - np.median(residuals[local])))
+    deviation = residuals / np.sqrt(errs**2 + scatter**2)
+
+    faint = deviation > nsigma
+    bright = deviation < -nsigma
+    bright_neighbour = np.r_[False, deviation[:-1] < -nsigma / 2.0] | np.r_[deviation[1:] < -nsigma / 2.0, False]
+    outlier = local & (faint | (bright & ~bright_neighbour))
+
+    mask[order[outlier]] = False
+    rejected['outlier'] = int(outlier.sum())
 
-            mask = (np.abs(photometry[:, -2].astype(float)) < 99.0)
+    return mask, rejected
 
-        lightcurve = photometry[mask].astype(float)
+def clean_datasets(datasets, nsigma=CLEAN_NSIGMA, window=CLEAN_WINDOW, max_span=CLEAN_MAX_SPAN):
+    """
+    Function to remove invalid, duplicate and outlying datapoints from each of an event's lightcurves.
+    See clean_lightcurve.
+
+    Parameters:
+        datasets    dict    Lightcurve arrays indexed by passband
+
+    Returns:
+        cleaned     dict    Lightcurve arrays of (time, mag, mag_error) indexed by passband, in time order
+        rejected    dict    Number of datapoints rejected as invalid, duplicates and outliers
+    """
+
+    cleaned = {}
+    rejected = {'invalid': 0, 'duplicate': 0, 'outlier': 0}
+    for name, photometry in datasets.items():
+        if len(photometry) == 0:
+            cleaned[name] = photometry
+            continue
+
+        (mask, dataset_rejected) = clean_lightcurve(photometry, nsigma=nsigma, window=window, max_span=max_span)
+        lc = np.asarray(photometry, dtype=float)[mask, 0:3]
+        cleaned[name] = lc[np.argsort(lc[:, 0])]
+        for key, value in dataset_rejected.items():
+            rejected[key] += value
+
+    return cleaned, rejected
+
+def estimate_event_window(datasets, warm_start=None, emag_limit=None):
+    """
+    Function to estimate the time range over which an event's photometry is magnified, and must be
+    fitted at full resolution.
+
+    If a previous model is available as a warm_start, the window spans BASELINE_WINDOW tE either side
+    of its t0.  Otherwise, t0 is estimated from the peak of the reference lightcurve, and the window
+    spans twice the duration for which the lightcurve remains significantly brighter than its baseline
+    either side of the peak.  In both cases the window extends at least MIN_BASELINE_HALF_WINDOW either
+    side of t0.
+
+    Parameters:
+        datasets    dict    Lightcurve arrays indexed by passband
+        warm_start  dict    Optional parameters of a previous fit to this event
+        emag_limit  float   Optional limit on the photometric uncertainty of datapoints
+
+    Returns:
+        t0          float   Estimated time of peak [JD]
+        half_window float   Half-width of the window [days]
+    """
+
+    if warm_start and np.isfinite(warm_start.get('t0', np.nan)) and np.isfinite(warm_start.get('tE', np.nan)):
+        return warm_start['t0'], max(BASELINE_WINDOW * warm_start['tE'], MIN_BASELINE_HALF_WINDOW)
+
+    lightcurves = select_lightcurves(datasets, emag_limit=emag_limit)
+    if len(lightcurves) == 0:
+        return np.nan, np.nan
+
+    ref = lightcurves[0]
+    (time, mags) = pspl_tools.smoothed_lightcurve(ref)
+    ipeak = np.argmin(mags)
+    t0 = time[ipeak]
+
+    # The magnified part of the lightcurve extends either side of the peak until the lightcurve
+    # returns to the baseline for several consecutive datapoints, so that it is not extended by
+    # isolated outliers
+    nbaseline = 5
+    threshold = max(0.1, 3.0 * np.median(ref[:, 2]))
+    baseline = (mags >= np.median(mags) - threshold).astype(int)
+    run_start = np.where(np.convolve(baseline, np.ones(nbaseline, dtype=int), mode='valid') == nbaseline)[0]
+
+    after = run_start[run_start > ipeak]
+    before = run_start[run_start + nbaseline - 1 < ipeak]
+    t_end = time[after[0]] if len(after) > 0 else time[-1]
+    t_start = time[before[-1] + nbaseline - 1] if len(before) > 0 else time[0]
+
+    half_window = max(2.0 * max(t_end - t0, t0 - t_start), MIN_BASELINE_HALF_WINDOW)
+
+    return t0, half_window
+
+def bin_lightcurve(lc, bin_size):
+    """
+    Function to bin a lightcurve array of (time, mag, mag_error), by inverse-variance weighted
+    averaging of the fluxes of the datapoints in each time bin.
+
+    Parameters:
+        lc          array   Lightcurve
+        bin_size    float   Width of the bins [days]
+
+    Returns:
+        binned      array   Lightcurve of (time, mag, mag_error), with the weighted mean time of each bin
+    """
+
+    flux = pspl_tools.mag_to_flux(lc[:, 1])
+    weight = 1.0 / (lc[:, 2] * flux * np.log(10.0) / 2.5)**2
+
+    (bins, index) = np.unique(np.floor((lc[:, 0] - lc[:, 0].min()) / bin_size), return_inverse=True)
+    sum_weight = np.bincount(index, weights=weight)
+    bin_time = np.bincount(index, weights=weight * lc[:, 0]) / sum_weight
+    bin_flux = np.bincount(index, weights=weight * flux) / sum_weight
+    bin_flux_error = 1.0 / np.sqrt(sum_weight)
+
+    binned = np.c_[bin_time, pspl_tools.flux_to_mag(bin_flux), 2.5 / np.log(10.0) * bin_flux_error / bin_flux]
+
+    return binned
+
+def reduce_baseline(datasets, bin_size, warm_start=None, emag_limit=None):
+    """
+    Function to reduce the number of datapoints of an event to be fitted, by binning the photometry
+    of each dataset outside the window where the event is magnified, as estimated by
+    estimate_event_window.  The baseline photometry constrains only the baseline fluxes, so
+    binning it has little effect on the fitted model, while the cost of a fit scales with the number
+    of datapoints.  Datapoints excluded by the emag_limit are removed.
+
+    Parameters:
+        datasets    dict    Lightcurve arrays indexed by passband
+        bin_size    float   Width of the baseline bins [days], e.g. 1 for nightly or 7 for weekly bins
+        warm_start  dict    Optional parameters of a previous fit to this event
+        emag_limit  float   Optional limit on the photometric uncertainty of datapoints
+
+    Returns:
+        reduced     dict    Lightcurve arrays indexed by passband
+        reduction   dict    Summary of the reduction: the number of datapoints before and after,
+                            the window fitted at full resolution and the bin size
+    """
+
+    (t0, half_window) = estimate_event_window(datasets, warm_start=warm_start, emag_limit=emag_limit)
+
+    reduced = {}
+    ndata = 0
+    for name, photometry in datasets.items():
+        lc = photometry[photometry_mask(photometry, emag_limit=emag_limit)][:, 0:3].astype(float)
+        ndata += len(photometry)
+
+        # Datapoints without a valid uncertainty cannot be weighted, and are not binned
+        valid = np.isfinite(lc[:, 2]) & (lc[:, 2] > 0.0)
+        baseline = valid & (np.abs(lc[:, 0] - t0) > half_window) if np.isfinite(t0) else np.zeros(len(lc), dtype=bool)
+
+        if baseline.sum() > 1:
+            lc = np.r_[lc[~baseline], bin_lightcurve(lc[baseline], bin_size)]
+            lc = lc[np.argsort(lc[:, 0])]
+        reduced[name] = lc
+
+    reduction = {
+        'ndata': int(ndata),
+        'ndata_fit': int(sum([len(lc) for lc in reduced.values()])),
+        't0': float(t0),
+        'half_window': float(half_window),
+        'bin_size': float(bin_size)
+    }
+
+    logger.info('FITTOOLS: Binned baseline photometry in ' + str(bin_size) + 'd bins outside '
+                + str(round(t0, 2)) + ' +/- ' + str(round(half_window, 1)) + 'd, reducing '
+                + str(reduction['ndata']) + ' to ' + str(reduction['ndata_fit']) + ' datapoints')
+
+    return reduced, reduction
+
+def pylima_telescopes_from_datasets(datasets, emag_limit=None):
+    """Function to convert the dictionary of datasets retrieved from MOP of the lightcurves for this object,
+    and convert them into PyLIMA Telescope objects.
+    This function returns a list of Telescope objects containing the lightcurve data, applying an
+    order of preference, so that prioritized datasets occur at the start of the list.
+    """
+
+    dataset_order = order_datasets(datasets)
+
+    # Loop over all available datasets and create a telescope object for each one
+    tel_list = []
+    for idx, name in enumerate(dataset_order):
+        photometry = datasets[name]
+
+        mask = photometry_mask(photometry, emag_limit=emag_limit)
 
         # Treating all sites as ground-based without coordinates
         tel = telescopes.Telescope(name='Tel_'+str(idx), camera_filter=name,
@@ -249,6 +1125,22 @@ def pylima_telescopes_from_datasets(datasets, emag_limit=None):
 
     return tel_list
 
+def pylima_event_from_datasets(ra, dec, datasets, emag_limit=None, event_class=event.Event):
+    """Function to create a pyLIMA Event for the lightcurves of a target, with the telescopes returned by
+    pylima_telescopes_from_datasets, so that the reference dataset is the first telescope.  A subclass of
+    the pyLIMA Event may be given as the event_class"""
+
+    current_event = event_class(ra=ra, dec=dec)
+    current_event.name = 'MOP_to_fit'
+
+    for tel in pylima_telescopes_from_datasets(datasets, emag_limit=emag_limit):
+        current_event.telescopes.append(tel)
+
+    current_event.find_survey('Tel_0')
+    current_event.check_event()
+
+    return current_event
+
 def store_model_lightcurve(target, model):
     """Function to store in the TOM the timeseries lihgtcurve corresponding to a fitted model.
     The input is a model fit object from PyLIMA"""
@@ -257,10 +1149,8 @@ def store_model_lightcurve(target, model):
     model_time = datetime.strptime('2018-06-29 08:15:27.243860', '%Y-%m-%d %H:%M:%S.%f')
 
     # Extract the model lightcurve timeseries from the PyLIMA fit object
-    data = {
-        'lc_model_time': model.lightcurve_magnitude['time'].value.tolist(),
-        'lc_model_magnitude': model.lightcurve_magnitude['mag'].value.tolist()
-        }
+    data = model_lightcurves.encode_model_lightcurve(model.lightcurve_magnitude['time'].value,
+                                                     model.lightcurve_magnitude['mag'].value)
 
     # Search MOP to see if an existing model is already stored
     existing_model = ReducedDatum.objects.filter(source_name='MOP',data_type='lc_model',
@@ -333,6 +1223,48 @@ def gather_model_parameters(pevent, model_fit):
     # list of key indices
     param_keys = list(model_fit.fit_parameters.keys())
 
+    ndata = 0
+    for i,tel in enumerate(pevent.telescopes):
+        ndata += len(tel.lightcurve_magnitude)
+
+    # The model_fit.model_residuals returns photometric and astrometric residuals as a dictionary
+    # while the photometric residuals provides a list of arrays consisting of the
+    # photometric residuals and their errors for each telescope.  The model is evaluated once,
+    # and these residuals used for both the chi2, reporting its actual value instead of the value
+    # of the loss function, and the statistics of the reference dataset's residuals.
+    # None of the models fitted rescale the photometric uncertainties
+    with fit_stage('residual_stats'):
+        (residuals, errors) = model_fit.model_residuals(model_fit.fit_results['best_model'])
+        chi = [np.ravel(res) / np.ravel(err) for res, err in zip(residuals['photometry'], errors['photometry'])]
+        chi2 = np.sum([np.sum(c**2) for c in chi])
+        normalized_residuals = chi[0] if len(chi) > 0 else None
+
+    model_params = model_parameters_from_fit(param_keys, model_fit.fit_results["best_model"],
+                                             model_fit.fit_results["covariance_matrix"], chi2, ndata,
+                                             model_fit.fit_parameters, normalized_residuals)
+
+    return model_params
+
+def model_parameters_from_fit(param_keys, best_model, covariance, chi2, ndata, fit_parameters,
+                              normalized_residuals):
+    """
+    Function to gather the results of a model fit into the dictionary of model parameters used by MOP.
+    This is independent of the fitting engine used.
+
+    Parameters:
+        param_keys              list    Names of the fitted parameters, in pyLIMA nomenclature and order
+        best_model              list    Fitted values of the parameters
+        covariance              array   Covariance matrix of the fitted parameters
+        chi2                    float   Chi squared of the fitted model
+        ndata                   int     Number of datapoints fitted
+        fit_parameters          dict    pyLIMA-style dictionary of the index and boundaries of each parameter
+        normalized_residuals    array   Residuals of the reference dataset, normalized by their uncertainties,
+                                        or None if not available
+
+    Returns:
+        model_params            dict    Model parameters
+    """
+
     model_params = {}
 
     for i, key in enumerate(param_keys):
@@ -340,12 +1272,9 @@ def gather_model_parameters(pevent, model_fit):
             ndp = 3
         else:
             ndp = 5
-        model_params[key] = np.around(model_fit.fit_results["best_model"][i], ndp)
-        model_params[key+'_error'] = np.around(np.sqrt(model_fit.fit_results["covariance_matrix"][i,i]), ndp)
+        model_params[key] = np.around(best_model[i], ndp)
+        model_params[key+'_error'] = np.around(np.sqrt(covariance[i,i]), ndp)
 
-    # model_params['chi2'] = np.around(model_fit.fit_results["best_model"][-1], 3)
-    # Reporting actual chi2 instead value of the loss function
-    (chi2, pyLIMA_parameters) = model_fit.model_chi2(model_fit.fit_results["best_model"])
     model_params['chi2'] = np.around(chi2, 3)
 
     # If the model did not include parallax, zero those parameters
@@ -356,9 +1285,6 @@ def gather_model_parameters(pevent, model_fit):
         model_params['piEE_error'] = 0.0
 
     # Calculate the reduced chi2
-    ndata = 0
-    for i,tel in enumerate(pevent.telescopes):
-        ndata += len(tel.lightcurve_magnitude)
     model_params['red_chi2'] = np.around(model_params['chi2'] / float(ndata - len(param_keys)),3)
 
     # Retrieve the flux parameters, converting from PyLIMA's key nomenclature to MOPs
@@ -371,7 +1297,7 @@ def gather_model_parameters(pevent, model_fit):
     for pylima_key,mop_key in key_map.items():
         try:
             idx = param_keys.index(pylima_key)
-            model_params[mop_key] = np.around(flux_to_mag(model_fit.fit_results["best_model"][idx]), 3)
+            model_params[mop_key] = np.around(flux_to_mag(best_model[idx]), 3)
             flux_index.append(idx)
         except ValueError:
             model_params[mop_key] = np.nan
@@ -393,8 +1319,7 @@ def gather_model_parameters(pevent, model_fit):
     # use these to calculate the baseline magnitude.  Otherwise, use the source magnitude
     if not np.isnan(model_params['Source_magnitude']) \
            and not np.isnan(model_params['Blend_magnitude']):
-        unlensed_flux = model_fit.fit_results["best_model"][flux_index[0]] \
-                            + model_fit.fit_results["best_model"][flux_index[1]]
+        unlensed_flux = best_model[flux_index[0]] + best_model[flux_index[1]]
         unlensed_flux_error = np.sqrt(
                                 (model_params['fsource_Tel_0_error']**2 + model_params['fblend_Tel_0_error']**2)
                                 + (model_params['fsource_Tel_0_error']*model_params['fblend_Tel_0_error'])
@@ -405,35 +1330,63 @@ def gather_model_parameters(pevent, model_fit):
         model_params['Baseline_magnitude'] = model_params['Source_magnitude']
         model_params['Baseline_mag_error'] = model_params['Source_mag_error']
 
-    model_params['Fit_covariance'] = model_fit.fit_results["covariance_matrix"]
+    model_params['Fit_covariance'] = covariance
 
-    model_params['fit_parameters'] = model_fit.fit_parameters
+    model_params['fit_parameters'] = fit_parameters
 
-    # Calculate fit statistics
-    # The model_fit.model_residuals returns photometric and astrometric residuals as a dictionary
-    # while the photometric residuals provides a list of arrays consisting of the
-    # photometric residuals, photometric errors, and error_flux
-    try:
-        res = model_fit.model_residuals(model_fit.fit_results['best_model'])
-        sw_test = stats.normal_Shapiro_Wilk(
-            (np.ravel(res[0]['photometry'][0]) / np.ravel(res[1]['photometry'][0])))
-        model_params['SW_test'] = np.around(sw_test[0],3)
-        ad_test = stats.normal_Anderson_Darling(
-            (np.ravel(res[0]['photometry'][0]) / np.ravel(res[1]['photometry'][0])))
-        model_params['AD_test'] = np.around(ad_test[0],3)
-        ks_test = stats.normal_Kolmogorov_Smirnov(
-            (np.ravel(res[0]['photometry'][0]) / np.ravel(res[1]['photometry'][0])))
-        model_params['KS_test'] = np.around(ks_test[0],3)
-        model_params['chi2_dof'] = np.sum((np.ravel(res[0]['photometry'][0]) / np.ravel(res[1]['photometry'][0])) ** 2) / (
-                len(np.ravel(res[0]['photometry'][0])) - 5)
-    except:
-        model_params['SW_test'] = np.nan
-        model_params['AD_test'] = np.nan
-        model_params['KS_test'] = np.nan
-        model_params['chi2_dof'] = np.nan
+    # Calculate fit statistics, if enabled by the FIT_RESIDUAL_STATISTICS setting.  Otherwise they are
+    # reported as NaN
+    with fit_stage('residual_stats'):
+        if getattr(settings, 'FIT_RESIDUAL_STATISTICS', False):
+            model_params.update(residual_statistics(normalized_residuals))
+        else:
+            model_params.update(residual_statistics(None))
 
     return model_params
 
+def residual_statistics(normalized_residuals, tests=None):
+    """
+    Function to calculate the statistics of the normalized residuals of a fitted model, comparing
+    their distribution with a normal distribution of zero mean and unit variance.  The residual array
+    is shared between all of the tests.
+
+    Parameters:
+        normalized_residuals    array   Residuals normalized by their uncertainties, or None
+        tests                   list    Normality tests to apply, any of RESIDUAL_TESTS.  Defaults to
+                                        the FIT_RESIDUAL_TESTS setting
+
+    Returns:
+        statistics              dict    Statistic of each test, as SW_test, AD_test and KS_test,
+                                        and chi2_dof.  Statistics which are not calculated are NaN
+    """
+
+    if tests is None:
+        tests = getattr(settings, 'FIT_RESIDUAL_TESTS', RESIDUAL_TESTS)
+
+    statistics = {'SW_test': np.nan, 'AD_test': np.nan, 'KS_test': np.nan, 'chi2_dof': np.nan}
+
+    if normalized_residuals is None:
+        return statistics
+    normalized_residuals = np.asarray(normalized_residuals, dtype=float)
+    normalized_residuals = normalized_residuals[np.isfinite(normalized_residuals)]
+    if len(normalized_residuals) <= 5:
+        return statistics
+
+    statistics['chi2_dof'] = np.sum(normalized_residuals**2) / (len(normalized_residuals) - 5)
+
+    # The Shapiro-Wilk p-value is unreliable for large samples, but only the statistic is used
+    try:
+        if 'SW' in tests:
+            statistics['SW_test'] = np.around(stats.shapiro(normalized_residuals)[0], 3)
+        if 'AD' in tests:
+            statistics['AD_test'] = np.around(stats.anderson(normalized_residuals)[0], 3)
+        if 'KS' in tests:
+            statistics['KS_test'] = np.around(stats.kstest(normalized_residuals, 'norm', args=(0, 1))[0], 3)
+    except ValueError as e:
+        logger.warning('FITTOOLS: Unable to calculate residual statistics: ' + repr(e))
+
+    return statistics
+
 def test_quality_of_model_fit(model_params):
     """Function to evaluate whether the initial model fit indicates a low degree of
     blend flux.  If so, this criterion is used to determine whether to attempt
@@ -489,34 +1442,29 @@ def evaluate_model(best_model, verbose=False):
     return best_model
 
 def generate_model_lightcurve(pevent, model_params):
-    """Function to generate a photometric timeseries corresponding to the given model parameters"""
-
-    pyLIMA_plots.list_of_fake_telescopes = []
-
-    # This doesn't include parallax right now, since none of the fitted models do either yet
-    pspl = PSPL_model.PSPLmodel(pevent, parallax=['None', 0.])
-
-    params = []
-    parameters = ['t0', 'u0', 'tE', 'Source_magnitude', 'Blend_magnitude']
-    for key in parameters:
-        value = model_params[key]
-        if 'magnitude' in key:
-            if not np.isnan(value):
-                value = mag_to_flux(value)
-            else:
-                value = 0.0
-        params.append(value)
-    pyLIMA_parameters = pspl.compute_pyLIMA_parameters(params)
-
-    model_telescope = pyLIMA_plots.create_telescopes_to_plot_model(pspl, pyLIMA_parameters)[0]
-
-    flux_model = pspl.compute_the_microlensing_model(model_telescope, pyLIMA_parameters)['photometry']
-
-    magnitude = toolbox.brightness_transformation.flux_to_magnitude(flux_model)
-
-    model_telescope.lightcurve_magnitude["mag"] = magnitude * unit.mag
-
-    mask = ~np.isnan(magnitude)
-    model_telescope.lightcurve_magnitude = model_telescope.lightcurve_magnitude[mask]
-
-    return model_telescope
\ No newline at end of file
+    """Function to generate a photometric timeseries corresponding to the given model parameters.
+    The model is evaluated directly with numpy, on an adaptive time grid spanning the data, which is dense
+    only where needed to reproduce the model to within the MODEL_LIGHTCURVE_TOLERANCE, and returned as a
+    pyLIMA Telescope, in the passband of the reference dataset"""
+
+    # This doesn't include parallax, see parallax_fits.generate_parallax_model_lightcurve for parallax models
+    (t0, u0, tE, fs, fb) = pspl_tools.event_parameters(model_params)
+
+    data_times = [tel.lightcurve_magnitude['time'].value for tel in pevent.telescopes
+                  if tel.location == 'Earth' and tel.lightcurve_magnitude is not None]
+    if len(data_times) > 0:
+        data_times = np.concatenate(data_times)
+    model_time = pspl_tools.adaptive_time_grid(t0, u0, tE, fs, fb, data_times=data_times,
+                                               tolerance=getattr(settings, 'MODEL_LIGHTCURVE_TOLERANCE', 0.001))
+
+    magnitude = pspl_tools.model_magnitude(model_time, t0, u0, tE, fs, fb)
+    mask = np.isfinite(magnitude)
+
+    model_telescope = telescopes.Telescope(name=pevent.telescopes[0].name,
+                                           camera_filter=pevent.telescopes[0].filter,
+                                           light_curve=np.c_[model_time[mask], magnitude[mask],
+                                                             [0.1] * mask.sum()],
+                                           light_curve_names=['time', 'mag', 'err_mag'],
+                                           light_curve_units=['JD', 'mag', 'err_mag'])
+
+    return model_telescope
@@ -3,7 +3,7 @@ from django.conf import settings
 from astropy.coordinates import SkyCoord
 from astropy import units as u
 from mop.brokers import gaia, gsc
-from mop.toolbox import utilities
+from mop.toolbox import utilities, model_lightcurves
 import numpy as np
 import matplotlib.pyplot as plt
 from astroquery.vizier import Vizier
@@ -553,22 +553,49 @@ def predict_period_above_brightness_threshold(target, Kbase, Kthreshold=14.0):
     # This calculation can only be made if a valid model has been fitted
     if qs.count() > 0 and not np.isnan(mag_base) and mag_base > 0.0:
 
-        ts = np.array(qs[0].value['lc_model_time'])
-        mags = np.array(qs[0].value['lc_model_magnitude'])
+        (model_ts, model_mags) = model_lightcurves.decode_model_lightcurve(qs[0].value)
 
         # Estimate the K-band lightcurve
-        Klc = Kbase + (mags - mag_base)
+        Klc = Kbase + (model_mags - mag_base)
 
         # Calulate how many days the lightcurve spends brighter than Kthreshold
-        idx = np.where(Klc <= Kthreshold)[0]
-
-        if len(idx) > 0 and len(idx) < len(mags):
-            interval = ts[idx].max() - ts[idx].min()
-        elif len(idx) > 0 and len(idx) == len(mags):
-            interval = np.inf
+        interval = period_above_threshold(model_ts, Klc, Kthreshold)
 
     return interval
 
+def period_above_threshold(ts, mags, threshold):
+    """
+    Function to calculate the time between the first and last points at which a lightcurve is
+    brighter than a threshold.  The crossings of the threshold are bracketed by the timestamps of the
+    lightcurve, and located by interpolating linearly between them, so that a lightcurve stored on an
+    adaptive time grid does not need to be resampled.
+
+    Parameters:
+        ts          array   Timestamps of the lightcurve, in time order
+        mags        array   Magnitudes of the lightcurve
+        threshold   float   Threshold magnitude
+
+    Returns:
+        interval    float   Period brighter than the threshold [days], np.inf if the lightcurve is brighter
+                            than the threshold throughout, or np.nan if it is never brighter
+    """
+
+    idx = np.where(mags <= threshold)[0]
+
+    if len(idx) == 0:
+        return np.nan
+    if len(idx) == len(mags):
+        return np.inf
+
+    def crossing(i, j):
+        return ts[i] + (threshold - mags[i]) * (ts[j] - ts[i]) / (mags[j] - mags[i])
+
+    (first, last) = (idx.min(), idx.max())
+    t_start = crossing(first - 1, first) if first > 0 else ts[first]
+    t_end = crossing(last, last + 1) if last < len(mags) - 1 else ts[last]
+
+    return t_end - t_start
+
 def gravity_target_selection(target, Kpeak, interval, gsc_table, Kthreshold=14.0):
 
     # Count the numbers of AO and FT stars
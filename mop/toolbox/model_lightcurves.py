@@ -0,0 +1,110 @@
+from django.conf import settings
+import numpy as np
+import base64
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Encoding of the compact model lightcurve format.  Timestamps are stored as the first timestamp,
+# followed by the differences between successive timestamps, quantized to TIME_RESOLUTION and
+# stored as 32-bit integers.  Magnitudes are stored as 32-bit floats.  Both arrays are stored as
+# base64-encoded little-endian bytes
+COMPACT_ENCODING = 'delta_int32_float32_base64'
+
+# Resolution of the timestamps of compact model lightcurves [days]
+TIME_RESOLUTION = 1e-5
+
+def encode_model_lightcurve(model_times, model_mags, compact=None):
+    """
+    Function to encode a model lightcurve into the value dictionary of a ReducedDatum of
+    data_type 'lc_model'.
+
+    Parameters:
+        model_times array   Timestamps of the model lightcurve in ascending order [JD]
+        model_mags  array   Model magnitudes
+        compact     bool    Switch to use the compact encoding rather than lists of floats.  Defaults
+                            to the MODEL_LIGHTCURVE_COMPACT setting
+
+    Returns:
+        data        dict    Encoded model lightcurve
+    """
+
+    if compact is None:
+        compact = getattr(settings, 'MODEL_LIGHTCURVE_COMPACT', True)
+
+    model_times = np.asarray(model_times, dtype=float)
+    model_mags = np.asarray(model_mags, dtype=float)
+
+    if not compact or len(model_times) == 0:
+        return {
+            'lc_model_time': list(map(float, model_times)),
+            'lc_model_magnitude': list(map(float, model_mags))
+        }
+
+    # Quantizing the timestamps before differencing them means that the rounding errors do not
+    # accumulate along the lightcurve
+    steps = np.round((model_times - model_times[0]) / TIME_RESOLUTION).astype(np.int64)
+    deltas = np.diff(steps, prepend=0)
+    if np.abs(deltas).max() > np.iinfo(np.int32).max:
+        logger.warning('MODEL_LIGHTCURVES: Model lightcurve timestamps too widely spaced for the compact encoding')
+        return encode_model_lightcurve(model_times, model_mags, compact=False)
+    deltas = deltas.astype('<i4')
+
+    data = {
+        'lc_model_encoding': COMPACT_ENCODING,
+        'lc_model_npoints': int(len(model_times)),
+        'lc_model_time_start': float(model_times[0]),
+        'lc_model_time': base64.b64encode(deltas.tobytes()).decode('ascii'),
+        'lc_model_magnitude': base64.b64encode(model_mags.astype('<f4').tobytes()).decode('ascii')
+    }
+
+    return data
+
+def decode_model_lightcurve(data):
+    """
+    Function to decode the model lightcurve stored in the value dictionary of a ReducedDatum of
+    data_type 'lc_model', in either the compact or the list encoding.
+
+    Parameters:
+        data        dict    Encoded model lightcurve
+
+    Returns:
+        model_times array   Timestamps of the model lightcurve [JD]
+        model_mags  array   Model magnitudes
+    """
+
+    encoding = data.get('lc_model_encoding')
+
+    if encoding is None:
+        return (np.array(data['lc_model_time'], dtype=float),
+                np.array(data['lc_model_magnitude'], dtype=float))
+
+    if encoding != COMPACT_ENCODING:
+        raise ValueError('Unknown model lightcurve encoding ' + repr(encoding))
+
+    deltas = np.frombuffer(base64.b64decode(data['lc_model_time']), dtype='<i4')
+    model_times = data['lc_model_time_start'] + np.cumsum(deltas, dtype=np.int64) * TIME_RESOLUTION
+    model_mags = np.frombuffer(base64.b64decode(data['lc_model_magnitude']), dtype='<f4').astype(float)
+
+    return model_times, model_mags
+
+def model_magnitude_at(data, times):
+    """
+    Function to estimate the magnitude of a stored model lightcurve at the given times, by
+    interpolating between the timestamps of the model.  The model lightcurve is sampled finely
+    enough that interpolation reproduces the model to within the tolerance of its time grid.
+
+    Parameters:
+        data        dict    Encoded model lightcurve
+        times       float or array  Timestamps at which to estimate the magnitude [JD]
+
+    Returns:
+        mags        float or array  Model magnitudes.  Outside the range of the model lightcurve,
+                                    the magnitude at the nearest end is returned
+    """
+
+    (model_times, model_mags) = decode_model_lightcurve(data)
+    if len(model_times) == 0:
+        return np.full(np.shape(times), np.nan) if np.ndim(times) else np.nan
+
+    return np.interp(times, model_times, model_mags)
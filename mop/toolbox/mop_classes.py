@@ -1,9 +1,10 @@
 from tom_dataproducts.models import ReducedDatum
 from tom_targets.models import Target,TargetExtra
-from astropy.time import Time
-from mop.toolbox import fittools
+from django.db.models import Q
+from mop.toolbox import fittools, model_lightcurves, fit_profiling, photometry_cache, utilities
 from datetime import datetime
 import json
+import numpy as np
 import logging
 
 logger = logging.getLogger(__name__)
@@ -11,10 +12,52 @@ logger = logging.getLogger(__name__)
 class MicrolensingEvent():
     """
     Superclass designed to consolidate data associated with a single microlensing event in a 
-    form convenient for processing
+    form convenient for processing.
+
+    The event's attributes are held in slots rather than a per-instance dictionary, so that large sets
+    of events can be held in memory.  TargetExtras with numerical values are stored as floats, while
+    any TargetExtras without a slot of their own are held in the other_params dictionary.  The event's
+    photometry, model lightcurve and tabular data products, and the TargetExtra instances themselves,
+    are only retrieved from the database when they are first accessed, unless they have already been
+    provided.
     """
 
+    # TargetExtras with numerical values, which are stored as floats
+    NUMERIC_PARAMETERS = (
+        't0', 't0_error', 'u0', 'u0_error', 'tE', 'tE_error',
+        'piEN', 'piEN_error', 'piEE', 'piEE_error', 'rho', 'rho_error',
+        's', 's_error', 'q', 'q_error', 'alpha', 'alpha_error',
+        'Source_magnitude', 'Source_mag_error', 'Blend_magnitude', 'Blend_mag_error',
+        'Baseline_magnitude', 'Baseline_mag_error',
+        'TAP_priority', 'TAP_priority_error', 'TAP_priority_longtE', 'TAP_priority_longtE_error',
+        'Mag_now', 'Last_fit', 'chi2', 'red_chi2', 'KS_test', 'AD_test', 'SW_test'
+    )
+
+    # TargetExtras used by the pipeline which are stored as given
+    STRING_PARAMETERS = (
+        'Alive', 'Classification', 'Category', 'Sky_location',
+        'Fit_covariance', 'Fit_fingerprint', 'Parallax_fingerprint', 'Fit_data_reduction'
+    )
+
+    # Attributes derived from the event's photometry, which are loaded together on first access
+    PHOTOMETRY_ATTRIBUTES = ('datasets', 'ndata', 'first_observation', 'last_observation')
+
+    # Data products held as ReducedDatums, indexed by attribute name, with their data_type and source_name
+    DATA_PRODUCTS = {
+        'existing_model': ('lc_model', None),
+        'neighbours': ('tabular', 'Interferometry_predictor'),
+        'gsc_results': ('tabular', 'GSC_query_results'),
+        'aoft_table': ('tabular', 'AOFT_table')
+    }
+
+    __slots__ = (
+        'name', 'target', 'ra', 'dec', 'galactic_lat', 'galactic_lng', 'targetnames',
+        'clean_datasets', 'fit_profile', 'pylima_model', 'need_to_fit', 'other_params', '_extras'
+    ) + PHOTOMETRY_ATTRIBUTES + tuple(DATA_PRODUCTS.keys()) + NUMERIC_PARAMETERS + STRING_PARAMETERS
+
     def __init__(self, t):
+        self.other_params = {}
+        self._extras = None
         self.name = t.name
         self.target = t
         try:
@@ -32,76 +75,195 @@ class MicrolensingEvent():
             self.galactic_lat = None
             self.galactic_lng = None
         self.targetnames = []
-        self.red_data = None
-        self.extras = None
+        self.clean_datasets = None
         self.Last_fit = None
-        self.first_observation = None
-        self.last_observation = None
-        self.existing_model = None
-        self.neighbours = None
-        self.gsc_results = None
-        self.aoft_table = None
         self.pylima_model = None
         self.need_to_fit = True
 
     def __str__(self):
         return str(self.name)
 
+    def __getattr__(self, name):
+        """Called only for attributes which have not been set, to load them on demand"""
+
+        if name in MicrolensingEvent.PHOTOMETRY_ATTRIBUTES:
+            self.load_photometry()
+        elif name in MicrolensingEvent.DATA_PRODUCTS:
+            self.load_data_products()
+        elif name == 'fit_profile':
+            self.fit_profile = fit_profiling.FitProfile()
+        else:
+            try:
+                return object.__getattribute__(self, 'other_params')[name]
+            except KeyError:
+                raise AttributeError('MicrolensingEvent has no attribute ' + name)
+
+        return object.__getattribute__(self, name)
+
+    def __setattr__(self, name, value):
+        # Attributes without a slot, such as TargetExtras not used by the pipeline, are held
+        # in the other_params dictionary
+        try:
+            object.__setattr__(self, name, value)
+        except AttributeError:
+            self.other_params[name] = value
+
+    @property
+    def extras(self):
+        """TargetExtras of this event indexed by key, retrieved from the database on first access"""
+
+        if self._extras is None:
+            self._extras = {par.key: par for par in TargetExtra.objects.filter(target=self.target)}
+        return self._extras
+
+    @extras.setter
+    def extras(self, value):
+        self._extras = value
+
     def set_extra_params(self, qs):
         """Extracts the key, value pairs from a QuerySet of ExtraFields and sets them as
-        attributes of the Event"""
-        self.extras = {}
+        attributes of the Event.  Numerical parameters are converted to floats, where possible"""
+
         for par in qs:
-            setattr(self, par.key, par.value)
-            self.extras[par.key] = par
+            value = par.value
+            if par.key in MicrolensingEvent.NUMERIC_PARAMETERS:
+                try:
+                    value = float(value)
+                except (TypeError, ValueError):
+                    pass
+            setattr(self, par.key, value)
 
     def set_target_names(self, qs):
         """Attributes the names associated with this target"""
         for name in qs:
             self.targetnames.append(name.name)
 
-    def set_reduced_data(self, qs):
+    def set_reduced_data(self, qs, photometry=None):
         """Extracts the timeseries data from a QuerySet of ReducedDatums, and
-        creates the necessary arrays"""
+        creates the necessary arrays.  If the event's photometry is given, as held in the
+        photometry cache, the lightcurves are unpacked from it instead, and the QuerySet
+        need not include the photometric ReducedDatums.  The ReducedDatums themselves are
+        not retained."""
+
+        (self.datasets, self.ndata, self.first_observation, self.last_observation) = \
+            self.extract_photometry(qs, photometry=photometry)
+
+    def extract_photometry(self, qs, photometry=None):
+        """Method to unpack the lightcurves of this event from a QuerySet of ReducedDatums or
+        from its cached photometry.
+
+        Returns:
+            datasets            dict    Lightcurve arrays indexed by passband
+            ndata               int     Total number of datapoints
+            first_observation   float   Timestamp of the first photometric datapoint [JD], or None
+            last_observation    float   Timestamp of the last photometric datapoint [JD], or None
+        """
+
+        # The time taken to load the data is recorded in the profile of the event's next fit
+        with self.fit_profile.stage('data_load'):
+            if photometry is not None:
+                return photometry_cache.unpack_photometry(photometry)
+
+            # Unpack the lightcurve data:
+            (datasets, ndata) = fittools.repackage_lightcurves(qs)
 
-        # Store the complete set of results
-        self.red_data = qs
+            # Extract the timestamps of the first and last observations.  Only these two
+            # timestamps need to be converted to JD
+            timestamps = [i.timestamp for i in qs if i.data_type == 'photometry']
+            if len(timestamps) > 0:
+                (first_observation, last_observation) = \
+                    utilities.datetimes_to_jd([min(timestamps), max(timestamps)]).tolist()
+            else:
+                first_observation = None
+                last_observation = None
+
+        return datasets, ndata, first_observation, last_observation
 
-        # Unpack the lightcurve data:
-        (self.datasets, self.ndata) = fittools.repackage_lightcurves(self.red_data)
+    def load_photometry(self):
+        """Method to load the lightcurves of this event, from the photometry cache if possible and
+        otherwise from the database.  Only those photometric attributes which have not already been
+        set are loaded"""
 
-        # Extract the timestamp of the last observation
-        time = [Time(i.timestamp).jd for i in self.red_data if i.data_type == 'photometry']
-        if len(time) > 0:
-            self.first_observation = min(time)
-            self.last_observation = max(time)
+        (photometry, generations) = photometry_cache.lookup_photometry([self.target])
+        entry = photometry.get(self.target.pk)
+        if entry is not None:
+            values = self.extract_photometry([], photometry=entry)
         else:
-            self.first_observation = None
-            self.last_observation = None
+            qs = ReducedDatum.objects.filter(target=self.target, data_type='photometry').order_by('timestamp')
+            values = self.extract_photometry(qs)
+            photometry_cache.store_photometry({
+                self.target: photometry_cache.pack_photometry(values[0], values[2], values[3],
+                                                              generation=generations.get(self.target.pk))
+            })
+
+        for name, value in zip(MicrolensingEvent.PHOTOMETRY_ATTRIBUTES, values):
+            try:
+                object.__getattribute__(self, name)
+            except AttributeError:
+                setattr(self, name, value)
 
-        # Identify any pre-existing datasets of specific categories, if available
-        for dset in qs:
-            if dset.data_type == 'lc_model':
-                self.existing_model = dset
+    def load_data_products(self):
+        """Method to retrieve the model lightcurve and tabular data products of this event with a
+        single query.  Only those data products which have not already been set are loaded"""
 
-            if dset.data_type == 'tabular' and dset.source_name == 'Interferometry_predictor':
-                self.neighbours = dset
+        selection = Q()
+        for (data_type, source_name) in MicrolensingEvent.DATA_PRODUCTS.values():
+            if source_name:
+                selection |= Q(data_type=data_type, source_name=source_name)
+            else:
+                selection |= Q(data_type=data_type)
+
+        products = dict.fromkeys(MicrolensingEvent.DATA_PRODUCTS.keys())
+        for dset in ReducedDatum.objects.filter(selection, target=self.target).order_by('timestamp'):
+            for name, (data_type, source_name) in MicrolensingEvent.DATA_PRODUCTS.items():
+                if dset.data_type == data_type and source_name in [None, dset.source_name]:
+                    products[name] = dset
 
-            if dset.data_type == 'tabular' and dset.source_name == 'GSC_query_results':
-                self.gsc_results = dset
+        for name, dset in products.items():
+            try:
+                object.__getattribute__(self, name)
+            except AttributeError:
+                setattr(self, name, dset)
 
-            if dset.data_type == 'tabular' and dset.source_name == 'AOFT_table':
-                self.aoft_table = dset
+    def get_clean_datasets(self):
+        """Method to return this event's lightcurves with invalid, duplicate and outlying datapoints
+        removed, as used for model fitting.  The result is computed once for each set of lightcurves,
+        and cached under the fingerprint of the photometry so that other processes can re-use it"""
 
-            if self.existing_model and self.neighbours \
-                    and self.gsc_results and self.aoft_table:
-                break
+        if self.clean_datasets is None or self.clean_datasets[0] is not self.datasets:
+            with self.fit_profile.stage('data_clean'):
+                fingerprint = fittools.photometry_fingerprint(self.datasets,
+                                                              fit_config=fittools.clean_configuration())
+                cached = photometry_cache.lookup_clean_datasets(fingerprint)
+                if cached:
+                    (cleaned, rejected) = cached
+                else:
+                    (cleaned, rejected) = fittools.clean_datasets(self.datasets)
+                    photometry_cache.store_clean_datasets(fingerprint, cleaned, rejected)
+            self.clean_datasets = (self.datasets, cleaned)
+            if sum(rejected.values()) > 0:
+                logger.info('MicrolensingEvent: Rejected datapoints of ' + self.name + ' before fitting: '
+                            + repr(rejected))
 
-    def check_need_to_fit(self):
+        return self.clean_datasets[1]
+
+    def photometry_fingerprint(self, fit_config=None):
+        """Method to calculate the fingerprint of this event's photometry and the fit configuration"""
+
+        return fittools.photometry_fingerprint(self.datasets, fit_config=fit_config)
+
+    def check_need_to_fit(self, fit_config=None):
         reason = 'OK'
 
         if self.last_observation:
-            if self.Last_fit:
+            # If the photometry and fit configuration are identical to those of the last fit,
+            # re-fitting would reproduce the same model
+            stored_fingerprint = getattr(self, 'Fit_fingerprint', None)
+            if stored_fingerprint and stored_fingerprint == self.photometry_fingerprint(fit_config=fit_config):
+                self.need_to_fit = False
+                reason = 'Photometry unchanged since last fit'
+
+            elif self.Last_fit:
                 if (float(self.last_observation) < float(self.Last_fit)):
                     self.need_to_fit = False
                     reason = 'Up to date model'
@@ -115,18 +277,41 @@ class MicrolensingEvent():
 
         return self.need_to_fit, reason
 
+    def get_warm_start_parameters(self):
+        """Method to extract the parameters of the previous model fit to this event, in a form
+        that can be used to seed a new fit.  Returns None if no valid previous fit is available"""
+
+        warm_start = {}
+        for key in ['t0', 'u0', 'tE', 't0_error', 'u0_error', 'tE_error']:
+            try:
+                warm_start[key] = float(getattr(self, key))
+            except (AttributeError, TypeError, ValueError):
+                warm_start[key] = np.nan
+
+        # A previous fit is only useful if the key parameters were successfully constrained
+        for key in ['t0', 'u0', 'tE']:
+            if not np.isfinite(warm_start[key]) or warm_start[key] <= 0.0:
+                return None
+
+        return warm_start
+
     def store_model_lightcurve(self, model):
         """Method to store in the TOM the timeseries lihgtcurve corresponding to a fitted model.
         The input is a model fit object from PyLIMA"""
 
+        self.store_model_lightcurve_arrays(
+            model.lightcurve_magnitude['time'].value,
+            model.lightcurve_magnitude['mag'].value
+        )
+
+    def store_model_lightcurve_arrays(self, model_times, model_mags):
+        """Method to store in the TOM the timeseries lightcurve corresponding to a fitted model,
+        given as arrays of timestamps (JD) and magnitudes.  See model_lightcurves for the encoding"""
+
         # Why is this timestamp hardwired?
         model_time = datetime.strptime('2018-06-29 08:15:27.243860', '%Y-%m-%d %H:%M:%S.%f')
 
-        # Extract the model lightcurve timeseries from the PyLIMA fit object
-        data = {
-            'lc_model_time': model.lightcurve_magnitude['time'].value.tolist(),
-            'lc_model_magnitude': model.lightcurve_magnitude['mag'].value.tolist()
-        }
+        data = model_lightcurves.encode_model_lightcurve(model_times, model_mags)
 
         # If there is no existing model for this target, create one
         if not self.existing_model:
@@ -165,12 +350,17 @@ class MicrolensingEvent():
                       'Fit_covariance', 'chi2', 'red_chi2',
                       'KS_test', 'AD_test', 'SW_test']
 
+        # Parameters which are only stored if provided
+        optional_parameters = ['Fit_fingerprint', 'Fit_data_reduction']
+        parameters += [key for key in optional_parameters if key in model_params.keys()]
+
         for key in parameters:
+            if key == 'Fit_covariance':
+                data = json.dumps(model_params['Fit_covariance'].tolist())
+            else:
+                data = model_params[key]
+            setattr(self, key, data)
             if key in self.extras.keys():
-                if key == 'Fit_covariance':
-                    data = json.dumps(model_params['Fit_covariance'].tolist())
-                else:
-                    data = model_params[key]
                 self.extras[key].value = data
                 self.extras[key].save()
             else:
@@ -0,0 +1,336 @@
+from django.conf import settings
+from django.db import transaction
+from pyLIMA import event
+from pyLIMA.models import PSPL_model
+from pyLIMA.parallax import parallax
+from pyLIMA import telescopes
+from scipy import stats
+from mop.models import ParallaxEphemeris
+from mop.toolbox import fittools, pspl_tools
+from mop.toolbox.fit_profiling import fit_stage
+import numpy as np
+import base64
+import json
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Category of the events to which the parallax model is fitted, as assigned by
+# TAP.categorize_event_timescale
+PARALLAX_CATEGORY = 'Microlensing long-tE'
+
+# Parallax model fitted.  MOP treats all datasets as ground-based without site coordinates, so only
+# the annual parallax due to the orbital motion of the Earth is modeled
+PARALLAX_MODEL = 'Annual'
+
+# Boundaries of the components of the parallax vector
+PIE_BOUNDS = [-1.0, 1.0]
+
+# Version of the ephemeris calculation.  This should be incremented whenever a change would alter the
+# cached positions of the Earth, so that those cached by earlier versions are not re-used
+EPHEMERIS_VERSION = 1
+
+class ParallaxEvent(event.Event):
+    """
+    pyLIMA Event which computes the parallax of its telescopes from the projected positions of the
+    Earth held in its earth_positions, if given, rather than computing the Earth's ephemeris for every
+    datapoint whenever a parallax model is defined.  earth_positions is a dictionary of arrays of the
+    North and East projected positions of the Earth [AU] at the times of each telescope's photometry,
+    indexed by telescope name, as returned by earth_projected_positions
+    """
+
+    def __init__(self, ra=266.416792, dec=-29.007806):
+        super().__init__(ra=ra, dec=dec)
+        self.earth_positions = None
+
+    def compute_parallax_all_telescopes(self, parallax_model):
+        if self.earth_positions is None or parallax_model[0] != PARALLAX_MODEL:
+            return super().compute_parallax_all_telescopes(parallax_model)
+
+        for tel in self.telescopes:
+            time = tel.lightcurve_flux['time'].value
+            tel.Earth_positions_projected['photometry'] = self.earth_positions[tel.name]
+            tel.deltas_positions['photometry'] = annual_parallax_offsets(
+                time, self.earth_positions[tel.name], parallax_model[1], self.North, self.East)
+
+def earth_projected_positions(current_event):
+    """
+    Function to calculate the positions of the Earth at the times of the photometry of each telescope
+    of a pyLIMA event, projected onto the North and East directions on the sky at the event.
+
+    Parameters:
+        current_event   Event   pyLIMA event, with its telescopes set
+
+    Returns:
+        positions       dict    Arrays of shape (2, ndata) of the North and East projected positions [AU],
+                                indexed by telescope name
+    """
+
+    positions = {}
+    for tel in current_event.telescopes:
+        (earth_positions, earth_speeds) = parallax.Earth_ephemerides(tel.lightcurve_flux['time'].value)
+        positions[tel.name] = np.array([np.dot(earth_positions, current_event.North),
+                                        np.dot(earth_positions, current_event.East)])
+
+    return positions
+
+def annual_parallax_offsets(time, earth_positions, t0_par, North, East):
+    """
+    Function to calculate the offsets of the observer from the position of the Earth extrapolated
+    linearly from the reference time t0_par, projected onto the sky, following pyLIMA's annual_parallax.
+    Only the position and velocity of the Earth at t0_par need to be computed.
+
+    Parameters:
+        time            array   Timestamps [JD]
+        earth_positions array   North and East projected positions of the Earth at each timestamp, shape (2, N)
+        t0_par          float   Reference time of the parallax model [JD]
+        North, East     array   North and East vectors of the event, as computed by pyLIMA
+
+    Returns:
+        deltas_positions array  North and East projected offsets, shape (2, N)
+    """
+
+    (reference_position, reference_speed) = parallax.Earth_ephemerides(t0_par)
+    reference_position = np.array([np.dot(reference_position, North), np.dot(reference_position, East)])
+    reference_speed = np.array([np.dot(reference_speed, North), np.dot(reference_speed, East)])
+
+    return -earth_positions + np.outer(reference_speed, time - t0_par) + reference_position[:, np.newaxis]
+
+def parallax_magnification(t, t0, u0, tE, piEN, piEE, deltas_positions):
+    """Function to calculate the magnification of a point-source, point-lens event with annual parallax,
+    given the North and East projected offsets of the observer at each timestamp, shape (2, N),
+    following pyLIMA's sign conventions"""
+
+    (delta_North, delta_East) = deltas_positions
+    tau = (np.asarray(t, dtype=float) - t0) / tE + piEN * delta_North + piEE * delta_East
+    beta = u0 + piEN * delta_East - piEE * delta_North
+    usqr = tau**2 + beta**2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        A = (usqr + 2.0) / np.sqrt(usqr * (usqr + 4.0))
+
+    return A
+
+def ephemeris_key(ra, dec, datasets, emag_limit=None):
+    """Function to calculate the key of the cached ephemeris of an event, from the fingerprint of the
+    photometry to be fitted and the event's position on the sky"""
+
+    config = {'ra': ra, 'dec': dec, 'emag_limit': emag_limit, 'version': EPHEMERIS_VERSION}
+
+    return fittools.photometry_fingerprint(datasets, fit_config=config)
+
+def load_ephemeris(key):
+    """Function to retrieve a cached ephemeris, returning the dictionary of projected positions of each
+    telescope, or None if not cached"""
+
+    try:
+        entry = ParallaxEphemeris.objects.get(key=key)
+    except ParallaxEphemeris.DoesNotExist:
+        return None
+
+    positions = {}
+    for name, encoded in json.loads(entry.positions).items():
+        data = np.frombuffer(base64.b64decode(encoded['positions']), dtype='<f8')
+        positions[name] = data.reshape(2, encoded['ndata'])
+
+    return positions
+
+def store_ephemeris(key, target, positions):
+    """Function to cache the ephemeris of the current version of a target's photometry, replacing
+    those of any earlier versions"""
+
+    encoded = {}
+    for name, data in positions.items():
+        encoded[name] = {
+            'ndata': int(data.shape[1]),
+            'positions': base64.b64encode(np.ascontiguousarray(data, dtype='<f8').tobytes()).decode('ascii')
+        }
+
+    with transaction.atomic():
+        ParallaxEphemeris.objects.filter(target=target).exclude(key=key).delete()
+        ParallaxEphemeris.objects.update_or_create(
+            key=key,
+            defaults={
+                'target': target,
+                'positions': json.dumps(encoded),
+                'ndata': int(np.sum([data.shape[1] for data in positions.values()]))
+            }
+        )
+
+def event_earth_positions(target, current_event, key):
+    """
+    Function to return the projected positions of the Earth for the photometry of an event, from the
+    cache if available.  Otherwise they are computed and added to the cache.
+
+    Parameters:
+        target          Target  Event to be fitted
+        current_event   Event   pyLIMA event holding the photometry to be fitted
+        key             str     Cache key, as returned by ephemeris_key
+
+    Returns:
+        positions       dict    Projected positions of each telescope, see earth_projected_positions
+    """
+
+    with fit_stage('ephemeris'):
+        positions = load_ephemeris(key)
+
+        # The cached positions are only valid if they match the photometry of each telescope
+        if positions is not None:
+            for tel in current_event.telescopes:
+                if tel.name not in positions or positions[tel.name].shape[1] != len(tel.lightcurve_flux):
+                    positions = None
+                    break
+
+        if positions is None:
+            positions = earth_projected_positions(current_event)
+            store_ephemeris(key, target, positions)
+            logger.info('PARALLAX: Computed the Earth ephemeris for ' + target.name)
+        else:
+            logger.info('PARALLAX: Using cached Earth ephemeris for ' + target.name)
+
+    return positions
+
+def fit_pspl_parallax(ra, dec, datasets, static_model, target=None, emag_limit=None, max_nfev=None,
+                      verbose=False):
+    """
+    Function to fit a PSPL model with blending and annual parallax to the photometry of an event,
+    with a TRF fit seeded from the parameters of a static PSPL model.  The reference time of the
+    parallax is fixed at the t0 of the static model.  As for the static models, u0 is constrained to
+    be positive, so only one of the pair of solutions related by the ecliptic degeneracy is found.
+
+    Parameters:
+        ra, dec         float   Position of the event [deg]
+        datasets        dict    Lightcurve arrays indexed by passband, as returned by repackage_lightcurves
+        static_model    dict    Parameters of the static PSPL model fitted to the same photometry
+        target          Target  Optional Target of the event.  If given, the Earth's ephemeris is cached
+                                for this version of its photometry, see event_earth_positions
+        emag_limit      float   Optional limit on the photometric uncertainty of datapoints to include
+        max_nfev        int     Optional maximum number of evaluations of the objective function
+        verbose         bool    Switch for logging output
+
+    Returns:
+        model_params    dict            Fitted and evaluated model parameters
+        model_telescope Telescope       Model lightcurve, or None if the model failed evaluation
+    """
+
+    with fit_stage('telescope_build'):
+        current_event = fittools.pylima_event_from_datasets(ra, dec, datasets, emag_limit=emag_limit,
+                                                            event_class=ParallaxEvent)
+    if target is not None:
+        key = ephemeris_key(ra, dec, datasets, emag_limit=emag_limit)
+        current_event.earth_positions = event_earth_positions(target, current_event, key)
+
+    t0_par = float(static_model['t0'])
+    with fit_stage('model_parallax'):
+        pspl = PSPL_model.PSPLmodel(current_event, parallax=[PARALLAX_MODEL, t0_par],
+                                    blend_flux_parameter='fblend')
+        pspl.define_model_parameters()
+        fit_tap = fittools.BudgetTRFfit(pspl, max_nfev=max_nfev, loss_function='soft_l1')
+
+        fit_tap.fit_parameters['t0'][1] = [fit_tap.fit_parameters['t0'][1][0],
+                                           fit_tap.fit_parameters['t0'][1][1] + fittools.PSPL_T0_MARGIN]
+        fit_tap.fit_parameters['tE'][1] = list(fittools.PSPL_TE_BOUNDS)
+        fit_tap.fit_parameters['u0'][1] = list(fittools.PSPL_U0_BOUNDS)
+        fit_tap.fit_parameters['piEN'][1] = list(PIE_BOUNDS)
+        fit_tap.fit_parameters['piEE'][1] = list(PIE_BOUNDS)
+
+        fit_tap.model_parameters_guess = [
+            float(np.clip(float(static_model[key]), fit_tap.fit_parameters[key][1][0],
+                          fit_tap.fit_parameters[key][1][1]))
+            for key in ['t0', 'u0', 'tE']
+        ] + [0.0, 0.0]
+        if verbose: logger.info('PARALLAX: fit seeded from ' + repr(fit_tap.model_parameters_guess)
+                                + ' with t0_par=' + str(t0_par))
+
+        fit_tap.fit()
+
+    model_params = fittools.gather_model_parameters(current_event, fit_tap)
+    model_params = fittools.evaluate_model(model_params)
+    if verbose: logger.info('PARALLAX: fitted parameters ' + repr(model_params))
+
+    model_telescope = None
+    if not np.isnan(model_params['tE']):
+        with fit_stage('lightcurve_generation'):
+            model_telescope = generate_parallax_model_lightcurve(current_event, model_params, t0_par)
+
+    return model_params, model_telescope
+
+def generate_parallax_model_lightcurve(pevent, model_params, t0_par):
+    """Function to generate the photometric timeseries of a PSPL model with annual parallax, in the passband
+    of the reference dataset, as a pyLIMA Telescope.  The timestamps are those of the adaptive time grid
+    of the corresponding static model, at which the Earth's ephemeris is computed"""
+
+    (t0, u0, tE, fs, fb) = pspl_tools.event_parameters(model_params)
+
+    data_times = np.concatenate([tel.lightcurve_magnitude['time'].value for tel in pevent.telescopes])
+    model_time = pspl_tools.adaptive_time_grid(t0, u0, tE, fs, fb, data_times=data_times,
+                                               tolerance=getattr(settings, 'MODEL_LIGHTCURVE_TOLERANCE', 0.001))
+
+    (earth_positions, earth_speeds) = parallax.Earth_ephemerides(model_time)
+    earth_positions = np.array([np.dot(earth_positions, pevent.North), np.dot(earth_positions, pevent.East)])
+    deltas_positions = annual_parallax_offsets(model_time, earth_positions, t0_par, pevent.North, pevent.East)
+
+    A = parallax_magnification(model_time, t0, u0, tE, float(model_params['piEN']), float(model_params['piEE']),
+                               deltas_positions)
+    magnitude = pspl_tools.flux_to_mag(fs * A + fb)
+    mask = np.isfinite(magnitude)
+
+    model_telescope = telescopes.Telescope(name=pevent.telescopes[0].name,
+                                           camera_filter=pevent.telescopes[0].filter,
+                                           light_curve=np.c_[model_time[mask], magnitude[mask],
+                                                             [0.1] * mask.sum()],
+                                           light_curve_names=['time', 'mag', 'err_mag'],
+                                           light_curve_units=['JD', 'mag', 'err_mag'])
+
+    return model_telescope
+
+def static_model_chi2(datasets, static_model, emag_limit=None):
+    """Function to calculate the chi2 of a static PSPL model with blending, given its (t0, u0, tE), for the
+    photometry to which a parallax model is fitted, solving for the fluxes of each telescope.  The chi2 stored
+    with the static model may not be comparable, since that fit may have used binned photometry"""
+
+    lightcurves = fittools.select_lightcurves(datasets, emag_limit=emag_limit)
+    packed = pspl_tools.pack_lightcurves([lightcurves])
+    A = pspl_tools.magnification(packed['time'], float(static_model['t0']), float(static_model['u0']),
+                                 float(static_model['tE']))
+    (fs, fb) = pspl_tools.solve_linear_fluxes(A, packed['flux'], packed['weight'], packed['tel'],
+                                              max(len(lightcurves), 1))
+    model = np.take_along_axis(fs, packed['tel'], axis=1) * A + np.take_along_axis(fb, packed['tel'], axis=1)
+
+    return float(np.sum((packed['flux'] - model)**2 * packed['weight']))
+
+def prefer_parallax_model(static_chi2, parallax_model):
+    """Function to decide whether a parallax model should be adopted in place of the static model fitted
+    to the same photometry, with the given chi2.  The parallax model is required to improve the chi2 by
+    more than the 3-sigma threshold for its two additional parameters"""
+
+    parallax_chi2 = float(parallax_model['chi2'])
+    if np.isnan(parallax_chi2):
+        return False
+    if np.isnan(static_chi2):
+        return True
+
+    return (static_chi2 - parallax_chi2) > stats.chi2.ppf(0.9973, 2)
+
+def need_parallax_fit(mulens, force=False):
+    """
+    Function to determine whether a parallax model should be fitted to an event.  This is the case for
+    events in the PARALLAX_CATEGORY, whose static model is up to date with their photometry, and whose
+    current photometry has not already been fitted with parallax, unless force is set.
+
+    Returns:
+        status  bool    True if a parallax fit is needed
+        reason  str     Explanation
+    """
+
+    if getattr(mulens, 'Category', None) != PARALLAX_CATEGORY:
+        return False, 'Not a ' + PARALLAX_CATEGORY + ' event'
+
+    fingerprint = mulens.photometry_fingerprint()
+    if getattr(mulens, 'Fit_fingerprint', None) != fingerprint:
+        return False, 'Static model not up to date'
+
+    if not force and getattr(mulens, 'Parallax_fingerprint', None) == fingerprint:
+        return False, 'Photometry unchanged since last parallax fit'
+
+    return True, 'OK'
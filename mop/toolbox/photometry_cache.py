@@ -0,0 +1,229 @@
+from django.conf import settings
+from django.core.cache import caches
+from django.utils import timezone
+from mop.models import EventSummary
+import numpy as np
+import datetime
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Version of the format of the cached photometry.  This should be incremented whenever the format
+# changes, so that photometry cached in earlier formats is not re-used
+PHOTOMETRY_CACHE_VERSION = 2
+
+# Default lifetime of cached photometry [s]
+PHOTOMETRY_CACHE_TIMEOUT = 7 * 24 * 3600
+
+# Default period after an ingest by bulk insert starts during which photometry is not cached [s]
+PHOTOMETRY_INGEST_WINDOW = 300
+
+def photometry_cache():
+    """Function to return the Django cache in which photometry is held, as selected by the
+    PHOTOMETRY_CACHE_ALIAS setting"""
+
+    return caches[getattr(settings, 'PHOTOMETRY_CACHE_ALIAS', 'default')]
+
+def entry_key(target, generation):
+    """Function to return the cache key of a target's photometry, given the generation of the photometry.
+    The key includes the time the target was created, so that photometry is never attributed to a
+    different target that re-uses its ID"""
+
+    return 'mop_photometry_' + str(PHOTOMETRY_CACHE_VERSION) + '_' + str(target.pk) \
+           + '_' + _stamp(getattr(target, 'created', None)) + '_' + generation
+
+def _stamp(timestamp):
+    if timestamp is None:
+        return ''
+    return timestamp.strftime('%Y%m%d%H%M%S%f')
+
+def photometry_generations(target_list):
+    """
+    Function to retrieve the current generation of the photometry of a set of targets from the
+    database, with a single query.  The generation is the time the target's photometry last changed,
+    as recorded in its EventSummary, so it is shared by all processes whichever cache they use.
+
+    Parameters:
+        target_list     list    Targets
+
+    Returns:
+        generations     dict    Generation of the photometry of each target, indexed by target ID, or
+                                None while photometry is being ingested for the target
+    """
+
+    now = timezone.now()
+    modified = dict(EventSummary.objects.filter(target_id__in=[t.pk for t in target_list])
+                    .values_list('target_id', 'photometry_modified'))
+
+    generations = {}
+    for t in target_list:
+        timestamp = modified.get(t.pk)
+        if timestamp is not None and timestamp > now:
+            generations[t.pk] = None
+        else:
+            generations[t.pk] = _stamp(timestamp)
+
+    return generations
+
+def pack_photometry(datasets, first_observation, last_observation, generation=None):
+    """
+    Function to pack the lightcurves of a target into the columnar form in which they are cached.
+
+    Parameters:
+        datasets            dict    Lightcurve arrays indexed by passband, as returned by repackage_lightcurves
+        first_observation   float   Timestamp of the first photometric datapoint [JD], or None
+        last_observation    float   Timestamp of the last photometric datapoint [JD], or None
+        generation          str     Generation of the target's photometry when it was retrieved
+
+    Returns:
+        entry               dict    Arrays of the time, magnitude and uncertainty of each passband,
+                                    with the generation and a summary of the photometry
+    """
+
+    passbands = {}
+    ndata = 0
+    for passband, lc in datasets.items():
+        lc = np.asarray(lc, dtype=float).reshape(-1, 3)
+        passbands[passband] = {
+            'time': np.ascontiguousarray(lc[:, 0]),
+            'mag': np.ascontiguousarray(lc[:, 1]),
+            'err': np.ascontiguousarray(lc[:, 2])
+        }
+        ndata += len(lc)
+
+    return {
+        'generation': generation,
+        'ndata': ndata,
+        'first_observation': first_observation,
+        'last_observation': last_observation,
+        'passbands': passbands
+    }
+
+def unpack_photometry(entry):
+    """
+    Function to unpack cached photometry
+
+    Returns:
+        datasets            dict    Lightcurve arrays indexed by passband, as returned by repackage_lightcurves
+        ndata               int     Total number of datapoints
+        first_observation   float   Timestamp of the first photometric datapoint [JD], or None
+        last_observation    float   Timestamp of the last photometric datapoint [JD], or None
+    """
+
+    datasets = {}
+    for passband, columns in entry['passbands'].items():
+        datasets[passband] = np.column_stack((columns['time'], columns['mag'], columns['err']))
+
+    return datasets, entry['ndata'], entry['first_observation'], entry['last_observation']
+
+def lookup_photometry(target_list):
+    """
+    Function to retrieve the cached photometry of a set of targets, with a single read of the cache.
+    Photometry is only returned if it was cached under the current generation of the target's photometry,
+    so photometry cached before new photometry was ingested is never used.
+
+    Parameters:
+        target_list     list    Targets
+
+    Returns:
+        photometry      dict    Cached photometry, indexed by target ID, for those targets with current
+                                cached photometry
+        generations     dict    Current generation of the photometry of each target, indexed by target ID,
+                                to be stored with any photometry subsequently cached
+    """
+
+    if not getattr(settings, 'PHOTOMETRY_CACHE', True) or len(target_list) == 0:
+        return {}, {}
+
+    generations = photometry_generations(target_list)
+    keys = {t.pk: entry_key(t, generations[t.pk]) for t in target_list if generations[t.pk] is not None}
+    found = photometry_cache().get_many(list(keys.values()))
+
+    photometry = {}
+    for pk, key in keys.items():
+        if key in found:
+            photometry[pk] = found[key]
+
+    return photometry, generations
+
+def store_photometry(entries):
+    """Function to cache the photometry of a set of targets, given as a dictionary of the entries
+    returned by pack_photometry, indexed by Target.  Photometry retrieved while new photometry was
+    being ingested for the target is not cached"""
+
+    if not getattr(settings, 'PHOTOMETRY_CACHE', True):
+        return
+
+    entries = {entry_key(t, entry['generation']): entry for t, entry in entries.items()
+               if entry['generation'] is not None}
+    if len(entries) == 0:
+        return
+
+    timeout = getattr(settings, 'PHOTOMETRY_CACHE_TIMEOUT', PHOTOMETRY_CACHE_TIMEOUT)
+    photometry_cache().set_many(entries, timeout=timeout)
+
+def invalidate_photometry(target, ingest_window=0):
+    """
+    Function to invalidate the cached photometry of a target, by changing the generation of its
+    photometry in the database.  This is done by the ReducedDatum signals whenever photometry is saved
+    or deleted, but must be called explicitly before photometry is stored by bulk insert, which sends
+    no signals.
+
+    Parameters:
+        target          Target  Target whose photometry is changing
+        ingest_window   float   Period during which photometry is being ingested, and so should not be
+                                cached [s]
+    """
+
+    modified = timezone.now() + datetime.timedelta(seconds=ingest_window)
+    EventSummary.touch_photometry(target.pk, modified=modified)
+
+def clean_key(fingerprint):
+    """Function to return the cache key of the cleaned lightcurves of a set of photometry, given the
+    fingerprint of the photometry and the cleaning configuration"""
+
+    return 'mop_clean_photometry_' + str(PHOTOMETRY_CACHE_VERSION) + '_' + fingerprint
+
+def lookup_clean_datasets(fingerprint):
+    """
+    Function to retrieve the cleaned lightcurves of a set of photometry.  The cleaned lightcurves are
+    keyed by the content of the photometry, so need no invalidation when new photometry is ingested.
+
+    Parameters:
+        fingerprint     str     Fingerprint of the photometry and the cleaning configuration
+
+    Returns:
+        cleaned         dict    Cleaned lightcurve arrays indexed by passband, or None if not cached
+        rejected        dict    Number of datapoints rejected as invalid, duplicates and outliers
+    """
+
+    if not getattr(settings, 'PHOTOMETRY_CACHE', True):
+        return None
+
+    try:
+        entry = photometry_cache().get(clean_key(fingerprint))
+    except Exception as e:
+        logger.warning('PHOTOMETRY CACHE: Failed to retrieve cleaned photometry: ' + repr(e))
+        return None
+
+    if entry is None:
+        return None
+    (cleaned, ndata, first_observation, last_observation) = unpack_photometry(entry)
+
+    return cleaned, entry['rejected']
+
+def store_clean_datasets(fingerprint, cleaned, rejected):
+    """Function to cache the cleaned lightcurves of a set of photometry, as returned by
+    fittools.clean_datasets, under the fingerprint of the photometry and the cleaning configuration"""
+
+    if not getattr(settings, 'PHOTOMETRY_CACHE', True):
+        return
+
+    entry = pack_photometry(cleaned, None, None)
+    entry['rejected'] = rejected
+
+    timeout = getattr(settings, 'PHOTOMETRY_CACHE_TIMEOUT', PHOTOMETRY_CACHE_TIMEOUT)
+    try:
+        photometry_cache().set(clean_key(fingerprint), entry, timeout=timeout)
+    except Exception as e:
+        logger.warning('PHOTOMETRY CACHE: Failed to store cleaned photometry: ' + repr(e))
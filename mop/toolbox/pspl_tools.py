@@ -0,0 +1,607 @@
+import numpy as np
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Zeropoint for conversions between flux and magnitude, following the pyLIMA convention
+ZP = 27.4
+
+# Coarse grid of (t0, u0, tE) searched for the starting point of the fit of a single event.  Candidate
+# values of t0 are offset from the peak of the reference lightcurve by multiples of tE, and spread
+# uniformly across the t0 boundaries, in case the peak of the lightcurve is misidentified
+GRID_U0_VALUES = (0.01, 0.05, 0.15, 0.4, 0.8, 1.5)
+GRID_TE_VALUES = (2.0, 5.0, 12.0, 30.0, 75.0, 180.0, 450.0, 1100.0)
+GRID_T0_OFFSETS = (-0.5, -0.2, 0.0, 0.2, 0.5)
+GRID_NT0 = 8
+
+# Factors applied to u0 and tE at the best point of the coarse grid, and offsets of t0 in units of tE,
+# forming a finer grid around it
+GRID_REFINE_FACTORS = (0.6, 0.775, 1.0, 1.29, 1.667)
+GRID_REFINE_T0_OFFSETS = (-0.1, -0.05, 0.0, 0.05, 0.1)
+
+# Maximum number of datapoints of an event evaluated at each point of the grid search; denser
+# lightcurves are thinned evenly in time
+GRID_MAX_POINTS = 400
+
+def magnification(t, t0, u0, tE):
+    """
+    Function to calculate the Paczynski magnification of a static point-source, point-lens event.
+
+    All arguments are numpy-broadcastable, so that the magnification of many events can be computed
+    in a single call, for example by passing times with shape (1, ntimes) and parameters with
+    shape (nevents, 1).
+
+    Parameters:
+        t   float or array  Timestamps [JD]
+        t0  float or array  Time of peak magnification [JD]
+        u0  float or array  Minimum impact parameter
+        tE  float or array  Einstein crossing time [days]
+
+    Returns:
+        A   float or array  Magnification
+    """
+
+    tau = (np.asarray(t, dtype=float) - t0) / tE
+    usqr = tau**2 + np.asarray(u0, dtype=float)**2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        A = (usqr + 2.0) / np.sqrt(usqr * (usqr + 4.0))
+
+    return A
+
+def model_flux(t, t0, u0, tE, fs, fb):
+    """
+    Function to calculate the lensed flux of a static PSPL event, given the source and blend fluxes.
+    Arguments are broadcast as for magnification.
+    """
+
+    return fs * magnification(t, t0, u0, tE) + fb
+
+def flux_to_mag(flux):
+    """Function to convert flux to magnitude, returning NaN for non-positive fluxes"""
+
+    flux = np.asarray(flux, dtype=float)
+    with np.errstate(divide='ignore', invalid='ignore'):
+        mag = np.where(flux > 0.0, ZP - 2.5 * np.log10(flux), np.nan)
+
+    return mag
+
+def mag_to_flux(mag):
+    """Function to convert magnitude to flux"""
+
+    return 10**((ZP - np.asarray(mag, dtype=float)) / 2.5)
+
+def model_magnitude(t, t0, u0, tE, fs, fb):
+    """
+    Function to calculate the magnitude of a static PSPL event, given the source and blend fluxes.
+    Arguments are broadcast as for magnification.
+    """
+
+    return flux_to_mag(model_flux(t, t0, u0, tE, fs, fb))
+
+def event_parameters(model_params):
+    """
+    Function to extract the (t0, u0, tE, fs, fb) parameters of a PSPL model from a dictionary of
+    MOP model parameters, such as that produced by fittools.gather_model_parameters or the
+    TargetExtras of an event.  An undefined blend magnitude is treated as zero blend flux.
+
+    Returns:
+        params  tuple of floats (t0, u0, tE, fs, fb), NaN for any undefined parameter
+    """
+
+    values = []
+    for key in ['t0', 'u0', 'tE', 'Source_magnitude', 'Blend_magnitude']:
+        try:
+            values.append(float(model_params[key]))
+        except (KeyError, TypeError, ValueError):
+            values.append(np.nan)
+
+    fs = float(mag_to_flux(values[3]))
+    if np.isfinite(values[4]):
+        fb = float(mag_to_flux(values[4]))
+    else:
+        fb = 0.0
+
+    return values[0], values[1], values[2], fs, fb
+
+def event_parameter_arrays(param_list):
+    """
+    Function to stack the PSPL parameters of a set of events into column arrays of shape (nevents, 1),
+    ready to broadcast against a row array of timestamps.
+
+    Parameters:
+        param_list  list    Dictionaries of MOP model parameters for each event
+
+    Returns:
+        (t0, u0, tE, fs, fb) tuple of arrays with shape (nevents, 1)
+    """
+
+    params = np.array([event_parameters(x) for x in param_list], dtype=float).reshape(-1, 5)
+
+    return tuple(params[:, i:i+1] for i in range(5))
+
+def valid_parameters(t0, u0, tE, fs, fb):
+    """Function to verify that a set of PSPL parameters can be used to calculate a model lightcurve"""
+
+    return np.isfinite(t0) & np.isfinite(u0) & np.isfinite(tE) & (tE > 0.0) \
+        & np.isfinite(fs) & (fs > 0.0) & np.isfinite(fb)
+
+def adaptive_time_grid(t0, u0, tE, fs, fb, data_times=None, tolerance=0.001, min_step=0.001, max_iter=40):
+    """
+    Function to generate the timestamps at which to sample a model lightcurve, such that linear
+    interpolation between them reproduces the model magnitude to within a given tolerance.  The grid
+    spans both the data and t0 +/- 5 tE, but is dense only where the lightcurve is strongly curved,
+    near t0, and sparse in the wings.
+
+    The grid is refined by bisecting every interval in which the interpolated magnitude at the
+    quarter-points deviates from the model by more than the tolerance, until no interval does, or
+    the intervals reach min_step.  The tolerance may therefore be exceeded within min_step of the peak
+    of events with u0 close to zero, where the magnification is almost singular.
+
+    Parameters:
+        t0, u0, tE  float   PSPL model parameters
+        fs, fb      float   Source and blend fluxes
+        data_times  array   Optional timestamps of the observed data [JD]
+        tolerance   float   Maximum interpolation error [mag]
+        min_step    float   Minimum interval between timestamps [days]
+        max_iter    int     Maximum number of refinement iterations
+
+    Returns:
+        model_time  array   Sorted, unique timestamps [JD]
+    """
+
+    if data_times is None or len(data_times) == 0:
+        data_times = np.array([t0])
+    data_times = np.asarray(data_times, dtype=float)
+    t_start = min(data_times.min(), t0 - 5.0 * tE)
+    t_end = max(data_times.max(), t0 + 5.0 * tE)
+
+    # Start from a coarse grid with nodes on either side of the peak
+    model_time = t0 + tE * np.array([-3.0, -1.0, -0.3, -0.1, 0.0, 0.1, 0.3, 1.0, 3.0])
+    model_time = np.unique(np.r_[t_start, t_end, model_time[(model_time > t_start) & (model_time < t_end)]])
+    mags = model_magnitude(model_time, t0, u0, tE, fs, fb)
+
+    quarters = np.array([0.25, 0.5, 0.75])
+    for i in range(max_iter):
+        step = np.diff(model_time)
+        check_time = model_time[:-1, np.newaxis] + step[:, np.newaxis] * quarters
+        with np.errstate(invalid='ignore'):
+            interpolated = mags[:-1, np.newaxis] + (mags[1:] - mags[:-1])[:, np.newaxis] * quarters
+            error = np.abs(model_magnitude(check_time, t0, u0, tE, fs, fb) - interpolated).max(axis=1)
+            refine = (error > tolerance) & (step > 2.0 * min_step)
+        if not refine.any():
+            break
+
+        midpoints = model_time[:-1][refine] + 0.5 * step[refine]
+        order = np.argsort(np.r_[model_time, midpoints], kind='stable')
+        model_time = np.r_[model_time, midpoints][order]
+        mags = np.r_[mags, model_magnitude(midpoints, t0, u0, tE, fs, fb)][order]
+
+    return model_time
+
+def magnification_derivatives(t, t0, u0, tE):
+    """
+    Function to calculate the PSPL magnification and its partial derivatives with respect to t0, u0 and tE.
+    Arguments are broadcast as for magnification.
+
+    Returns:
+        A       array   Magnification
+        dA      list    Arrays of dA/dt0, dA/du0 and dA/dtE
+    """
+
+    tau = (np.asarray(t, dtype=float) - t0) / tE
+    usqr = tau**2 + np.asarray(u0, dtype=float)**2
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        root = np.sqrt(usqr * (usqr + 4.0))
+        A = (usqr + 2.0) / root
+
+        # dA/d(u^2), combined with d(u^2)/dp for each parameter
+        dA_dusqr = -4.0 / (root * usqr * (usqr + 4.0))
+        dA = [
+            dA_dusqr * (-2.0 * tau / tE),
+            dA_dusqr * (2.0 * u0),
+            dA_dusqr * (-2.0 * tau**2 / tE)
+        ]
+
+    return A, dA
+
+def pack_lightcurves(event_lightcurves):
+    """
+    Function to pack the lightcurves of many events into padded arrays, so that the models of all events
+    can be evaluated together.
+
+    Parameters:
+        event_lightcurves   list    For each event, a list of arrays of (time, mag, mag_error) for each
+                                    telescope, with the reference telescope first
+
+    Returns:
+        packed  dict    Arrays of shape (nevents, nmax) of time, flux, weight (1/sigma_flux^2, zero for
+                        padding) and telescope index, plus the number of telescopes and datapoints of each
+                        event and the time of the brightest point of its reference lightcurve
+    """
+
+    nevents = len(event_lightcurves)
+    npts = [int(np.sum([len(lc) for lc in tels])) for tels in event_lightcurves]
+    nmax = max(max(npts, default=1), 1)
+
+    packed = {
+        'time': np.zeros((nevents, nmax)),
+        'flux': np.zeros((nevents, nmax)),
+        'weight': np.zeros((nevents, nmax)),
+        'tel': np.zeros((nevents, nmax), dtype=int),
+        'ntel': np.array([len(tels) for tels in event_lightcurves], dtype=int),
+        'ndata': np.array(npts, dtype=int),
+        'peak_time': np.zeros(nevents)
+    }
+
+    for i, tels in enumerate(event_lightcurves):
+        if npts[i] == 0:
+            continue
+        lc = np.concatenate([np.asarray(x, dtype=float)[:, 0:3] for x in tels])
+        tel_index = np.concatenate([[k] * len(x) for k, x in enumerate(tels)]).astype(int)
+        flux = mag_to_flux(lc[:, 1])
+        flux_err = lc[:, 2] * flux * np.log(10.0) / 2.5
+
+        packed['time'][i, 0:npts[i]] = lc[:, 0]
+        packed['flux'][i, 0:npts[i]] = flux
+        packed['weight'][i, 0:npts[i]] = 1.0 / flux_err**2
+        packed['tel'][i, 0:npts[i]] = tel_index
+
+        packed['peak_time'][i] = peak_time(tels[0])
+
+    return packed
+
+def thin_lightcurves(lightcurves, max_points):
+    """Function to thin the lightcurves of an event, a list of arrays of (time, mag, ...) for each telescope,
+    to no more than about max_points datapoints in total, by taking every n-th datapoint of each lightcurve in
+    time order, while retaining at least 10 datapoints of each.  Lightcurves that are already sparse enough
+    are returned unchanged"""
+
+    npts = np.sum([len(lc) for lc in lightcurves])
+    if npts <= max_points:
+        return lightcurves
+
+    step = int(np.ceil(npts / max_points))
+    thinned = []
+    for lc in lightcurves:
+        lc = np.asarray(lc, dtype=float)
+        thinned.append(lc[np.argsort(lc[:, 0])][::max(1, min(step, len(lc) // 10))])
+
+    return thinned
+
+def smoothed_lightcurve(lc):
+    """Function to sort a lightcurve array of (time, mag, ...) into time order and apply a 3-point
+    running median to its magnitudes, to reject single outliers.  Returns the times and smoothed
+    magnitudes, which are unsmoothed for lightcurves of fewer than 3 points"""
+
+    lc = np.asarray(lc, dtype=float)
+    lc = lc[np.argsort(lc[:, 0])]
+    if len(lc) < 3:
+        return lc[:, 0], lc[:, 1]
+
+    smoothed = np.median(np.c_[lc[:-2, 1], lc[1:-1, 1], lc[2:, 1]], axis=1)
+
+    return lc[1:-1, 0], smoothed
+
+def peak_time(lc):
+    """Function to estimate the time of peak brightness of a lightcurve array of (time, mag, ...),
+    from its brightest point after a 3-point running median"""
+
+    if len(lc) == 0:
+        return 0.0
+
+    (time, mags) = smoothed_lightcurve(lc)
+
+    return time[np.argmin(mags)]
+
+def solve_linear_fluxes(A, flux, weight, tel, ntel, blend=True):
+    """
+    Function to solve analytically for the source and blend fluxes of each telescope of each event,
+    by weighted linear least squares, given the magnification of every datapoint.
+
+    Parameters:
+        A       array   Magnification, shape (nevents, nmax)
+        flux    array   Observed flux, shape (nevents, nmax)
+        weight  array   Inverse variance of the flux, zero for padding, shape (nevents, nmax)
+        tel     array   Telescope index of each datapoint, shape (nevents, nmax)
+        ntel    int     Maximum number of telescopes per event
+        blend   bool    If False, the blend flux is fixed at zero
+
+    Returns:
+        fs, fb  arrays  Source and blend fluxes, shape (nevents, ntel)
+    """
+
+    nevents = A.shape[0]
+    index = (np.arange(nevents)[:, np.newaxis] * ntel + tel).ravel()
+    A = np.where(weight > 0.0, A, 0.0)
+
+    def tel_sum(values):
+        return np.bincount(index, weights=values.ravel(), minlength=nevents * ntel).reshape(nevents, ntel)
+
+    S_w = tel_sum(weight)
+    S_A = tel_sum(weight * A)
+    S_AA = tel_sum(weight * A * A)
+    S_f = tel_sum(weight * flux)
+    S_Af = tel_sum(weight * A * flux)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fs_noblend = np.where(S_AA > 0.0, S_Af / S_AA, 0.0)
+
+        if blend:
+            det = S_AA * S_w - S_A**2
+            degenerate = ~(np.abs(det) > 1e-12 * np.abs(S_AA * S_w))
+            fs = np.where(degenerate, fs_noblend, (S_Af * S_w - S_A * S_f) / det)
+            fb = np.where(degenerate, 0.0, (S_AA * S_f - S_A * S_Af) / det)
+        else:
+            fs = fs_noblend
+            fb = np.zeros_like(fs)
+
+    return fs, fb
+
+def project_flux_basis(g, a, b, tel, ntel, blend=True):
+    """
+    Function to remove from a column of a Jacobian the component that lies within the space spanned
+    by the flux parameters of each telescope, a (source flux) and b (blend flux), by weighted linear
+    least squares.  All arrays have shape (nevents, nmax), and are already scaled by the uncertainties.
+    """
+
+    nevents = g.shape[0]
+    index = (np.arange(nevents)[:, np.newaxis] * ntel + tel).ravel()
+
+    def tel_sum(values):
+        return np.bincount(index, weights=values.ravel(), minlength=nevents * ntel).reshape(nevents, ntel)
+
+    S_aa = tel_sum(a * a)
+    S_ag = tel_sum(a * g)
+
+    with np.errstate(divide='ignore', invalid='ignore'):
+        if blend:
+            S_ab = tel_sum(a * b)
+            S_bb = tel_sum(b * b)
+            S_bg = tel_sum(b * g)
+            det = S_aa * S_bb - S_ab**2
+            degenerate = ~(np.abs(det) > 1e-12 * np.abs(S_aa * S_bb))
+            ca = np.where(degenerate, 0.0, (S_bb * S_ag - S_ab * S_bg) / det)
+            cb = np.where(degenerate, 0.0, (S_aa * S_bg - S_ab * S_ag) / det)
+        else:
+            ca = np.where(S_aa > 0.0, S_ag / S_aa, 0.0)
+            cb = np.zeros_like(ca)
+
+    return g - np.take_along_axis(ca, tel, axis=1) * a - np.take_along_axis(cb, tel, axis=1) * b
+
+def loss_function(chi, loss='soft_l1'):
+    """Function to calculate the cost of each normalized residual, for a linear or soft_l1 loss function,
+    following the definitions used by scipy.optimize.least_squares"""
+
+    if loss == 'soft_l1':
+        return 2.0 * (np.sqrt(1.0 + chi**2) - 1.0)
+
+    return chi**2
+
+def batch_initial_guess(packed, bounds, blend=True, loss='soft_l1',
+                        u0_values=(0.05, 0.2, 0.6, 1.2), tE_values=(5.0, 20.0, 60.0, 200.0),
+                        t0_offsets=(0.0,), nt0=0, max_block=4000000):
+    """
+    Function to choose starting values of (t0, u0, tE) for many events, by evaluating the cost of a grid
+    of candidate (t0, u0, tE), with the fluxes of each telescope solved linearly at every grid point.
+    By default, t0 is fixed at the time of the peak of each event's reference lightcurve, and a small set
+    of (u0, tE) pairs is searched.  Candidate values of t0 offset from the peak by multiples of tE, or
+    spread uniformly across the t0 boundaries, may be added to widen the search.
+
+    Parameters:
+        packed      dict    Packed lightcurves, as returned by pack_lightcurves
+        bounds      array   Lower and upper boundaries of (t0, u0, tE), shape (nevents, 3, 2)
+        blend       bool    If False, the blend flux is fixed at zero
+        loss        str     Loss function, 'soft_l1' or 'linear'
+        u0_values   list    Candidate values of u0
+        tE_values   list    Candidate values of tE
+        t0_offsets  list    Candidate offsets of t0 from the peak of the lightcurve, in units of tE
+        nt0         int     Number of candidate values of t0 spread uniformly across the t0 boundaries
+        max_block   int     Maximum number of model points evaluated in a single array operation
+
+    Returns:
+        guess       array   Starting values of (t0, u0, tE), shape (nevents, 3)
+    """
+
+    ntel = max(int(packed['ntel'].max(initial=1)), 1)
+    (nevents, nmax) = packed['time'].shape
+    t0_lower = bounds[:, 0, 0][:, np.newaxis]
+    t0_upper = bounds[:, 0, 1][:, np.newaxis]
+    t0_peak = np.clip(packed['peak_time'], bounds[:, 0, 0], bounds[:, 0, 1])
+    t0_window = t0_lower + (t0_upper - t0_lower) * (np.arange(nt0) + 0.5) / max(nt0, 1)
+
+    # The candidate values of t0 and u0 for each value of tE are evaluated together, by treating each as a
+    # copy of the event, in blocks of events small enough to limit the memory required
+    u0_values = np.asarray(u0_values, dtype=float)
+    nu0 = len(u0_values)
+    ncand = (len(t0_offsets) + nt0) * nu0
+    block = max(1, max_block // (ncand * nmax))
+
+    guess = np.zeros((nevents, 3))
+    best_cost = np.full(nevents, np.inf)
+
+    for tE in tE_values:
+        t0_cand = np.clip(np.c_[t0_peak[:, np.newaxis] + tE * np.array(t0_offsets)[np.newaxis, :], t0_window],
+                          t0_lower, t0_upper)
+        t0_cand = np.repeat(t0_cand, nu0, axis=1)
+        u0_cand = np.tile(u0_values, ncand // nu0)
+
+        for i in range(0, nevents, block):
+            j = min(i + block, nevents)
+            time = np.repeat(packed['time'][i:j], ncand, axis=0)
+            flux = np.repeat(packed['flux'][i:j], ncand, axis=0)
+            weight = np.repeat(packed['weight'][i:j], ncand, axis=0)
+            tel = np.repeat(packed['tel'][i:j], ncand, axis=0)
+
+            A = magnification(time, t0_cand[i:j].reshape(-1, 1), np.tile(u0_cand, j - i)[:, np.newaxis], tE)
+            A = np.where(weight > 0.0, A, 1.0)
+            fs, fb = solve_linear_fluxes(A, flux, weight, tel, ntel, blend=blend)
+            model = np.take_along_axis(fs, tel, axis=1) * A + np.take_along_axis(fb, tel, axis=1)
+            chi = (flux - model) * np.sqrt(weight)
+            cost = np.sum(loss_function(chi, loss), axis=1).reshape(j - i, ncand)
+            cost = np.where(np.isfinite(cost), cost, np.inf)
+
+            k = np.argmin(cost, axis=1)
+            cost = cost[np.arange(j - i), k]
+            better = np.isfinite(cost) & (cost < best_cost[i:j])
+            index = np.arange(i, j)[better]
+            guess[index] = np.c_[t0_cand[index, k[better]], u0_cand[k[better]], [tE] * better.sum()]
+            best_cost[index] = cost[better]
+
+    # Events for which no candidate could be evaluated start from the middle of the grid
+    undefined = ~np.isfinite(best_cost)
+    guess[undefined] = np.c_[t0_peak[undefined], [u0_values[1]] * undefined.sum(), [tE_values[1]] * undefined.sum()]
+
+    return np.clip(guess, bounds[:, :, 0], bounds[:, :, 1])
+
+def fit_pspl_batch_arrays(packed, bounds, guess, blend=True, loss='soft_l1', max_iter=200, tol=1e-8):
+    """
+    Function to fit static PSPL models to many events simultaneously, by Levenberg-Marquardt iteration
+    over (t0, u0, tE), vectorized over events.  At every step, the source and blend fluxes of each
+    telescope are solved analytically for the current (t0, u0, tE).  Robust losses are handled by
+    iteratively reweighting the residuals.
+
+    Parameters:
+        packed      dict    Packed lightcurves, as returned by pack_lightcurves
+        bounds      array   Lower and upper boundaries of (t0, u0, tE), shape (nevents, 3, 2)
+        guess       array   Starting values of (t0, u0, tE), shape (nevents, 3)
+        blend       bool    If False, the blend flux is fixed at zero
+        loss        str     Loss function, 'soft_l1' or 'linear'
+        max_iter    int     Maximum number of iterations
+        tol         float   Convergence tolerance on the relative change in cost
+
+    Returns:
+        results     dict    Arrays of the fitted (t0, u0, tE), fluxes fs and fb per telescope, the chi2
+                            and cost of each event, and the number of iterations taken
+    """
+
+    time = packed['time']
+    flux = packed['flux']
+    weight = packed['weight']
+    tel = packed['tel']
+    ntel = max(int(packed['ntel'].max(initial=1)), 1)
+    nevents = time.shape[0]
+    sigma_inv = np.sqrt(weight)
+
+    def evaluate(p):
+        t0, u0, tE = (p[:, i:i+1] for i in range(3))
+        A, dA = magnification_derivatives(time, t0, u0, tE)
+        A = np.where(weight > 0.0, A, 1.0)
+        fs, fb = solve_linear_fluxes(A, flux, weight, tel, ntel, blend=blend)
+        fs_pt = np.take_along_axis(fs, tel, axis=1)
+        fb_pt = np.take_along_axis(fb, tel, axis=1)
+        chi = (flux - (fs_pt * A + fb_pt)) * sigma_inv
+        cost = np.sum(loss_function(chi, loss) * (weight > 0.0), axis=1)
+        return chi, cost, A, dA, fs, fb, fs_pt
+
+    p = np.array(guess, dtype=float).reshape(nevents, 3)
+    p = np.clip(p, bounds[:, :, 0], bounds[:, :, 1])
+    chi, cost, A, dA, fs, fb, fs_pt = evaluate(p)
+    damping = np.full(nevents, 1e-3)
+    active = np.ones(nevents, dtype=bool)
+    niter = np.zeros(nevents, dtype=int)
+
+    for iteration in range(max_iter):
+        if not active.any():
+            break
+
+        # Jacobian of the normalized residuals with respect to (t0, u0, tE), shape (nevents, nmax, 3),
+        # reweighted for the robust loss function.  Since the fluxes are solved for at each step, the
+        # component of each column that can be absorbed by the fluxes is projected out (Kaufman's
+        # variable projection)
+        if loss == 'soft_l1':
+            rho = 1.0 / np.sqrt(np.sqrt(1.0 + chi**2))
+        else:
+            rho = np.ones_like(chi)
+        scale = np.nan_to_num(sigma_inv * rho)
+        J = np.stack([project_flux_basis(-fs_pt * np.nan_to_num(d) * scale, np.nan_to_num(A) * scale, scale,
+                                         tel, ntel, blend=blend) for d in dA], axis=-1)
+        r = np.nan_to_num(chi * rho)
+
+        JTJ = np.einsum('eni,enj->eij', J, J)
+        JTr = np.einsum('eni,en->ei', J, r)
+
+        diag = np.einsum('eii->ei', JTJ)
+        lhs = JTJ + damping[:, np.newaxis, np.newaxis] * np.eye(3) * (diag + 1e-12)[:, :, np.newaxis]
+        try:
+            step = -np.linalg.solve(lhs, JTr[:, :, np.newaxis])[:, :, 0]
+        except np.linalg.LinAlgError:
+            step = -np.einsum('eij,ej->ei', np.linalg.pinv(lhs), JTr)
+        step[~active] = 0.0
+        step = np.nan_to_num(step)
+
+        p_trial = np.clip(p + step, bounds[:, :, 0], bounds[:, :, 1])
+        chi_trial, cost_trial, A_trial, dA_trial, fs_trial, fb_trial, fs_pt_trial = evaluate(p_trial)
+
+        improved = active & np.isfinite(cost_trial) & (cost_trial < cost)
+        converged = improved & ((cost - cost_trial) < tol * cost)
+
+        p[improved] = p_trial[improved]
+        chi[improved] = chi_trial[improved]
+        fs[improved] = fs_trial[improved]
+        fb[improved] = fb_trial[improved]
+        fs_pt[improved] = fs_pt_trial[improved]
+        A[improved] = A_trial[improved]
+        for d, d_trial in zip(dA, dA_trial):
+            d[improved] = d_trial[improved]
+        cost[improved] = cost_trial[improved]
+        niter[active] += 1
+
+        damping = np.where(improved, damping / 10.0, damping * 10.0)
+        active = active & ~converged & (damping < 1e10)
+
+    results = {
+        't0': p[:, 0], 'u0': p[:, 1], 'tE': p[:, 2],
+        'fs': fs, 'fb': fb,
+        'chi2': np.sum(np.nan_to_num(chi)**2, axis=1),
+        'cost': cost,
+        'niter': niter
+    }
+
+    return results
+
+def pspl_covariance(lightcurves, t0, u0, tE, fs, fb, blend=True):
+    """
+    Function to calculate the covariance matrix of a PSPL model of a single event, for the full set of
+    parameters in pyLIMA order: t0, u0, tE, then the source (and blend) flux of each telescope.
+    The matrix is scaled by the reduced chi2, following pyLIMA's TRF fit.
+
+    Parameters:
+        lightcurves list    Arrays of (time, mag, mag_error) for each telescope
+        t0, u0, tE  float   Fitted PSPL parameters
+        fs, fb      array   Fitted source and blend fluxes of each telescope
+        blend       bool    If False, the blend fluxes are not parameters of the model
+
+    Returns:
+        covariance  array   Covariance matrix
+    """
+
+    nflux = 2 if blend else 1
+    nparams = 3 + nflux * len(lightcurves)
+    JTJ = np.zeros((nparams, nparams))
+    chi2 = 0.0
+    ndata = 0
+
+    for k, lc in enumerate(lightcurves):
+        lc = np.asarray(lc, dtype=float)
+        flux = mag_to_flux(lc[:, 1])
+        sigma = lc[:, 2] * flux * np.log(10.0) / 2.5
+        A, dA = magnification_derivatives(lc[:, 0], t0, u0, tE)
+
+        J = np.zeros((len(lc), nparams))
+        for i in range(3):
+            J[:, i] = fs[k] * dA[i] / sigma
+        J[:, 3 + nflux * k] = A / sigma
+        if blend:
+            J[:, 4 + nflux * k] = 1.0 / sigma
+
+        JTJ += np.dot(J.T, J)
+        chi2 += np.sum(((flux - (fs[k] * A + fb[k])) / sigma)**2)
+        ndata += len(lc)
+
+    covariance = np.linalg.pinv(JTJ)
+    if ndata > nparams:
+        covariance *= chi2 / (ndata - nparams)
+
+    return covariance
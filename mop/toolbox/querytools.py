@@ -1,56 +1,71 @@
 from tom_dataproducts.models import ReducedDatum
 from tom_targets.models import Target,TargetExtra,TargetName, TargetList
 from mop.toolbox.mop_classes import MicrolensingEvent
-from mop.toolbox import utilities
+from mop.toolbox import utilities, photometry_cache
+from mop.models import EventSummary
 import logging
 import datetime
+import itertools
 from django.db import connection
+from django.db.models import Exists, OuterRef, Q
 import numpy as np
 
 logger = logging.getLogger(__name__)
 
+def extra_exists(key, **lookups):
+    """
+    Function to build a subquery which tests whether a Target has a TargetExtra with the given key
+    whose value matches the given field lookups, for use in filtering Targets.  Combining these
+    conditions in a single query selects the Targets meeting all criteria in the database,
+    rather than retrieving every TargetExtra matching each criterion.
+
+    Parameters:
+        key     str     Key of the TargetExtra
+        lookups         Field lookups applied to the TargetExtra, e.g. value__icontains='Microlensing'
+
+    Returns:
+        condition   Exists  Condition to pass to Target.objects.filter
+    """
+
+    return Exists(TargetExtra.objects.filter(target=OuterRef('pk'), key=key, **lookups))
+
+def alive_microlensing():
+    """
+    Function to build the condition selecting Targets which are classified as microlensing events
+    and are currently alive, from their EventSummary.  Further criteria on the summary can be
+    combined with this condition in the same query.
+
+    Returns:
+        condition   Q   Condition to pass to Target.objects.filter
+    """
+
+    return Q(event_summary__alive=True, event_summary__classification=EventSummary.CLASS_MICROLENSING)
+
 def fetch_alive_events_outside_HCZ(with_atomic=True):
     """
     Function to retrieve Targets that are classified as microlensing events that are currently ongoing.
     """
 
+    qs = Target.objects.filter(alive_microlensing(), event_summary__outside_hcz=True)
     if with_atomic:
-        ts1 = TargetExtra.objects.prefetch_related('target').select_for_update(skip_locked=True).filter(
-            key='Classification', value__icontains='Microlensing'
-        )
-        ts2 = TargetExtra.objects.prefetch_related('target').select_for_update(skip_locked=True).filter(
-            key='Alive', value=True
-        )
-        ts3 = TargetExtra.objects.prefetch_related('target').select_for_update(skip_locked=True).filter(
-            key='Sky_location', value__icontains='Outside HCZ'
-        )
+        qs = qs.select_for_update(skip_locked=True)
 
-    else:
-        ts1 = TargetExtra.objects.prefetch_related('target').filter(
-            key='Classification', value__icontains='Microlensing'
-        )
-        ts2 = TargetExtra.objects.prefetch_related('target').filter(
-            key='Alive', value=True
-        )
-        ts3 = TargetExtra.objects.prefetch_related('target').filter(
-            key='Sky_location', value__icontains='Outside HCZ'
-        )
-    logger.info('queryTools: Initial queries selected '
-                + str(ts1.count()) + ' events classified as microlensing, '
-                + str(ts2.count()) + ' events currently Alive, and '
-                + str(ts3.count()) + ' events outside the HCZ')
+    target_set = list(qs)
+    logger.info('queryTools: Selected ' + str(len(target_set))
+                + ' alive events classified as microlensing outside the HCZ')
     utilities.checkpoint()
 
-    # This doesn't directly produce a queryset of targets, instead it returns a queryset of target IDs.
-    # So we have to extract the corresponding targets:
-    targets1 = [x.target for x in ts1]
-    targets2 = [x.target for x in ts2]
-    targets3 = [x.target for x in ts3]
-    target_set = list(set(targets1).intersection(
-        set(targets2)
-    ).intersection(
-        set(targets3)
-    ))
+    return target_set
+
+def fetch_alive_events_in_category(category):
+    """
+    Function to retrieve Targets that are classified as microlensing events that are currently ongoing,
+    and have been assigned the given Category, for example by TAP.categorize_event_timescale
+    """
+
+    target_set = list(Target.objects.filter(alive_microlensing(), event_summary__category=category))
+    logger.info('queryTools: Selected ' + str(len(target_set))
+                + ' alive events classified as microlensing in category ' + category)
 
     return target_set
 
@@ -99,18 +114,70 @@ def get_alive_events_outside_HCZ(option):
 
     return target_data
 
+def group_by_target(qs, chunk_size=2000):
+    """
+    Function to stream the rows of a queryset ordered by target ID, grouping them by target in a
+    single pass.  This replaces a separate query for the rows of each target.
+
+    Parameters:
+        qs          QuerySet    Rows with a target foreign key, ordered by target_id first
+        chunk_size  int         Number of rows fetched from the database at a time
+
+    Returns:
+        groups      dict        Lists of rows indexed by target ID.  Targets without rows are omitted
+    """
+
+    groups = {}
+    for target_id, rows in itertools.groupby(qs.iterator(chunk_size=chunk_size), key=lambda x: x.target_id):
+        groups[target_id] = list(rows)
+
+    return groups
+
+def fetch_reduced_data(target_list):
+    """
+    Function to retrieve the photometric ReducedDatums of a set of targets with a single query, grouped
+    by target.  The lightcurves of targets whose photometry is held in the photometry cache are taken
+    from the cache, so their ReducedDatums are not retrieved.  Other data products are loaded by each
+    MicrolensingEvent on demand.
+
+    Parameters:
+        target_list     list    Targets
+
+    Returns:
+        datums          dict    Lists of photometric ReducedDatums in time order, indexed by target ID
+        photometry      dict    Cached photometry, indexed by target ID, see photometry_cache
+        generations     dict    Generation of the photometry of each target, indexed by target ID,
+                                to be stored with the photometry of the targets not cached
+    """
+
+    (photometry, generations) = photometry_cache.lookup_photometry(target_list)
+
+    uncached = [t for t in target_list if t.pk not in photometry]
+    datums = {}
+    if len(uncached) > 0:
+        datums = group_by_target(
+            ReducedDatum.objects.filter(target__in=uncached, data_type='photometry').order_by('target_id', 'timestamp')
+        )
+
+    return datums, photometry, generations
+
 def fetch_data_for_targetset(target_list, check_need_to_fit=True, fetch_photometry=True):
     """
-    Function to retrieve all TargetExtra and ReducedDatums associated with a set of targets
+    Function to retrieve all TargetExtra and ReducedDatums associated with a set of targets.
+    Each table is queried once for the whole set, and the rows are collated by target.
+    If fetch_photometry is False, the photometry of each event is instead loaded when it is first accessed.
     """
     t1 = datetime.datetime.utcnow()
 
     # Perform the search for associated data
-    target_extras = TargetExtra.objects.filter(
-        target__in=target_list
+    target_extras = group_by_target(
+        TargetExtra.objects.filter(target__in=target_list).order_by('target_id')
+    )
+    names = group_by_target(
+        TargetName.objects.filter(target__in=target_list).order_by('target_id')
     )
-    datums = ReducedDatum.objects.filter(target__in=target_list).order_by("timestamp")
-    names = TargetName.objects.filter(target__in=target_list)
+    if fetch_photometry:
+        (datums, photometry, generations) = fetch_reduced_data(target_list)
 
     t2 = datetime.datetime.utcnow()
     logger.info('queryTools: Retrieved associated data for ' + str(len(target_list)) + ' Targets')
@@ -121,12 +188,17 @@ def fetch_data_for_targetset(target_list, check_need_to_fit=True, fetch_photomet
     # data products for later use
     logger.info('queryTools: collating data on microlensing event set')
     target_data = {}
+    uncached = {}
     for i, t in enumerate(target_list):
         mulens = MicrolensingEvent(t)
-        mulens.set_target_names(names.filter(target=t))
-        mulens.set_extra_params(target_extras.filter(target=t))
+        mulens.set_target_names(names.get(t.pk, []))
+        mulens.set_extra_params(target_extras.get(t.pk, []))
         if fetch_photometry:
-            mulens.set_reduced_data(datums.filter(target=t))
+            mulens.set_reduced_data(datums.get(t.pk, []), photometry=photometry.get(t.pk))
+            if t.pk not in photometry:
+                uncached[t] = photometry_cache.pack_photometry(mulens.datasets, mulens.first_observation,
+                                                               mulens.last_observation,
+                                                               generation=generations.get(t.pk))
         if check_need_to_fit:
             (status, reason) = mulens.check_need_to_fit()
             logger.info('queryTools: Need to fit: ' + repr(status) + ', reason: ' + reason)
@@ -140,6 +212,8 @@ def fetch_data_for_targetset(target_list, check_need_to_fit=True, fetch_photomet
                     + str(i) + ' out of ' + str(len(target_list)))
         utilities.checkpoint()
 
+    photometry_cache.store_photometry(uncached)
+
     t3 = datetime.datetime.utcnow()
     logger.info('queryTools: Collated data for ' + str(len(target_data)) + ' targets in ' + str(t3 - t2))
     utilities.checkpoint()
@@ -151,65 +225,17 @@ def fetch_priority_targets(priority_key, priority_threshold):
     the given threshold.  Different priority keys are specified in the extra_fields and can
     be used as selection keys. """
 
-    # First fetch a list of TargetExtra entries where the priority exceeds the threshold.
-    # This returns a list of Target pk interger values.
-    ts1 = TargetExtra.objects.prefetch_related('target').filter(
-        key=priority_key, float_value__gt=priority_threshold
-    ).exclude(
-        value=np.nan
-    ).exclude(
-        value__exact=''
-    ).exclude(
-        value__exact='None'
-    )
-    ts2 = TargetExtra.objects.prefetch_related('target').filter(
-        key='Sky_location', value__icontains='Outside HCZ'
-    )
-    ts3 = TargetExtra.objects.prefetch_related('target').filter(
-        key='Classification', value__icontains='Microlensing'
-    )
-    ts4 = TargetExtra.objects.prefetch_related('target').filter(
-        key='YSO', value=False
-    )
-    ts5 = TargetExtra.objects.prefetch_related('target').filter(
-        key='QSO', value=False
-    )
-    ts6 = TargetExtra.objects.prefetch_related('target').filter(
-        key='galaxy', value=False
-    )
-    ts7 = TargetExtra.objects.prefetch_related('target').filter(
-        key='Alive', value=True
-    )
-
-    logger.info('QueryTools: Got ' + str(ts1.count()) + ' targets above priority threshold, '
-          + str(ts2.count()) + ' targets outside the HCZ, '
-          + str(ts3.count()) + ' targets classified as microlensing, '
-          + str(ts4.count()) + ' targets not YSOs, '
-          + str(ts5.count()) + ' targets not QSOs, '
-          + str(ts6.count()) + ' targets not galaxies, '
-          + str(ts7.count()) + ' targets that are currently Alive')
-
-    # Find the intersection of the target sets:
-    targets1 = [x.target for x in ts1]
-    targets2 = [x.target for x in ts2]
-    targets3 = [x.target for x in ts3]
-    targets4 = [x.target for x in ts4]
-    targets5 = [x.target for x in ts5]
-    targets6 = [x.target for x in ts6]
-    targets7 = [x.target for x in ts7]
-
-    target_list = list(set(targets1).intersection(
-        set(targets2)
-    ).intersection(
-        set(targets3)
-    ).intersection(
-        set(targets4)
-    ).intersection(
-        set(targets5)
-    ).intersection(
-        set(targets6)
-    ).intersection(
-        set(targets7)
+    # Targets whose priority exceeds the threshold.  Invalid priority values are held as null
+    # in the event summary, so they are never selected
+    priority_field = 'event_summary__' + EventSummary.EXTRA_FIELDS[priority_key]
+
+    target_list = list(Target.objects.filter(
+        alive_microlensing(),
+        event_summary__outside_hcz=True,
+        event_summary__yso=False,
+        event_summary__qso=False,
+        event_summary__galaxy=False,
+        **{priority_field + '__gt': priority_threshold}
     ))
     logger.info('QueryTools: identified ' + str(len(target_list)) + ' targets')
 
@@ -227,26 +253,14 @@ def get_gaia_alive_events():
     logger.info('queryTools: checkpoint 1')
     utilities.checkpoint()
 
-   # Search TargetExtras to identify alive microlensing events outside the HCZ
-    ts1 = TargetExtra.objects.prefetch_related('target').select_for_update(skip_locked=True).filter(
-        key='Classification', value__icontains='Microlensing'
-    )
-    ts2 = TargetExtra.objects.prefetch_related('target').select_for_update(skip_locked=True).filter(
-        key='Alive', value=True
-    )
-    logger.info('queryTools: Initial queries selected '
-                + str(ts1.count()) + ' events classified as microlensing, '
-                + str(ts2.count()) + ' events currently Alive')
+    # Search TargetExtras to identify alive microlensing events from Gaia
+    target_list = list(Target.objects.select_for_update(skip_locked=True).filter(
+        alive_microlensing(),
+        name__contains='Gaia'
+    ))
     t2 = datetime.datetime.utcnow()
     utilities.checkpoint()
 
-    # This doesn't directly produce a queryset of targets, instead it returns a queryset of target IDs.
-    # So we have to extract the corresponding targets.
-    # In the process, filter out any events that are not from Gaia
-    targets1 = [x.target for x in ts1 if 'Gaia' in x.target.name]
-    targets2 = [x.target for x in ts2 if 'Gaia' in x.target.name]
-    target_list = list(set(targets1).intersection(set(targets2)))
-
     logger.info('queryTools: Initial target list has ' + str(len(target_list)) + ' entries')
 
     # Now gather any TargetExtra and ReducedDatums associated with these targets.
@@ -266,11 +280,8 @@ def get_targetlist_alive_events(targetlist_name='all'):
     """
 
     # Options include 'all' targets, in which case we fetch all alive microlensing events
-    target_set = fetch_alive_events_outside_HCZ(with_atomic=False)
+    qs = Target.objects.filter(alive_microlensing(), event_summary__outside_hcz=True)
     if targetlist_name != 'all':
-        targets = TargetList.objects.get(id=targetlist_name)
-        targets = targets.targets.all()
-
-        target_set = list(set(target_set).intersection(set(targets)))
+        qs = qs.filter(targetlist__id=targetlist_name)
 
-    return target_set
\ No newline at end of file
+    return list(qs)
\ No newline at end of file
@@ -1,10 +1,13 @@
 from tom_targets.models import Target
 from astropy.coordinates import SkyCoord, Galactic
 from astropy import units as u
+from astropy.time import Time
 from django.contrib.auth.models import Group, User
 from django.db import connection
 from guardian.shortcuts import assign_perm
 import datetime
+import erfa
+import numpy as np
 import os
 import logging
 import psutil
@@ -75,3 +78,57 @@ def checkpoint():
                 + str(len(connection.queries)) + ', memory: '
                 + str(round(psutil.Process(os.getpid()).memory_info().rss / 1048576, 2)) + 'MiB')
 
+
+def datetimes_to_jd(timestamps):
+    """
+    Function to convert a sequence of datetimes to Julian Dates in a single vectorized call, rather than
+    creating a Time object for each timestamp.  The results are identical to Time(timestamp).jd.
+
+    Parameters:
+        timestamps  list    datetime objects, naive (UTC) or timezone-aware
+
+    Returns:
+        jd          array   Julian Dates (UTC)
+    """
+
+    if len(timestamps) == 0:
+        return np.array([], dtype=float)
+
+    return Time(list(timestamps), format='datetime', scale='utc').jd
+
+def jd_to_datetimes(jd, timezone=None):
+    """
+    Function to convert an array of Julian Dates to datetimes in a single vectorized call, rather than
+    creating a Time object for each timestamp.  The results are identical to
+    Time(jd, format='jd', scale='utc').to_datetime(timezone=timezone), except that timestamps
+    within a leap second are rounded to the following second.
+
+    Parameters:
+        jd          array   Julian Dates (UTC)
+        timezone    tzinfo  Optional timezone, for example astropy.time.TimezoneInfo().  If given, the
+                            datetimes returned are timezone-aware
+
+    Returns:
+        timestamps  list    datetime objects
+    """
+
+    jd = np.atleast_1d(np.asarray(jd, dtype=float))
+    if len(jd) == 0:
+        return []
+
+    t = Time(jd, format='jd', scale='utc')
+    (iys, ims, ids, ihmsfs) = erfa.d2dtf(b'UTC', 6, t.jd1, t.jd2)
+
+    timestamps = []
+    for (iy, im, id, ihr, imin, isec, ifrac) in zip(iys.tolist(), ims.tolist(), ids.tolist(),
+                                                    ihmsfs['h'].tolist(), ihmsfs['m'].tolist(),
+                                                    ihmsfs['s'].tolist(), ihmsfs['f'].tolist()):
+        in_leap_second = (isec >= 60)
+        dt = datetime.datetime(iy, im, id, ihr, imin, isec - 1 if in_leap_second else isec, ifrac)
+        if timezone is not None:
+            dt = dt.replace(tzinfo=datetime.timezone.utc).astimezone(timezone)
+        if in_leap_second:
+            dt += datetime.timedelta(seconds=1)
+        timestamps.append(dt)
+
+    return timestamps
@@ -0,0 +1,99 @@
+from django.test import TestCase
+from tom_targets.tests.factories import SiderealTargetFactory
+from tom_targets.models import Target, TargetExtra
+from tom_dataproducts.models import ReducedDatum
+from mop.models import EventSummary
+from mop.toolbox import querytools
+from mop.management.commands.backfill_event_summary import backfill_event_summaries
+from astropy.time import Time, TimezoneInfo
+from django.apps import apps
+import importlib
+import numpy as np
+
+class TestEventSummary(TestCase):
+    def setUp(self):
+        self.target = SiderealTargetFactory.create()
+        self.target.name = 'Gaia23sum'
+        self.target.save()
+
+        self.extras = {'Classification': 'Microlensing PSPL', 'Alive': True, 'Sky_location': 'Outside HCZ',
+                       'Category': 'Microlensing long-tE', 'YSO': False, 'QSO': False, 'galaxy': False,
+                       't0': 2460005.0, 'tE': 150.0, 'TAP_priority': 'nan', 'TAP_priority_longtE': 25.0,
+                       'Last_fit': 2460010.5, 'Gmag': 15.0}
+        for key, value in self.extras.items():
+            self.set_extra(key, value)
+
+        for jd in np.arange(2460000.0, 2460010.0):
+            ReducedDatum.objects.create(
+                timestamp=Time(jd, format='jd', scale='utc').to_datetime(timezone=TimezoneInfo()),
+                value={'magnitude': 17.0, 'filter': 'G', 'error': 0.01},
+                source_name='Gaia',
+                source_location=self.target.name,
+                data_type='photometry',
+                target=self.target
+            )
+
+    def set_extra(self, key, value):
+        (extra, created) = TargetExtra.objects.get_or_create(target=self.target, key=key)
+        extra.value = value
+        extra.save()
+
+    def test_summary_maintained(self):
+
+        summary = EventSummary.objects.get(target=self.target)
+        assert(summary.alive == True)
+        assert(summary.classification == EventSummary.CLASS_MICROLENSING)
+        assert(summary.category == 'Microlensing long-tE')
+        assert(summary.outside_hcz)
+        assert(summary.yso == False)
+        assert(summary.tE == 150.0)
+        assert(summary.tap_priority is None)
+        assert(summary.tap_priority_longte == 25.0)
+        assert(summary.last_fit_jd == 2460010.5)
+
+        self.set_extra('Alive', False)
+        self.set_extra('Classification', 'Unclassified variable')
+        summary.refresh_from_db()
+        assert(summary.alive == False)
+        assert(summary.classification == EventSummary.CLASS_UNCLASSIFIED)
+
+        TargetExtra.objects.filter(target=self.target, key='tE').delete()
+        summary.refresh_from_db()
+        assert(summary.tE is None)
+
+        # Alive microlensing events are selected from the summaries
+        self.set_extra('Alive', True)
+        self.set_extra('Classification', 'Microlensing binary')
+        assert(querytools.fetch_priority_targets('TAP_priority_longtE', 10.0) == [self.target])
+        assert(querytools.fetch_priority_targets('TAP_priority', 10.0) == [])
+
+    def test_backfill_event_summaries(self):
+
+        maintained = EventSummary.objects.get(target=self.target)
+        EventSummary.objects.all().delete()
+
+        nsummaries = backfill_event_summaries(chunk_size=1)
+        assert(nsummaries == Target.objects.count())
+
+        summary = EventSummary.objects.get(target=self.target)
+        for field in EventSummary.EXTRA_FIELDS.values():
+            assert(getattr(summary, field) == getattr(maintained, field))
+        assert(abs(summary.last_obs_jd - 2460009.0) < 1e-6)
+
+        # Backfilling again updates the existing summaries
+        TargetExtra.objects.filter(target=self.target, key='Alive').update(value='False')
+        backfill_event_summaries()
+        summary.refresh_from_db()
+        assert(summary.alive == False)
+
+    def test_migration_backfill(self):
+
+        # Targets created before the summary table existed are not selected until they are summarised
+        EventSummary.objects.all().delete()
+        assert(querytools.fetch_priority_targets('TAP_priority_longtE', 10.0) == [])
+
+        migration = importlib.import_module('mop.migrations.0006_eventsummary')
+        migration.backfill_event_summaries(apps, None)
+
+        assert(EventSummary.objects.count() == Target.objects.count())
+        assert(querytools.fetch_priority_targets('TAP_priority_longtE', 10.0) == [self.target])
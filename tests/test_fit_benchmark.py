@@ -0,0 +1,59 @@
+from django.test import TestCase
+from mop.toolbox import fit_benchmark, fittools
+import numpy as np
+import json
+import os
+import tempfile
+
+class TestFitBenchmark(TestCase):
+    def setUp(self):
+        self.config = fit_benchmark.benchmark_case('multi_survey')
+
+    def test_synthetic_event(self):
+
+        (datasets, truth) = fit_benchmark.synthetic_event(self.config, np.random.default_rng(1))
+
+        assert(len(datasets) == self.config['ndatasets'])
+        for name, lc in datasets.items():
+            assert(lc.shape == (self.config['ndata'] // self.config['ndatasets'], 3))
+            assert((np.diff(lc[:, 0]) >= 0.0).all())
+            assert((lc[:, 2] > 0.0).all())
+
+        # The event peaks close to t0 in the reference dataset
+        lc = datasets['I']
+        assert(abs(lc[np.argmin(lc[:, 1]), 0] - truth['t0']) < truth['tE'])
+
+        # The same seed reproduces the same photometry
+        (datasets2, truth2) = fit_benchmark.synthetic_event(self.config, np.random.default_rng(1))
+        assert((datasets2['I'] == datasets['I']).all())
+
+    def test_run_benchmark_case(self):
+
+        fit_function = fittools.fit_pspl_omega2
+        result = fit_benchmark.run_benchmark_case(fit_benchmark.benchmark_case('sparse'), repeats=2)
+
+        # The instrumented functions are restored after the benchmark
+        assert(fittools.fit_pspl_omega2 is fit_function)
+
+        assert(len(result['runs']) == 2)
+        for run in result['runs']:
+            assert(run['success'])
+            assert(run['nfev'] > 0)
+            assert(run['wall_time'] >= run['stages']['generate_model_lightcurve']['time'] > 0.0)
+            assert(abs(run['recovery']['tE']['offset']) < 0.2 * run['recovery']['tE']['true'])
+        assert(result['summary']['success_rate'] == 1.0)
+
+    def test_report(self):
+
+        report = fit_benchmark.run_benchmark(case_names=['sparse'], repeats=1)
+
+        with tempfile.TemporaryDirectory() as tmp_dir:
+            file_path = os.path.join(tmp_dir, 'benchmark.json')
+            fit_benchmark.write_report(report, file_path)
+            report2 = fit_benchmark.read_report(file_path)
+
+        assert(report2['cases'][0]['summary'] == json.loads(json.dumps(report['cases'][0]['summary'])))
+
+        comparison = fit_benchmark.compare_reports(report2, report)
+        assert(comparison[0]['name'] == 'sparse')
+        assert(comparison[0]['wall_time_ratio'] == 1.0)
@@ -0,0 +1,128 @@
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from tom_targets.tests.factories import SiderealTargetFactory
+from tom_targets.models import TargetExtra
+from mop.models import FitResultCache
+from mop.toolbox import fit_cache, photometry_cache
+from mop.toolbox.mop_classes import MicrolensingEvent
+from mop.management.commands.fit_need_events_PSPL import run_fit
+from unittest import mock
+import numpy as np
+import datetime
+
+class TestFitCache(TestCase):
+    def setUp(self):
+        self.target = SiderealTargetFactory.create()
+        self.target.name = 'Gaia23abc'
+        self.target.save()
+
+        t = np.linspace(2460000.0, 2460100.0, 50)
+        self.datasets = {
+            'G': np.column_stack((t, np.full(len(t), 17.0), np.full(len(t), 0.01)))
+        }
+
+        self.model_params = {
+            't0': 2460050.0, 't0_error': 0.1, 'u0': 0.2, 'u0_error': 0.01, 'tE': 25.0, 'tE_error': 0.5,
+            'piEN': np.nan, 'piEN_error': np.nan, 'piEE': np.nan, 'piEE_error': np.nan,
+            'Source_magnitude': np.float64(17.5), 'Source_mag_error': 0.01,
+            'Blend_magnitude': np.nan, 'Blend_mag_error': np.nan,
+            'Baseline_magnitude': 17.0, 'Baseline_mag_error': 0.01,
+            'Fit_covariance': np.eye(4), 'chi2': 45.0, 'red_chi2': 0.98,
+            'KS_test': np.nan, 'AD_test': np.nan, 'SW_test': np.nan
+        }
+        self.model_lightcurve = (np.linspace(2460000.0, 2460100.0, 10), np.full(10, 17.0))
+
+    def test_fit_cache_key(self):
+
+        key = fit_cache.fit_cache_key(self.datasets)
+        assert(key == fit_cache.fit_cache_key({'G': self.datasets['G'][::-1]}))
+
+        # Any change to the photometry or the fit configuration changes the key
+        datasets = {'G': self.datasets['G'].copy()}
+        datasets['G'][0, 1] += 0.01
+        assert(key != fit_cache.fit_cache_key(datasets))
+        assert(key != fit_cache.fit_cache_key(self.datasets, emag_limit=0.1))
+        assert(key != fit_cache.fit_cache_key(self.datasets, fitter=fit_cache.FITTER_LINEAR_FLUXES))
+        assert(key != fit_cache.fit_cache_key(self.datasets, max_nfev=1000))
+        with override_settings(FIT_RESIDUAL_STATISTICS=True):
+            assert(key != fit_cache.fit_cache_key(self.datasets))
+
+        # Fits seeded from different previous fits search different boundaries
+        warm_start = {key: self.model_params[key] for key in ['t0', 'u0', 'tE', 't0_error', 'u0_error', 'tE_error']}
+        warm_key = fit_cache.fit_cache_key(self.datasets, warm_start=warm_start)
+        assert(warm_key != key)
+        assert(warm_key == fit_cache.fit_cache_key(self.datasets, warm_start=dict(warm_start)))
+        warm_start['tE_error'] = 5.0
+        assert(warm_key != fit_cache.fit_cache_key(self.datasets, warm_start=warm_start))
+
+    def test_store_fit(self):
+
+        key = fit_cache.fit_cache_key(self.datasets)
+        assert(fit_cache.lookup_fit(key) is None)
+
+        fit_cache.store_fit(key, self.target, self.model_params, self.model_lightcurve)
+
+        (model_params, model_lightcurve) = fit_cache.lookup_fit(key)
+        assert(model_params['tE'] == self.model_params['tE'])
+        assert(np.isnan(model_params['piEN']))
+        assert(type(model_params['Fit_covariance']) == type(np.array([])))
+        assert((model_params['Fit_covariance'] == self.model_params['Fit_covariance']).all())
+        assert((model_lightcurve[0] == self.model_lightcurve[0]).all())
+        assert(FitResultCache.objects.get(key=key).hits == 1)
+
+    def test_evict_fits(self):
+
+        keys = []
+        for i in range(4):
+            key = 'key' + str(i)
+            fit_cache.store_fit(key, self.target, self.model_params, self.model_lightcurve)
+            FitResultCache.objects.filter(key=key).update(last_used=timezone.now() - datetime.timedelta(seconds=10 - i))
+            keys.append(key)
+
+        # The least recently used entries are evicted first
+        fit_cache.lookup_fit(keys[0])
+        assert(fit_cache.evict_fits(max_entries=2) == 2)
+        assert(set(FitResultCache.objects.values_list('key', flat=True)) == set([keys[0], keys[3]]))
+
+        size = FitResultCache.objects.get(key=keys[0]).size
+        assert(fit_cache.evict_fits(max_size=size) == 1)
+        assert(list(FitResultCache.objects.values_list('key', flat=True)) == [keys[0]])
+
+    def test_run_fit_cached(self):
+
+        mulens = MicrolensingEvent(self.target)
+        mulens.set_extra_params(TargetExtra.objects.filter(target=self.target))
+        mulens.datasets = self.datasets
+        mulens.ndata = len(self.datasets['G'])
+        mulens.last_observation = self.datasets['G'][:, 0].max()
+
+        # A cached result is stored without re-fitting the event
+        key = fit_cache.fit_cache_key(self.datasets)
+        fit_cache.store_fit(key, self.target, self.model_params, self.model_lightcurve)
+
+        assert(run_fit(mulens))
+        assert(float(TargetExtra.objects.get(target=self.target, key='tE').value) == self.model_params['tE'])
+        assert(mulens.existing_model is not None)
+
+    def test_clean_datasets_cached(self):
+
+        photometry_cache.photometry_cache().clear()
+        mulens = MicrolensingEvent(self.target)
+        mulens.datasets = self.datasets
+
+        # The cleaned lightcurves are only recalculated when the event's lightcurves change
+        cleaned = mulens.get_clean_datasets()
+        assert(len(cleaned['G']) == len(self.datasets['G']))
+        assert(mulens.get_clean_datasets() is cleaned)
+
+        mulens.datasets = {'G': self.datasets['G'][0:20]}
+        assert(len(mulens.get_clean_datasets()['G']) == 20)
+
+        # Other instances of the event, for example in another process, re-use the cleaned lightcurves
+        # of the same photometry from the cache
+        other = MicrolensingEvent(self.target)
+        other.datasets = {'G': self.datasets['G'][0:20].copy()}
+        with mock.patch('mop.toolbox.fittools.clean_datasets') as clean_datasets:
+            cleaned = other.get_clean_datasets()
+        clean_datasets.assert_not_called()
+        assert((cleaned['G'] == self.datasets['G'][0:20]).all())
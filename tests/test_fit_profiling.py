@@ -0,0 +1,90 @@
+from django.test import TestCase
+from django.utils import timezone
+from tom_targets.tests.factories import SiderealTargetFactory
+from tom_targets.models import TargetExtra
+from mop.models import FitTiming
+from mop.toolbox import fit_profiling, fit_benchmark
+from mop.toolbox.mop_classes import MicrolensingEvent
+from mop.management.commands.fit_need_events_PSPL import run_fit
+import numpy as np
+import datetime
+import json
+import time
+
+class TestFitProfiling(TestCase):
+    def setUp(self):
+        self.target = SiderealTargetFactory.create()
+        self.target.name = 'Gaia23abc'
+        self.target.ra = 270.0
+        self.target.dec = -29.0
+        self.target.save()
+
+    def test_fit_profile(self):
+
+        profile = fit_profiling.FitProfile()
+        with profile.stage('model_1'):
+            time.sleep(0.05)
+            with profile.stage('residual_stats'):
+                time.sleep(0.05)
+                TargetExtra.objects.filter(target=self.target).count()
+        with profile.stage('db_write'):
+            TargetExtra.objects.create(target=self.target, key='test', value='1')
+
+        # Nested stages are excluded from the time and queries of the stage enclosing them
+        assert(0.05 <= profile.timings['model_1'] < 0.09)
+        assert(0.05 <= profile.timings['residual_stats'] < 0.09)
+        assert(profile.queries['model_1'] == 0)
+        assert(profile.queries['residual_stats'] == 1)
+        assert(profile.queries['db_write'] >= 1)
+        self.assertAlmostEqual(profile.total(), sum(profile.timings.values()))
+
+        # Stages are only timed while a profile is active
+        with fit_profiling.fit_stage('model_2'):
+            pass
+        with fit_profiling.active_profile(profile):
+            with fit_profiling.fit_stage('model_2'):
+                pass
+        assert('model_2' in profile.timings)
+        assert(fit_profiling._active_profile.get() is None)
+
+    def test_stage_percentiles(self):
+
+        for i in range(10):
+            profile = fit_profiling.FitProfile()
+            profile.update({'model_1': float(i), 'db_write': 0.1})
+            fit_profiling.store_fit_timing(self.target, profile, fit_status='ok', cached=(i == 9))
+
+        statistics = fit_profiling.stage_percentiles(percentiles=[50, 90])
+        assert(list(statistics.keys()) == ['model_1', 'db_write', 'total'])
+        assert(statistics['model_1']['nfits'] == 9)
+        self.assertAlmostEqual(statistics['model_1']['p50'], 4.0)
+        self.assertAlmostEqual(statistics['total']['p90'], 7.3)
+
+        FitTiming.objects.update(created=timezone.now() - datetime.timedelta(days=10))
+        assert(fit_profiling.stage_percentiles(since=timezone.now() - datetime.timedelta(days=1)) == {})
+        assert(fit_profiling.prune_fit_timings(5) == 10)
+
+    def test_run_fit_profile(self):
+
+        config = fit_benchmark.benchmark_case('sparse')
+        (datasets, truth) = fit_benchmark.synthetic_event(config, np.random.default_rng(1))
+
+        mulens = MicrolensingEvent(self.target)
+        mulens.set_extra_params(TargetExtra.objects.filter(target=self.target))
+        mulens.datasets = datasets
+        mulens.ndata = len(datasets['I'])
+        mulens.last_observation = datasets['I'][:, 0].max()
+
+        assert(run_fit(mulens, use_cache=False))
+
+        timing = FitTiming.objects.get(target=self.target)
+        timings = json.loads(timing.timings)
+        for stage in ['data_clean', 'telescope_build', 'model_1', 'residual_stats',
+                      'lightcurve_generation', 'db_write']:
+            assert(timings[stage] > 0.0)
+        assert(json.loads(timing.queries)['db_write'] > 0)
+        assert(timing.fit_status == 'ok')
+        assert(timing.ndata == mulens.ndata)
+
+        # The event starts a new profile for its next fit
+        assert(mulens.fit_profile.timings == {})
@@ -0,0 +1,131 @@
+from django.test import TestCase
+from django.utils import timezone
+from tom_targets.tests.factories import SiderealTargetFactory
+from mop.models import FitJob
+from mop.toolbox import fit_queue
+import datetime
+
+class TestFitQueue(TestCase):
+    def setUp(self):
+        self.targets = []
+        for i in range(3):
+            st = SiderealTargetFactory.create()
+            st.name = 'Gaia23abc' + str(i)
+            st.save()
+            self.targets.append(st)
+
+    def test_enqueue_fit(self):
+
+        job = fit_queue.enqueue_fit(self.targets[0], reason='test')
+        assert(job.status == FitJob.STATUS_QUEUED)
+
+        # Enqueuing the same target again should not create a duplicate job
+        fit_queue.enqueue_fit(self.targets[0], reason='test again', priority=2)
+        assert(FitJob.objects.filter(target=self.targets[0]).count() == 1)
+        assert(FitJob.objects.get(target=self.targets[0]).priority == 2)
+
+    def test_claim_fit_jobs(self):
+
+        for target in self.targets[0:2]:
+            fit_queue.enqueue_fit(target, reason='test')
+        fit_queue.enqueue_fit(self.targets[2], reason='test', priority=5)
+
+        jobs = fit_queue.claim_fit_jobs('worker1', batch_size=2)
+        assert(len(jobs) == 2)
+        assert(jobs[0].target == self.targets[2])
+        for job in jobs:
+            job.refresh_from_db()
+            assert(job.status == FitJob.STATUS_RUNNING)
+            assert(job.worker == 'worker1')
+            assert(job.attempts == 1)
+
+        # A second worker can only claim the remaining job
+        jobs2 = fit_queue.claim_fit_jobs('worker2', batch_size=2)
+        assert(len(jobs2) == 1)
+        assert(jobs2[0].target not in [job.target for job in jobs])
+
+        assert(len(fit_queue.claim_fit_jobs('worker3')) == 0)
+
+    def test_lease_expiry(self):
+
+        fit_queue.enqueue_fit(self.targets[0], reason='test')
+        jobs = fit_queue.claim_fit_jobs('worker1', lease_time=60)
+
+        # While the lease is held, the job cannot be claimed, and the heartbeat extends the lease
+        assert(len(fit_queue.claim_fit_jobs('worker2')) == 0)
+        assert(fit_queue.heartbeat(jobs, 'worker1', lease_time=60) == 1)
+
+        # Once the lease expires, another worker can reclaim the job, and the original
+        # worker can no longer release it
+        FitJob.objects.filter(pk=jobs[0].pk).update(lease_expires=timezone.now() - datetime.timedelta(seconds=1))
+        jobs2 = fit_queue.claim_fit_jobs('worker2')
+        assert(len(jobs2) == 1)
+        assert(fit_queue.heartbeat(jobs, 'worker1') == 0)
+
+        fit_queue.complete_fit_job(jobs[0], 'worker1')
+        assert(FitJob.objects.get(pk=jobs[0].pk).status == FitJob.STATUS_RUNNING)
+
+        fit_queue.complete_fit_job(jobs2[0], 'worker2')
+        job = FitJob.objects.get(pk=jobs[0].pk)
+        assert(job.status == FitJob.STATUS_DONE)
+        assert(job.attempts == 2)
+
+    def test_requeue_while_running(self):
+
+        fit_queue.enqueue_fit(self.targets[0], reason='test')
+        jobs = fit_queue.claim_fit_jobs('worker1')
+
+        # New data arriving while the event is being fitted should queue a second fit
+        fit_queue.enqueue_fit(self.targets[0], reason='New photometry')
+        assert(FitJob.objects.get(pk=jobs[0].pk).status == FitJob.STATUS_RUNNING)
+
+        fit_queue.complete_fit_job(jobs[0], 'worker1')
+        job = FitJob.objects.get(pk=jobs[0].pk)
+        assert(job.status == FitJob.STATUS_QUEUED)
+        assert(not job.requeued)
+
+    def test_fail_fit_job(self):
+
+        fit_queue.enqueue_fit(self.targets[0], reason='test')
+        jobs = fit_queue.claim_fit_jobs('worker1')
+
+        fit_queue.fail_fit_job(jobs[0], 'worker1', error='Model fit failed', fit_status='timeout')
+        job = FitJob.objects.get(pk=jobs[0].pk)
+        assert(job.status == FitJob.STATUS_QUEUED)
+        assert(job.last_error == 'Model fit failed')
+        assert(job.fit_status == 'timeout')
+        assert(job.failures == 1)
+        assert(job.retry_after > timezone.now())
+
+        # The job is not claimed again until its back-off has elapsed, even if it is queued again
+        fit_queue.enqueue_fit(self.targets[0], reason='retry')
+        assert(len(fit_queue.claim_fit_jobs('worker1')) == 0)
+
+        FitJob.objects.filter(pk=job.pk).update(retry_after=timezone.now() - datetime.timedelta(seconds=1))
+        jobs = fit_queue.claim_fit_jobs('worker1')
+        assert(len(jobs) == 1)
+
+        # A successful fit resets the back-off
+        fit_queue.complete_fit_job(jobs[0], 'worker1')
+        job = FitJob.objects.get(pk=jobs[0].pk)
+        assert(job.status == FitJob.STATUS_DONE)
+        assert(job.fit_status == 'ok')
+        assert(job.failures == 0)
+        assert(job.retry_after is None)
+
+    def test_retry_backoff(self):
+
+        fit_queue.enqueue_fit(self.targets[0], reason='test')
+        for i in range(fit_queue.MAX_FAILURES):
+            FitJob.objects.filter(target=self.targets[0]).update(retry_after=None)
+            jobs = fit_queue.claim_fit_jobs('worker1')
+            fit_queue.fail_fit_job(jobs[0], 'worker1', error='Model fit failed')
+
+        # After repeated failures, the job is no longer retried
+        job = FitJob.objects.get(target=self.targets[0])
+        assert(job.status == FitJob.STATUS_FAILED)
+        assert(job.failures == fit_queue.MAX_FAILURES)
+
+        assert(fit_queue.retry_delay(1).total_seconds() == fit_queue.RETRY_BACKOFF)
+        assert(fit_queue.retry_delay(2).total_seconds() == 2 * fit_queue.RETRY_BACKOFF)
+        assert(fit_queue.retry_delay(100).total_seconds() == fit_queue.MAX_BACKOFF)
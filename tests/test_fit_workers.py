@@ -0,0 +1,94 @@
+from django.test import TestCase
+from tom_targets.tests.factories import SiderealTargetFactory
+import numpy as np
+from os import getcwd, path
+from mop.toolbox import fit_workers
+from mop.toolbox.mop_classes import MicrolensingEvent
+from mop.management.commands import fit_need_events_PSPL
+from unittest import mock
+
+class TestFitWorkers(TestCase):
+    def setUp(self):
+        st1 = SiderealTargetFactory.create()
+        st1.name = 'OGLE-2023-BLG-0348'
+        st1.ra = 271.1925
+        st1.dec = -28.3164
+        lightcurve_file = path.join(getcwd(), 'tests/data/OGLE-2023-BLG-0348_phot.dat')
+        data = np.loadtxt(lightcurve_file)
+        self.mulens = MicrolensingEvent(st1)
+        self.mulens.datasets = {'I': data[:, 0:3]}
+        self.mulens.ndata = len(data)
+
+    def test_build_fit_job(self):
+
+        job = fit_workers.build_fit_job(self.mulens)
+
+        for key in ['name', 'ra', 'dec', 'datasets']:
+            assert(key in job.keys())
+        assert(type(job['ra']) == type(1.0))
+        assert(type(job['datasets']['I']) == type(np.array([])))
+        assert(job['speculative_noblend'] == False)
+
+        job = fit_workers.build_fit_job(self.mulens, speculative_noblend=True)
+        assert(job['speculative_noblend'] == True)
+
+    def test_fit_worker(self):
+
+        job = fit_workers.build_fit_job(self.mulens)
+
+        result = fit_workers.fit_worker(job)
+
+        assert(result['name'] == self.mulens.name)
+        assert(result['model_params'] is not None)
+        assert(len(result['model_lightcurve'][0]) == len(result['model_lightcurve'][1]))
+
+    def test_run_parallel_fits(self):
+
+        jobs = []
+        for i in range(2):
+            job = fit_workers.build_fit_job(self.mulens)
+            job['name'] = self.mulens.name + '_' + str(i)
+            jobs.append(job)
+
+        results = list(fit_workers.run_parallel_fits(jobs, 2))
+
+        assert(len(results) == len(jobs))
+        names = [x['name'] for x in results]
+        for job in jobs:
+            assert(job['name'] in names)
+
+    def test_fit_worker_iteration_limit(self):
+
+        job = fit_workers.build_fit_job(self.mulens, max_nfev=5)
+
+        result = fit_workers.fit_worker(job)
+
+        assert(result['fit_status'] == fit_workers.FIT_ITERATION_LIMIT)
+        assert(result['model_params'] is None)
+
+    def test_run_parallel_fits_time_budget(self):
+
+        jobs = []
+        for i in range(2):
+            job = fit_workers.build_fit_job(self.mulens)
+            job['name'] = self.mulens.name + '_' + str(i)
+            jobs.append(job)
+
+        # No fit can complete within the time budget, so both are terminated by the watchdog
+        results = list(fit_workers.run_parallel_fits(jobs, 2, time_budget=0.01))
+
+        assert(len(results) == len(jobs))
+        for result in results:
+            assert(result['fit_status'] == fit_workers.FIT_TIMEOUT)
+            assert(result['model_params'] is None)
+
+    def test_run_parallel_fits_speculative(self):
+
+        # Each speculative fit takes a second process, so only half the cores are given to workers
+        with mock.patch('mop.toolbox.fit_workers.run_parallel_fits', return_value=iter([])) as run_fits:
+            fit_need_events_PSPL.run_parallel_fits({}, 8, speculative_noblend=True)
+            assert(run_fits.call_args[0][1] == 4)
+            fit_need_events_PSPL.run_parallel_fits({}, 1, speculative_noblend=True)
+            assert(run_fits.call_args[0][1] == 1)
+            fit_need_events_PSPL.run_parallel_fits({}, 8)
+            assert(run_fits.call_args[0][1] == 8)
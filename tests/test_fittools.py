@@ -1,5 +1,5 @@
-from django.test import TestCase
-from unittest import skip
+from django.test import TestCase, override_settings
+from unittest import skip, mock
 from tom_targets.tests.factories import SiderealTargetFactory
 from tom_dataproducts.models import ReducedDatum
 from tom_targets.models import Target, TargetExtra
@@ -15,6 +15,7 @@ from pyLIMA import event
 from pyLIMA import telescopes
 from datetime import datetime
 from collections import OrderedDict
+import json
 
 class TestModelingTools(TestCase):
     def setUp(self):
@@ -116,6 +117,205 @@ class TestModelingTools(TestCase):
 
         self.assertAlmostEqual(model_params['chi2'], 1930.62, places=1)
 
+    def test_fit_pspl_omega2_warm_start(self):
+
+        datasets = self.load_test_photometry(self.params['lightcurve_file'])
+
+        (cold_params, model_lightcurve) = fittools.fit_pspl_omega2(
+                self.params['target'].ra, self.params['target'].dec, datasets)
+
+        warm_start = {key: cold_params[key] for key in ['t0', 'u0', 'tE', 't0_error', 'u0_error', 'tE_error']}
+        (warm_params, model_lightcurve) = fittools.fit_pspl_omega2(
+                self.params['target'].ra, self.params['target'].dec, datasets, warm_start=warm_start)
+
+        self.assertAlmostEqual(warm_params['chi2'], cold_params['chi2'], places=1)
+        self.assertAlmostEqual(warm_params['tE'], cold_params['tE'], places=1)
+
+        # The boundaries of the warm-started fit should have been narrowed around the seed
+        assert(warm_params['fit_parameters']['tE'][1][1] < 3000.0)
+
+    def test_fit_pspl_omega2_linear_fluxes(self):
+
+        datasets = self.load_test_photometry(self.params['lightcurve_file'])
+
+        (model_params, model_lightcurve) = fittools.fit_pspl_omega2(
+                self.params['target'].ra, self.params['target'].dec, datasets)
+
+        (linear_params, linear_lightcurve) = fittools.fit_pspl_omega2(
+                self.params['target'].ra, self.params['target'].dec, datasets, linear_fluxes=True)
+
+        for key in model_params.keys():
+            assert(key in linear_params.keys())
+        self.assertAlmostEqual(linear_params['tE'], model_params['tE'], places=1)
+        self.assertAlmostEqual(linear_params['chi2'] / model_params['chi2'], 1.0, places=3)
+        for key in ['Source_mag_error', 'Baseline_mag_error']:
+            assert(np.isfinite(linear_params[key]))
+        assert(linear_params['Fit_covariance'].shape == model_params['Fit_covariance'].shape)
+        assert(type(linear_lightcurve) == type(telescopes.Telescope()))
+
+    def test_fit_pspl_omega2_speculative_noblend(self):
+
+        datasets = self.load_test_photometry(self.params['lightcurve_file'])
+
+        (model_params, model_lightcurve) = fittools.fit_pspl_omega2(
+                self.params['target'].ra, self.params['target'].dec, datasets)
+
+        # The speculative fit runs in parallel even if only one core is available
+        with mock.patch('mop.toolbox.fittools.available_cores', return_value=2):
+            (spec_params, spec_lightcurve) = fittools.fit_pspl_omega2(
+                    self.params['target'].ra, self.params['target'].dec, datasets, speculative_noblend=True)
+
+        for key in ['t0', 'u0', 'tE', 'chi2', 'Blend_magnitude']:
+            np.testing.assert_equal(spec_params[key], model_params[key])
+
+    def test_speculative_fit(self):
+
+        datasets = self.load_test_photometry(self.params['lightcurve_file'])
+        lightcurves = fittools.select_lightcurves(datasets)
+
+        model_params = fittools.fit_static_pspl_linear_fluxes(lightcurves, blend=False)
+        spec_fit = fittools.SpeculativeFit(fittools.fit_static_pspl_linear_fluxes, lightcurves=lightcurves,
+                                           blend=False)
+        assert(spec_fit.result()['tE'] == model_params['tE'])
+
+        # Exceptions raised by the fit are raised again by result(), and a cancelled fit is terminated
+        spec_fit = fittools.SpeculativeFit(fittools.fit_static_pspl_linear_fluxes, lightcurves=lightcurves,
+                                           max_nfev=2)
+        self.assertRaises(fittools.FitBudgetExceeded, spec_fit.result)
+
+        spec_fit = fittools.SpeculativeFit(fittools.fit_static_pspl_linear_fluxes, lightcurves=lightcurves)
+        spec_fit.cancel()
+        assert(not spec_fit.process.is_alive())
+
+    def test_fit_pspl_batch(self):
+
+        datasets = self.load_test_photometry(self.params['lightcurve_file'])
+
+        (model_params, model_lightcurve) = fittools.fit_pspl_omega2(
+                self.params['target'].ra, self.params['target'].dec, datasets)
+
+        jobs = [{'name': 'event' + str(i), 'ra': self.params['target'].ra,
+                 'dec': self.params['target'].dec, 'datasets': datasets} for i in range(3)]
+        results = fittools.fit_pspl_batch(jobs, batch_size=2)
+
+        assert(len(results) == len(jobs))
+        for job, result in zip(jobs, results):
+            assert(result['name'] == job['name'])
+            for key in model_params.keys():
+                assert(key in result['model_params'].keys())
+            self.assertAlmostEqual(result['model_params']['tE'], model_params['tE'], places=0)
+            self.assertAlmostEqual(result['model_params']['chi2'] / model_params['chi2'], 1.0, places=2)
+            assert(len(result['model_lightcurve'][0]) == len(result['model_lightcurve'][1]))
+
+    def test_reduce_baseline(self):
+
+        datasets = self.load_test_photometry(self.params['lightcurve_file'])
+        lc = datasets['I']
+
+        (t0, half_window) = fittools.estimate_event_window(datasets)
+        assert(abs(t0 - 2460065.2) < 5.0)
+        assert(half_window >= fittools.MIN_BASELINE_HALF_WINDOW)
+
+        (reduced, reduction) = fittools.reduce_baseline(datasets, 7.0)
+
+        # Photometry within the window is retained at full resolution, while the baseline is binned
+        window = np.abs(lc[:, 0] - t0) <= half_window
+        assert(reduction['ndata'] == len(lc))
+        assert(reduction['ndata_fit'] == len(reduced['I']))
+        assert(len(reduced['I']) < len(lc) / 2)
+        assert(np.isin(lc[window, 0], reduced['I'][:, 0]).all())
+        assert(np.all(np.diff(reduced['I'][:, 0]) > 0.0))
+
+        binned = np.abs(reduced['I'][:, 0] - t0) > half_window
+        baseline_mag = np.median(lc[~window, 1])
+        assert(np.abs(np.median(reduced['I'][binned, 1]) - baseline_mag) < 0.01)
+        assert(np.median(reduced['I'][binned, 2]) < np.median(lc[~window, 2]))
+
+    def test_fit_pspl_omega2_binned_baseline(self):
+
+        datasets = self.load_test_photometry(self.params['lightcurve_file'])
+
+        (model_params, model_lightcurve) = fittools.fit_pspl_omega2(
+                self.params['target'].ra, self.params['target'].dec, datasets)
+
+        (binned_params, binned_lightcurve) = fittools.fit_pspl_omega2(
+                self.params['target'].ra, self.params['target'].dec, datasets, baseline_bin_size=1.0)
+
+        # Binning the baseline should not significantly change the fitted model
+        for key in ['t0', 'u0', 'tE']:
+            assert(abs(binned_params[key] - model_params[key]) < model_params[key + '_error'])
+
+        reduction = json.loads(binned_params['Fit_data_reduction'])
+        assert(reduction['ndata_fit'] < reduction['ndata'])
+        assert(model_params['Fit_data_reduction'] == '')
+
+    def test_clean_lightcurve(self):
+
+        t = np.arange(2460000.0, 2460100.0, 0.2)
+        t0 = 2460050.0
+        u = np.sqrt(0.003**2 + ((t - t0) / 20.0)**2)
+        A = (u**2 + 2.0) / (u * np.sqrt(u**2 + 4.0))
+        mags = 17.0 - 2.5 * np.log10(A)
+        lc = np.column_stack((t, mags, np.full(len(t), 0.01)))
+        lc[:, 1] += np.random.default_rng(1).normal(0.0, 0.01, len(t))
+
+        # A sharply magnified peak is not rejected
+        (mask, rejected) = fittools.clean_lightcurve(lc)
+        assert(mask.all())
+        assert(sum(rejected.values()) == 0)
+
+        # Invalid and duplicated datapoints are rejected, as are isolated outliers
+        bad = lc.copy()
+        bad[10, 1] = np.nan
+        bad[11, 2] = 0.0
+        bad[12, 1] = 99.999
+        bad[20, 1] += 1.0
+        bad[30, 1] -= 1.5
+        bad = np.vstack((bad, [bad[40, 0], bad[40, 1] + 0.1, 0.05]))
+        (mask, rejected) = fittools.clean_lightcurve(bad)
+        assert(rejected == {'invalid': 3, 'duplicate': 1, 'outlier': 2})
+        assert(not mask[[10, 11, 12, 20, 30, -1]].any())
+        assert(mask[40])
+
+        (cleaned, rejected) = fittools.clean_datasets({'I': bad})
+        assert(len(cleaned['I']) == len(bad) - 6)
+        assert((np.diff(cleaned['I'][:, 0]) > 0).all())
+
+    def test_grid_search_guess(self):
+
+        datasets = self.load_test_photometry(self.params['lightcurve_file'])
+        lightcurves = fittools.select_lightcurves(datasets)
+        bounds = fittools.default_pspl_boundaries(lightcurves)
+
+        guess = fittools.grid_search_guess(lightcurves, bounds)
+
+        assert(len(guess) == 3)
+        assert((guess >= bounds[:, 0]).all() and (guess <= bounds[:, 1]).all())
+        # This event peaks at t0 = 2460065.2, with tE = 12.3 days
+        assert(abs(guess[0] - 2460065.2) < 2.0)
+        assert(6.0 < guess[2] < 25.0)
+
+    def test_warm_start_boundaries(self):
+
+        warm_start = {'t0': 2460065.2, 'u0': 0.1, 'tE': 20.0,
+                      't0_error': 0.25, 'u0_error': 0.01, 'tE_error': np.nan}
+        fit_parameters = OrderedDict([('t0', [0, [2460000.0, 2460100.0]]),
+                                      ('u0', [1, [0.0, 2.0]]),
+                                      ('tE', [2, [1.0, 3000.0]])])
+
+        bounds = fittools.warm_start_boundaries(warm_start, fit_parameters)
+
+        for key in ['t0', 'u0', 'tE']:
+            assert(bounds[key][0] < warm_start[key] < bounds[key][1])
+            assert(bounds[key][0] >= fit_parameters[key][1][0])
+            assert(bounds[key][1] <= fit_parameters[key][1][1])
+        self.assertAlmostEqual(bounds['tE'][1], 26.0, places=3)
+
+        # A previous t0 outside the range of the data reverts to the default boundaries
+        warm_start['t0'] = 2470000.0
+        bounds = fittools.warm_start_boundaries(warm_start, fit_parameters)
+        assert(bounds['t0'] == fit_parameters['t0'][1])
+
     def test_repackage_lightcurves(self):
 
         (datasets, ndata) = fittools.repackage_lightcurves(self.params['photometry'])
@@ -133,6 +333,25 @@ class TestModelingTools(TestCase):
             assert(type(datalist) == type(np.array([])))
             assert(len(datalist) == config[0])
 
+    def test_photometry_fingerprint(self):
+
+        (datasets, ndata) = fittools.repackage_lightcurves(self.params['photometry'])
+
+        fingerprint = fittools.photometry_fingerprint(datasets)
+        assert(len(fingerprint) == 64)
+
+        # The fingerprint should not depend on the order of the datapoints
+        shuffled = {key: lc[::-1] for key, lc in datasets.items()}
+        assert(fittools.photometry_fingerprint(shuffled) == fingerprint)
+
+        # But should change if any datapoint or the fit configuration changes
+        modified = {key: lc.copy() for key, lc in datasets.items()}
+        modified['I'][0, 2] += 0.001
+        assert(fittools.photometry_fingerprint(modified) != fingerprint)
+
+        fit_config = fittools.fit_configuration(emag_limit=0.1)
+        assert(fittools.photometry_fingerprint(datasets, fit_config=fit_config) != fingerprint)
+
     def test_store_model_lightcurve(self):
 
         fittools.store_model_lightcurve(self.params['target'], self.params['pylima_model'])
@@ -202,7 +421,8 @@ class TestModelingTools(TestCase):
         model_fit = TRF_fit.TRFfit(pspl, loss_function='soft_l1')
         model_fit.fit()
 
-        model_params = fittools.gather_model_parameters(pevent, model_fit)
+        with override_settings(FIT_RESIDUAL_STATISTICS=True):
+            model_params = fittools.gather_model_parameters(pevent, model_fit)
 
         expected_keys = [
             't0', 't0_error', 'u0', 'u0_error', 'tE', 'tE_error',
@@ -210,11 +430,41 @@ class TestModelingTools(TestCase):
             'Source_magnitude', 'Source_mag_error',
             'Blend_magnitude', 'Blend_mag_error',
             'Baseline_magnitude', 'Baseline_mag_error',
-            'Fit_covariance', 'chi2', 'red_chi2'
+            'Fit_covariance', 'chi2', 'red_chi2',
+            'SW_test', 'AD_test', 'KS_test', 'chi2_dof'
         ]
         for key in expected_keys:
             assert(key in model_params.keys())
 
+        # The chi2 is evaluated from the same residuals as the fit statistics
+        (chi2, pyLIMA_parameters) = model_fit.model_chi2(model_fit.fit_results['best_model'])
+        self.assertAlmostEqual(model_params['chi2'], chi2, places=2)
+        for key in ['SW_test', 'AD_test', 'KS_test', 'chi2_dof']:
+            assert(np.isfinite(model_params[key]))
+
+        # The residual statistics are not calculated unless enabled
+        with override_settings(FIT_RESIDUAL_STATISTICS=False):
+            model_params = fittools.gather_model_parameters(pevent, model_fit)
+        for key in ['SW_test', 'AD_test', 'KS_test', 'chi2_dof']:
+            assert(np.isnan(model_params[key]))
+
+    def test_residual_statistics(self):
+
+        residuals = np.random.default_rng(1).normal(0.0, 1.0, 500)
+
+        statistics = fittools.residual_statistics(residuals)
+        assert(statistics['SW_test'] > 0.99)
+        assert(statistics['KS_test'] < 0.1)
+        assert(abs(statistics['chi2_dof'] - 1.0) < 0.2)
+
+        # Tests which are not requested are not calculated
+        statistics = fittools.residual_statistics(residuals, tests=['KS'])
+        assert(np.isnan(statistics['SW_test']) and np.isnan(statistics['AD_test']))
+        assert(np.isfinite(statistics['KS_test']))
+
+        statistics = fittools.residual_statistics(None)
+        assert(np.isnan(statistics['chi2_dof']))
+
     def test_test_quality_of_model_fit(self):
 
         result = fittools.test_quality_of_model_fit(self.params['model_params'])
@@ -140,3 +140,19 @@ class TestInterferomeinterferometry_predictiontryFunctions(TestCase):
         print(self.st.extra_fields)
 
         assert(self.st.extra_fields['Interferometry_candidate'])
+
+
+class TestPeriodAboveThreshold(TestCase):
+
+    def test_period_above_threshold(self):
+
+        # The crossings are interpolated between the timestamps of a sparsely sampled lightcurve
+        ts = np.array([0.0, 10.0, 20.0, 30.0, 40.0])
+        mags = np.array([16.0, 15.0, 13.0, 15.0, 16.0])
+        interval = interferometry_prediction.period_above_threshold(ts, mags, 14.0)
+        assert(abs(interval - 10.0) < 1e-9)
+
+        # The interval is only bounded by the lightcurve where it starts or ends above the threshold
+        assert(interferometry_prediction.period_above_threshold(ts[2:], mags[2:], 14.0) == 5.0)
+        assert(np.isinf(interferometry_prediction.period_above_threshold(ts, mags, 17.0)))
+        assert(np.isnan(interferometry_prediction.period_above_threshold(ts, mags, 12.0)))
@@ -0,0 +1,46 @@
+from django.test import TestCase
+from mop.toolbox import model_lightcurves, pspl_tools
+import numpy as np
+
+class TestModelLightcurves(TestCase):
+    def setUp(self):
+        (t0, u0, tE, fs, fb) = (2460065.2, 0.15, 25.0, 100.0, 50.0)
+        self.model_times = pspl_tools.adaptive_time_grid(t0, u0, tE, fs, fb,
+                                                         data_times=np.linspace(2459900.0, 2460200.0, 100))
+        self.model_mags = pspl_tools.model_magnitude(self.model_times, t0, u0, tE, fs, fb)
+
+    def test_encode_model_lightcurve(self):
+
+        data = model_lightcurves.encode_model_lightcurve(self.model_times, self.model_mags, compact=True)
+        assert(data['lc_model_encoding'] == model_lightcurves.COMPACT_ENCODING)
+        assert(data['lc_model_npoints'] == len(self.model_times))
+
+        (model_times, model_mags) = model_lightcurves.decode_model_lightcurve(data)
+        np.testing.assert_allclose(model_times, self.model_times, rtol=0.0,
+                                   atol=model_lightcurves.TIME_RESOLUTION)
+        np.testing.assert_allclose(model_mags, self.model_mags, rtol=0.0, atol=1e-5)
+
+        # The compact encoding should be substantially smaller than the lists of floats
+        legacy = model_lightcurves.encode_model_lightcurve(self.model_times, self.model_mags, compact=False)
+        assert(len(str(data)) < len(str(legacy)) / 2)
+
+    def test_decode_legacy_model_lightcurve(self):
+
+        data = {
+            'lc_model_time': self.model_times.tolist(),
+            'lc_model_magnitude': self.model_mags.tolist()
+        }
+        (model_times, model_mags) = model_lightcurves.decode_model_lightcurve(data)
+        assert((model_times == self.model_times).all())
+        assert((model_mags == self.model_mags).all())
+
+    def test_model_magnitude_at(self):
+
+        data = model_lightcurves.encode_model_lightcurve(self.model_times, self.model_mags, compact=True)
+
+        mag = model_lightcurves.model_magnitude_at(data, self.model_times[10])
+        assert(abs(mag - self.model_mags[10]) < 1e-5)
+
+        # Beyond the end of the model, the magnitude at the end is returned
+        mag = model_lightcurves.model_magnitude_at(data, self.model_times[-1] + 100.0)
+        assert(abs(mag - self.model_mags[-1]) < 1e-5)
@@ -0,0 +1,88 @@
+from django.test import TestCase
+from tom_targets.tests.factories import SiderealTargetFactory
+from tom_targets.models import TargetExtra
+from tom_dataproducts.models import ReducedDatum
+from mop.toolbox import photometry_cache, querytools
+from mop.toolbox.mop_classes import MicrolensingEvent
+from astropy.time import Time, TimezoneInfo
+import numpy as np
+
+class TestMicrolensingEvent(TestCase):
+    def setUp(self):
+        photometry_cache.photometry_cache().clear()
+
+        self.target = SiderealTargetFactory.create()
+        self.target.name = 'Gaia23mce'
+        self.target.save()
+
+        for key, value in {'t0': 2460005.0, 'tE': 30.0, 'Category': 'Microlensing stellar/planet',
+                           'TAP_priority': '', 'Gmag': 15.2}.items():
+            (extra, created) = TargetExtra.objects.get_or_create(target=self.target, key=key)
+            extra.value = value
+            extra.save()
+
+        for jd in np.arange(2460000.0, 2460010.0):
+            ReducedDatum.objects.create(
+                timestamp=Time(jd, format='jd', scale='utc').to_datetime(timezone=TimezoneInfo()),
+                value={'magnitude': 17.0, 'filter': 'G', 'error': 0.01},
+                source_name='Gaia',
+                source_location=self.target.name,
+                data_type='photometry',
+                target=self.target
+            )
+        ReducedDatum.objects.create(
+            timestamp=Time(2460001.0, format='jd').to_datetime(timezone=TimezoneInfo()),
+            value={'lc_model_time': [2460000.0, 2460010.0], 'lc_model_magnitude': [17.0, 17.0]},
+            source_name='MOP',
+            source_location=self.target.name,
+            data_type='lc_model',
+            target=self.target
+        )
+
+    def test_set_extra_params(self):
+
+        mulens = MicrolensingEvent(self.target)
+        assert(not hasattr(mulens, '__dict__'))
+
+        with self.assertNumQueries(1):
+            mulens.set_extra_params(TargetExtra.objects.filter(target=self.target))
+        assert(mulens.t0 == 2460005.0)
+        assert(type(mulens.tE) == type(1.0))
+        assert(mulens.Category == 'Microlensing stellar/planet')
+        assert(mulens.TAP_priority == '')
+        assert(mulens.other_params['Gmag'] == '15.2')
+        assert(getattr(mulens, 'Gmag') == '15.2')
+        assert(getattr(mulens, 'u0_error', None) is None)
+
+        # The TargetExtra instances are only retrieved when required
+        with self.assertNumQueries(1):
+            assert(mulens.extras['t0'].float_value == 2460005.0)
+        mulens.store_parameter_set({'tE': 35.0})
+        assert(mulens.tE == 35.0)
+        assert(TargetExtra.objects.get(target=self.target, key='tE').float_value == 35.0)
+
+    def test_load_on_demand(self):
+
+        target_data = querytools.fetch_data_for_targetset([self.target], check_need_to_fit=False,
+                                                          fetch_photometry=False)
+        mulens = target_data[self.target]
+
+        # The photometry is loaded on first access, and cached
+        with self.assertNumQueries(2):
+            assert(mulens.ndata == 10)
+        assert(len(mulens.datasets['G']) == 10)
+        assert(mulens.last_observation == 2460009.0)
+        (photometry, generations) = photometry_cache.lookup_photometry([self.target])
+        assert(self.target.pk in photometry)
+
+        # The data products are retrieved together when any of them is first accessed
+        with self.assertNumQueries(1):
+            assert(mulens.existing_model.value['lc_model_magnitude'] == [17.0, 17.0])
+            assert(mulens.neighbours is None)
+            assert(mulens.gsc_results is None)
+
+        # Attributes which have been set are not replaced when the others are loaded
+        mulens = MicrolensingEvent(self.target)
+        mulens.datasets = {}
+        assert(mulens.ndata == 10)
+        assert(mulens.datasets == {})
@@ -0,0 +1,118 @@
+from django.test import TestCase
+from tom_targets.tests.factories import SiderealTargetFactory
+from tom_targets.models import TargetExtra
+from pyLIMA.parallax import parallax
+from mop.models import ParallaxEphemeris
+from mop.toolbox import parallax_fits, fittools, pspl_tools
+from mop.toolbox.mop_classes import MicrolensingEvent
+from mop.management.commands.fit_parallax_PSPL import run_parallax_fit
+import numpy as np
+
+class TestParallaxFits(TestCase):
+    def setUp(self):
+        self.target = SiderealTargetFactory.create()
+        self.target.name = 'Gaia23lng'
+        self.target.ra = 270.0
+        self.target.dec = -29.0
+        self.target.save()
+
+        # Long-timescale event with significant annual parallax
+        self.params = {'t0': 2460150.0, 'u0': 0.3, 'tE': 150.0, 'piEN': 0.15, 'piEE': -0.1}
+        rng = np.random.default_rng(42)
+        t = np.sort(rng.uniform(2459700.0, 2460600.0, 600))
+        pevent = fittools.pylima_event_from_datasets(270.0, -29.0,
+                                                     {'G': np.column_stack((t, np.full(len(t), 17.0),
+                                                                            np.full(len(t), 0.01)))},
+                                                     event_class=parallax_fits.ParallaxEvent)
+        pevent.earth_positions = parallax_fits.earth_projected_positions(pevent)
+        self.tel_name = pevent.telescopes[0].name
+        deltas = parallax_fits.annual_parallax_offsets(t, pevent.earth_positions[self.tel_name], self.params['t0'],
+                                                       pevent.North, pevent.East)
+        A = parallax_fits.parallax_magnification(t, self.params['t0'], self.params['u0'], self.params['tE'],
+                                                 self.params['piEN'], self.params['piEE'], deltas)
+        fs = pspl_tools.mag_to_flux(18.0)
+        mag = pspl_tools.flux_to_mag(fs * A + 0.3 * fs) + rng.normal(0.0, 0.01, len(t))
+        self.datasets = {'G': np.column_stack((t, mag, np.full(len(t), 0.01)))}
+        self.pevent = pevent
+
+    def test_annual_parallax_offsets(self):
+
+        # The offsets match pyLIMA's annual parallax, projected onto the sky
+        t = self.datasets['G'][:, 0]
+        (earth_positions, earth_speeds) = parallax.Earth_ephemerides(t)
+        delta_Sun = parallax.annual_parallax(t, earth_positions, self.params['t0'])
+        expected = np.array([np.dot(delta_Sun, self.pevent.North), np.dot(delta_Sun, self.pevent.East)])
+
+        deltas = parallax_fits.annual_parallax_offsets(t, self.pevent.earth_positions[self.tel_name], self.params['t0'],
+                                                       self.pevent.North, self.pevent.East)
+        assert(deltas.shape == (2, len(t)))
+        np.testing.assert_allclose(deltas, expected, atol=1e-10)
+
+        # Without parallax, the magnification is that of the static model
+        A = parallax_fits.parallax_magnification(t, self.params['t0'], self.params['u0'], self.params['tE'],
+                                                 0.0, 0.0, deltas)
+        np.testing.assert_allclose(A, pspl_tools.magnification(t, self.params['t0'], self.params['u0'],
+                                                                 self.params['tE']))
+
+    def test_store_ephemeris(self):
+
+        key = parallax_fits.ephemeris_key(270.0, -29.0, self.datasets)
+        assert(parallax_fits.load_ephemeris(key) is None)
+
+        parallax_fits.store_ephemeris(key, self.target, self.pevent.earth_positions)
+        positions = parallax_fits.load_ephemeris(key)
+        assert((positions[self.tel_name] == self.pevent.earth_positions[self.tel_name]).all())
+
+        # Storing the ephemeris of a new version of the photometry replaces the old one
+        datasets = {'G': self.datasets['G'][:-1]}
+        new_key = parallax_fits.ephemeris_key(270.0, -29.0, datasets)
+        assert(new_key != key)
+        parallax_fits.store_ephemeris(new_key, self.target, {self.tel_name: self.pevent.earth_positions[self.tel_name][:, :-1]})
+        assert(list(ParallaxEphemeris.objects.values_list('key', flat=True)) == [new_key])
+
+    def test_fit_pspl_parallax(self):
+
+        static_model = {'t0': self.params['t0'] + 3.0, 'u0': 0.35, 'tE': 120.0}
+        (model_params, model_telescope) = parallax_fits.fit_pspl_parallax(270.0, -29.0, self.datasets,
+                                                                          static_model, target=self.target)
+
+        assert(abs(model_params['piEN'] - self.params['piEN']) < 0.02)
+        assert(abs(model_params['piEE'] - self.params['piEE']) < 0.02)
+        assert(abs(model_params['tE'] - self.params['tE']) < 10.0)
+        assert(model_telescope is not None)
+        assert(ParallaxEphemeris.objects.filter(target=self.target).count() == 1)
+
+        static_chi2 = parallax_fits.static_model_chi2(self.datasets, static_model)
+        assert(parallax_fits.prefer_parallax_model(static_chi2, model_params))
+        assert(not parallax_fits.prefer_parallax_model(model_params['chi2'] + 1.0, model_params))
+
+    def test_run_parallax_fit(self):
+
+        mulens = MicrolensingEvent(self.target)
+        mulens.set_extra_params(TargetExtra.objects.filter(target=self.target))
+        mulens.datasets = self.datasets
+        mulens.ndata = len(self.datasets['G'])
+        mulens.last_observation = self.datasets['G'][:, 0].max()
+        mulens.Category = parallax_fits.PARALLAX_CATEGORY
+        mulens.t0 = self.params['t0']
+        mulens.u0 = self.params['u0']
+        mulens.tE = 130.0
+
+        (status, reason) = parallax_fits.need_parallax_fit(mulens)
+        assert(not status)
+        assert(reason == 'Static model not up to date')
+
+        mulens.Fit_fingerprint = mulens.photometry_fingerprint()
+        (status, reason) = parallax_fits.need_parallax_fit(mulens)
+        assert(status)
+
+        assert(run_parallax_fit(mulens))
+        assert(abs(float(mulens.piEN) - self.params['piEN']) < 0.02)
+        assert(mulens.Parallax_fingerprint == mulens.Fit_fingerprint)
+
+        # The event is not re-fitted until its photometry changes
+        (status, reason) = parallax_fits.need_parallax_fit(mulens)
+        assert(not status)
+        assert(reason == 'Photometry unchanged since last parallax fit')
+        (status, reason) = parallax_fits.need_parallax_fit(mulens, force=True)
+        assert(status)
@@ -0,0 +1,141 @@
+from django.test import TestCase
+from tom_targets.tests.factories import SiderealTargetFactory
+from tom_dataproducts.models import DataProduct, ReducedDatum
+from tom_dataproducts.data_processor import run_data_processor
+from django.core.files.uploadedfile import SimpleUploadedFile
+from django.test import override_settings
+from django.utils import timezone
+from mop.models import EventSummary
+from mop.toolbox import photometry_cache, querytools
+from astropy.time import Time, TimezoneInfo
+import numpy as np
+import tempfile
+
+class TestPhotometryCache(TestCase):
+    def setUp(self):
+        photometry_cache.photometry_cache().clear()
+
+        self.target = SiderealTargetFactory.create()
+        self.target.name = 'Gaia23phc'
+        self.target.save()
+
+        for jd in np.arange(2460000.0, 2460010.0):
+            self.add_datum(jd, 'G')
+        for jd in np.arange(2460000.5, 2460004.5):
+            self.add_datum(jd, 'ZTF_r')
+        ReducedDatum.objects.create(
+            timestamp=Time(2460001.0, format='jd').to_datetime(timezone=TimezoneInfo()),
+            value={'tap_planet': 0.1},
+            source_name='MOP',
+            source_location=self.target.name,
+            data_type='TAP_priority',
+            target=self.target
+        )
+
+    def add_datum(self, jd, passband):
+        ReducedDatum.objects.create(
+            timestamp=Time(jd, format='jd', scale='utc').to_datetime(timezone=TimezoneInfo()),
+            value={'magnitude': 17.0 + (jd - 2460000.0) / 100.0, 'filter': passband, 'error': 0.01},
+            source_name='Gaia',
+            source_location=self.target.name,
+            data_type='photometry',
+            target=self.target
+        )
+
+    def test_pack_photometry(self):
+
+        datasets = {'G': np.array([[2460000.0, 17.0, 0.01], [2460001.0, 17.1, 0.02]]),
+                    'R': np.zeros((0, 3))}
+        entry = photometry_cache.pack_photometry(datasets, 2460000.0, 2460001.0, generation='abc')
+        assert(entry['ndata'] == 2)
+        assert((entry['passbands']['G']['mag'] == datasets['G'][:, 1]).all())
+
+        (unpacked, ndata, first_observation, last_observation) = photometry_cache.unpack_photometry(entry)
+        assert((unpacked['G'] == datasets['G']).all())
+        assert(unpacked['R'].shape == (0, 3))
+        assert(ndata == 2)
+        assert(last_observation == 2460001.0)
+
+    def test_fetch_cached_photometry(self):
+
+        mulens = querytools.fetch_data_for_targetset([self.target], check_need_to_fit=False)[self.target]
+        assert(mulens.ndata == 14)
+        (photometry, generations) = photometry_cache.lookup_photometry([self.target])
+        assert(self.target.pk in photometry)
+
+        # Once cached, the photometric ReducedDatums are not retrieved from the database
+        with self.assertNumQueries(3):
+            cached = querytools.fetch_data_for_targetset([self.target], check_need_to_fit=False)[self.target]
+        assert(cached.ndata == mulens.ndata)
+        assert(cached.last_observation == mulens.last_observation)
+        for passband, lc in mulens.datasets.items():
+            assert((cached.datasets[passband] == lc).all())
+        assert(cached.photometry_fingerprint() == mulens.photometry_fingerprint())
+
+        # Ingesting photometry invalidates the cache
+        self.add_datum(2460020.0, 'G')
+        updated = querytools.fetch_data_for_targetset([self.target], check_need_to_fit=False)[self.target]
+        assert(updated.ndata == 15)
+        assert(len(updated.datasets['G']) == 11)
+
+    def test_invalidate_photometry(self):
+
+        # Photometry retrieved before an ingest is not treated as current if it is cached afterwards
+        (photometry, generations) = photometry_cache.lookup_photometry([self.target])
+        assert(photometry == {})
+        entry = photometry_cache.pack_photometry({}, None, None, generation=generations[self.target.pk])
+        photometry_cache.invalidate_photometry(self.target)
+        photometry_cache.store_photometry({self.target: entry})
+
+        (photometry, generations) = photometry_cache.lookup_photometry([self.target])
+        assert(photometry == {})
+
+    def test_invalidate_on_change(self):
+
+        querytools.fetch_data_for_targetset([self.target], check_need_to_fit=False)
+
+        # Photometry that is changed or deleted is no longer cached
+        datum = ReducedDatum.objects.filter(target=self.target, data_type='photometry').first()
+        datum.value['error'] = 0.02
+        datum.save()
+        (photometry, generations) = photometry_cache.lookup_photometry([self.target])
+        assert(photometry == {})
+
+        querytools.fetch_data_for_targetset([self.target], check_need_to_fit=False)
+        ReducedDatum.objects.filter(target=self.target, value__filter='ZTF_r').delete()
+        updated = querytools.fetch_data_for_targetset([self.target], check_need_to_fit=False)[self.target]
+        assert(updated.ndata == 10)
+
+        # Other data products do not affect the cached photometry
+        querytools.fetch_data_for_targetset([self.target], check_need_to_fit=False)
+        ReducedDatum.objects.filter(target=self.target, data_type='TAP_priority').delete()
+        (photometry, generations) = photometry_cache.lookup_photometry([self.target])
+        assert(self.target.pk in photometry)
+
+    def test_invalidate_on_upload(self):
+
+        querytools.fetch_data_for_targetset([self.target], check_need_to_fit=False)
+
+        processors = {'photometry': 'mop.processors.photometry_processor.PhotometryProcessor'}
+        with tempfile.TemporaryDirectory() as media_root, \
+                override_settings(MEDIA_ROOT=media_root, DATA_PROCESSORS=processors):
+            dp = DataProduct.objects.create(
+                product_id='test_photometry_upload',
+                target=self.target,
+                data=SimpleUploadedFile('photometry.csv', b'2460030.0 G 17.5 0.01\n2460031.0 G 17.6 0.01\n'),
+                data_product_type='photometry'
+            )
+            reduced_data = run_data_processor(dp)
+
+        assert(reduced_data.count() == 2)
+        updated = querytools.fetch_data_for_targetset([self.target], check_need_to_fit=False)[self.target]
+        assert(updated.ndata == 16)
+
+        # The photometry is not cached until the ingest window has passed
+        (photometry, generations) = photometry_cache.lookup_photometry([self.target])
+        assert(photometry == {})
+        assert(generations[self.target.pk] is None)
+        EventSummary.objects.filter(target=self.target).update(photometry_modified=timezone.now())
+        querytools.fetch_data_for_targetset([self.target], check_need_to_fit=False)
+        (photometry, generations) = photometry_cache.lookup_photometry([self.target])
+        assert(photometry[self.target.pk]['ndata'] == 16)
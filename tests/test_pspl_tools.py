@@ -0,0 +1,187 @@
+from django.test import TestCase
+import numpy as np
+from mop.toolbox import pspl_tools
+from pyLIMA.models import PSPL_model
+from pyLIMA import event
+from pyLIMA import telescopes
+
+class TestPSPLTools(TestCase):
+    def setUp(self):
+        self.params = {
+            't0': 2460065.2,
+            'u0': 0.15,
+            'tE': 25.0,
+            'Source_magnitude': 18.5,
+            'Blend_magnitude': 19.2
+        }
+        self.times = np.linspace(2460000.0, 2460150.0, 500)
+
+    def pylima_model_flux(self, times, t0, u0, tE, fs, fb):
+        pevent = event.Event(ra=271.1925, dec=-28.3164)
+        pevent.name = 'test'
+        tel = telescopes.Telescope(name='Tel_0', camera_filter='I',
+                                   light_curve=np.c_[times, [18.0] * len(times), [0.01] * len(times)],
+                                   light_curve_names=['time', 'mag', 'err_mag'],
+                                   light_curve_units=['JD', 'mag', 'err_mag'])
+        pevent.telescopes.append(tel)
+        pevent.find_survey('Tel_0')
+        pspl = PSPL_model.PSPLmodel(pevent, parallax=['None', 0.])
+        pspl.define_model_parameters()
+        pyLIMA_parameters = pspl.compute_pyLIMA_parameters([t0, u0, tE, fs, fb])
+
+        return pspl.compute_the_microlensing_model(tel, pyLIMA_parameters)['photometry']
+
+    def test_model_flux_matches_pylima(self):
+
+        (t0, u0, tE, fs, fb) = pspl_tools.event_parameters(self.params)
+
+        flux = pspl_tools.model_flux(self.times, t0, u0, tE, fs, fb)
+        pylima_flux = self.pylima_model_flux(self.times, t0, u0, tE, fs, fb)
+
+        np.testing.assert_allclose(flux, pylima_flux, rtol=1e-10)
+
+    def test_magnification(self):
+
+        A = pspl_tools.magnification(self.params['t0'], self.params['t0'], self.params['u0'], self.params['tE'])
+        u0 = self.params['u0']
+        self.assertAlmostEqual(A, (u0**2 + 2) / (u0 * np.sqrt(u0**2 + 4)), places=10)
+
+        # Far from the peak the magnification tends to unity
+        A = pspl_tools.magnification(self.params['t0'] + 1e4, self.params['t0'], u0, self.params['tE'])
+        self.assertAlmostEqual(A, 1.0, places=5)
+
+    def test_event_parameters(self):
+
+        (t0, u0, tE, fs, fb) = pspl_tools.event_parameters(self.params)
+        self.assertAlmostEqual(pspl_tools.flux_to_mag(fs), self.params['Source_magnitude'], places=10)
+
+        # An undefined blend magnitude is treated as zero blend flux
+        params = self.params.copy()
+        params['Blend_magnitude'] = np.nan
+        (t0, u0, tE, fs, fb) = pspl_tools.event_parameters(params)
+        assert(fb == 0.0)
+        assert(pspl_tools.valid_parameters(t0, u0, tE, fs, fb))
+
+        params['tE'] = 'nan'
+        (t0, u0, tE, fs, fb) = pspl_tools.event_parameters(params)
+        assert(not pspl_tools.valid_parameters(t0, u0, tE, fs, fb))
+
+    def test_vectorized_events(self):
+
+        param_list = []
+        for tE in [5.0, 25.0, 250.0]:
+            params = self.params.copy()
+            params['tE'] = tE
+            param_list.append(params)
+
+        (t0, u0, tE, fs, fb) = pspl_tools.event_parameter_arrays(param_list)
+        assert(t0.shape == (3, 1))
+
+        mags = pspl_tools.model_magnitude(self.times[np.newaxis, :], t0, u0, tE, fs, fb)
+        assert(mags.shape == (3, len(self.times)))
+
+        for i, params in enumerate(param_list):
+            single = pspl_tools.model_magnitude(self.times, *pspl_tools.event_parameters(params))
+            np.testing.assert_allclose(mags[i], single)
+
+    def test_adaptive_time_grid(self):
+
+        (t0, u0, tE, fs, fb) = pspl_tools.event_parameters(self.params)
+        tolerance = 0.001
+        model_time = pspl_tools.adaptive_time_grid(t0, u0, tE, fs, fb, data_times=self.times, tolerance=tolerance)
+
+        assert(np.all(np.diff(model_time) > 0.0))
+        assert(model_time.min() <= min(self.times.min(), t0 - 5.0 * tE))
+        assert(model_time.max() >= max(self.times.max(), t0 + 5.0 * tE))
+
+        # Interpolating the model between the grid points reproduces it to within the tolerance,
+        # with far fewer points than a fixed 0.01-day grid within t0 +/- tE
+        fine_time = np.linspace(model_time.min(), model_time.max(), 100000)
+        interpolated = np.interp(fine_time, model_time, pspl_tools.model_magnitude(model_time, t0, u0, tE, fs, fb))
+        error = np.abs(interpolated - pspl_tools.model_magnitude(fine_time, t0, u0, tE, fs, fb))
+        assert(error.max() <= tolerance)
+        assert(len(model_time) < (2.0 * tE / 0.01) / 10)
+
+    def test_fit_pspl_batch_arrays(self):
+
+        rng = np.random.default_rng(42)
+        truth = [(2460065.2, 0.15, 25.0), (2460080.0, 0.5, 8.0), (2460040.0, 0.05, 60.0)]
+        event_lightcurves = []
+        for (t0, u0, tE) in truth:
+            lightcurves = []
+            for (mag_source, ndata) in [(18.5, 400), (19.0, 150)]:
+                t = np.sort(rng.uniform(2459950.0, 2460200.0, ndata))
+                fs = pspl_tools.mag_to_flux(mag_source)
+                mag = pspl_tools.model_magnitude(t, t0, u0, tE, fs, 0.5 * fs)
+                lightcurves.append(np.c_[t, mag + rng.normal(0.0, 0.005, ndata), [0.005] * ndata])
+            event_lightcurves.append(lightcurves)
+
+        packed = pspl_tools.pack_lightcurves(event_lightcurves)
+        assert(packed['time'].shape == (3, 550))
+
+        bounds = np.zeros((3, 3, 2))
+        bounds[:, 0, :] = [2459950.0, 2460200.0]
+        bounds[:, 1, :] = [0.0, 2.0]
+        bounds[:, 2, :] = [1.0, 3000.0]
+        guess = pspl_tools.batch_initial_guess(packed, bounds)
+        results = pspl_tools.fit_pspl_batch_arrays(packed, bounds, guess, loss='linear')
+
+        for i, (t0, u0, tE) in enumerate(truth):
+            covariance = pspl_tools.pspl_covariance(event_lightcurves[i], results['t0'][i], results['u0'][i],
+                                                    results['tE'][i], results['fs'][i], results['fb'][i])
+            assert(covariance.shape == (7, 7))
+            sigma = np.sqrt(np.diag(covariance))
+            for j, key in enumerate(['t0', 'u0', 'tE']):
+                assert(abs(results[key][i] - truth[i][j]) < 5.0 * sigma[j])
+            self.assertAlmostEqual(results['fb'][i, 0] / results['fs'][i, 0], 0.5, places=1)
+            assert(results['chi2'][i] < 2.0 * packed['ndata'][i])
+
+    def test_batch_initial_guess_grid(self):
+
+        rng = np.random.default_rng(3)
+        (t0, u0, tE) = (2460065.2, 0.15, 25.0)
+        t = np.sort(rng.uniform(2459950.0, 2460200.0, 500))
+        fs = pspl_tools.mag_to_flux(18.5)
+        mag = pspl_tools.model_magnitude(t, t0, u0, tE, fs, 0.0) + rng.normal(0.0, 0.01, len(t))
+
+        # A run of bright outliers, which the peak of the lightcurve is mistaken for
+        mag[(t > 2460170.0) & (t < 2460175.0)] -= 3.0
+        packed = pspl_tools.pack_lightcurves([[np.c_[t, mag, [0.01] * len(t)]]])
+        assert(packed['peak_time'][0] > 2460170.0)
+
+        bounds = np.array([[[2459950.0, 2460200.0], [0.0, 2.0], [1.0, 3000.0]]])
+        guess = pspl_tools.batch_initial_guess(packed, bounds)
+        assert(guess[0, 0] > 2460170.0)
+
+        guess = pspl_tools.batch_initial_guess(packed, bounds, t0_offsets=pspl_tools.GRID_T0_OFFSETS,
+                                               nt0=pspl_tools.GRID_NT0, u0_values=pspl_tools.GRID_U0_VALUES,
+                                               tE_values=pspl_tools.GRID_TE_VALUES, max_block=20000)
+        assert(abs(guess[0, 0] - t0) < 0.5 * tE)
+        assert(guess[0, 1] in pspl_tools.GRID_U0_VALUES)
+        assert(guess[0, 2] in pspl_tools.GRID_TE_VALUES)
+
+    def test_thin_lightcurves(self):
+
+        lightcurves = [np.c_[self.times, [18.0] * 500, [0.01] * 500],
+                       np.c_[self.times[0:50], [19.0] * 50, [0.02] * 50]]
+
+        assert(pspl_tools.thin_lightcurves(lightcurves, 1000) is lightcurves)
+
+        thinned = pspl_tools.thin_lightcurves(lightcurves, 110)
+        assert(len(thinned[0]) == 100)
+        assert(len(thinned[1]) == 10)
+        assert((np.diff(thinned[0][:, 0]) > 0.0).all())
+
+    def test_solve_linear_fluxes(self):
+
+        A = pspl_tools.magnification(self.times, 2460065.2, 0.15, 25.0)[np.newaxis, :]
+        flux = 1000.0 * A + 250.0
+        weight = np.ones_like(A)
+        tel = np.zeros_like(A, dtype=int)
+
+        (fs, fb) = pspl_tools.solve_linear_fluxes(A, flux, weight, tel, 1)
+        self.assertAlmostEqual(fs[0, 0], 1000.0, places=6)
+        self.assertAlmostEqual(fb[0, 0], 250.0, places=6)
+
+        (fs, fb) = pspl_tools.solve_linear_fluxes(A, flux, weight, tel, 1, blend=False)
+        assert(fb[0, 0] == 0.0)
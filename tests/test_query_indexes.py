@@ -0,0 +1,71 @@
+from django.test import TestCase
+from django.db import connection
+from django.test.utils import CaptureQueriesContext
+from tom_targets.tests.factories import SiderealTargetFactory
+from tom_targets.models import Target, TargetExtra
+from tom_dataproducts.models import ReducedDatum
+from mop.toolbox import querytools
+from datetime import datetime, timezone
+
+def query_plans(func, *args, **kwargs):
+    """Returns the plans of the SELECT queries made by a function, as executed with its parameters.
+    Sequential scans are disabled for PostgreSQL, so that the plans show the indexes available to each
+    query even for the small tables of the test database"""
+
+    with CaptureQueriesContext(connection) as context:
+        func(*args, **kwargs)
+
+    plans = []
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('SET LOCAL enable_seqscan = off')
+            prefix = 'EXPLAIN '
+        else:
+            prefix = 'EXPLAIN QUERY PLAN '
+        for query in context.captured_queries:
+            if query['sql'].startswith('SELECT'):
+                cursor.execute(prefix + query['sql'])
+                plans.append(' '.join([str(row) for row in cursor.fetchall()]))
+
+    return plans
+
+class TestQueryIndexes(TestCase):
+    """The most frequent queries made by MOP must use the indexes created for them"""
+
+    def setUp(self):
+        self.target = SiderealTargetFactory.create()
+        self.target.name = 'Gaia23idx'
+        self.target.save()
+
+    def test_extra_indexes(self):
+
+        plans = query_plans(lambda: list(TargetExtra.objects.filter(key='Classification', value='Microlensing PSPL')))
+        assert('mop_extra_key_value_idx' in plans[0])
+
+        plans = query_plans(lambda: list(TargetExtra.objects.filter(key='TAP_priority', float_value__gt=10.0)))
+        assert('mop_extra_key_float_idx' in plans[0])
+
+    def test_datum_indexes(self):
+
+        plans = query_plans(querytools.fetch_reduced_data, [self.target])
+        assert('mop_datum_photometry_idx' in plans[-1])
+
+        model_time = datetime(2018, 6, 29, 8, 15, 27, 243860, tzinfo=timezone.utc)
+        plans = query_plans(lambda: list(ReducedDatum.objects.filter(source_name='MOP', data_type='lc_model',
+                                                                     timestamp=model_time,
+                                                                     source_location=self.target.name)))
+        assert('mop_datum_source_idx' in plans[0])
+
+        plans = query_plans(lambda: list(ReducedDatum.objects.filter(target=self.target, data_type='tabular',
+                                                                     source_name='GSC_query_results')))
+        assert('mop_datum_target_type_idx' in plans[0])
+
+    def test_event_summary_indexes(self):
+
+        plans = query_plans(querytools.fetch_alive_events_outside_HCZ, with_atomic=False)
+        # Either of the event summary indexes may be chosen, since both lead with the classification
+        assert('mop_summary_' in plans[0])
+
+        plans = query_plans(lambda: list(Target.objects.filter(querytools.alive_microlensing(),
+                                                               event_summary__last_fit_jd__lte=2460000.0)))
+        assert('mop_summary_' in plans[0])
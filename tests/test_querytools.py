@@ -0,0 +1,91 @@
+from django.test import TestCase
+from tom_targets.tests.factories import SiderealTargetFactory
+from tom_targets.models import TargetExtra, TargetList, TargetName
+from tom_dataproducts.models import ReducedDatum
+from mop.toolbox import querytools
+from astropy.time import Time, TimezoneInfo
+import numpy as np
+
+class TestQueryTools(TestCase):
+    def setUp(self):
+        self.targets = {}
+        extras = {
+            'Gaia23aaa': {'Classification': 'Microlensing PSPL', 'Alive': True, 'Sky_location': 'Outside HCZ',
+                          'Category': 'Microlensing long-tE', 'TAP_priority': 20.0,
+                          'YSO': False, 'QSO': False, 'galaxy': False},
+            'Gaia23aab': {'Classification': 'Microlensing PSPL', 'Alive': False, 'Sky_location': 'Outside HCZ',
+                          'Category': 'Microlensing long-tE', 'TAP_priority': 20.0,
+                          'YSO': False, 'QSO': False, 'galaxy': False},
+            'OGLE-2023-BLG-0001': {'Classification': 'Microlensing PSPL', 'Alive': True,
+                                   'Sky_location': 'Outside HCZ', 'Category': 'Microlensing stellar/planet',
+                                   'TAP_priority': 5.0, 'YSO': False, 'QSO': False, 'galaxy': False},
+            'Gaia23aac': {'Classification': 'Variable', 'Alive': True, 'Sky_location': 'Outside HCZ',
+                          'Category': 'Microlensing long-tE', 'TAP_priority': 20.0,
+                          'YSO': False, 'QSO': False, 'galaxy': False},
+            'Gaia23aad': {'Classification': 'Microlensing PSPL', 'Alive': True, 'Sky_location': 'Within HCZ',
+                          'Category': 'Microlensing long-tE', 'TAP_priority': 20.0,
+                          'YSO': True, 'QSO': False, 'galaxy': False},
+        }
+        for name, params in extras.items():
+            target = SiderealTargetFactory.create()
+            target.name = name
+            target.save()
+            for key, value in params.items():
+                (extra, created) = TargetExtra.objects.get_or_create(target=target, key=key)
+                extra.value = value
+                extra.save()
+            self.targets[name] = target
+
+    def test_fetch_alive_events_outside_HCZ(self):
+
+        with self.assertNumQueries(1):
+            target_list = querytools.fetch_alive_events_outside_HCZ(with_atomic=False)
+        assert(set(target_list) == set([self.targets['Gaia23aaa'], self.targets['OGLE-2023-BLG-0001']]))
+
+        target_list = querytools.fetch_alive_events_in_category('Microlensing long-tE')
+        assert(set(target_list) == set([self.targets['Gaia23aaa'], self.targets['Gaia23aad']]))
+
+        tlist = TargetList.objects.create(name='test')
+        tlist.targets.add(self.targets['OGLE-2023-BLG-0001'], self.targets['Gaia23aac'])
+        target_list = querytools.get_targetlist_alive_events(targetlist_name=tlist.id)
+        assert(target_list == [self.targets['OGLE-2023-BLG-0001']])
+
+    def test_fetch_priority_targets(self):
+
+        with self.assertNumQueries(1):
+            target_list = querytools.fetch_priority_targets('TAP_priority', 10.0)
+        assert(target_list == [self.targets['Gaia23aaa']])
+
+    def test_fetch_data_for_targetset(self):
+
+        # Photometry for two of the events, inserted out of time order and interleaved
+        rng = np.random.default_rng(1)
+        for i, jd in enumerate(rng.permutation(np.arange(2460000.0, 2460010.0))):
+            target = self.targets['Gaia23aaa'] if i % 2 == 0 else self.targets['OGLE-2023-BLG-0001']
+            ReducedDatum.objects.create(
+                timestamp=Time(jd, format='jd', scale='utc').to_datetime(timezone=TimezoneInfo()),
+                value={'magnitude': 17.0, 'filter': 'G', 'error': 0.01},
+                source_name='Gaia',
+                source_location=target.name,
+                data_type='photometry',
+                target=target
+            )
+        TargetName.objects.create(target=self.targets['Gaia23aaa'], name='OGLE-2023-BLG-0002')
+
+        target_list = list(self.targets.values())
+        with self.assertNumQueries(4):
+            target_data = querytools.fetch_data_for_targetset(target_list, check_need_to_fit=False)
+
+        assert(len(target_data) == len(target_list))
+        mulens = target_data[self.targets['Gaia23aaa']]
+        assert('OGLE-2023-BLG-0002' in mulens.targetnames)
+        assert(mulens.Category == 'Microlensing long-tE')
+        assert(mulens.ndata == 5)
+        time = mulens.datasets['G'][:, 0]
+        assert((time == np.sort(time)).all())
+        assert(mulens.first_observation == time[0])
+
+        mulens = target_data[self.targets['Gaia23aac']]
+        assert(mulens.ndata == 0)
+        assert(mulens.datasets == {})
+        assert(mulens.Classification == 'Variable')
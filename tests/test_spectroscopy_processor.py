@@ -1,12 +1,20 @@
-from django.test import TestCase
+from django.test import TestCase, override_settings
 from tom_targets.tests.factories import SiderealTargetFactory
 from tom_dataproducts.models import DataProduct
 from django.core.files.uploadedfile import SimpleUploadedFile
 from os import path
+import tempfile
 from mop.processors import spectroscopy_processor
 
 class TestSpectrumProcessor(TestCase):
     def setUp(self):
+        # Uploaded files are written to a temporary directory rather than the working tree
+        media_root = tempfile.TemporaryDirectory()
+        self.addCleanup(media_root.cleanup)
+        settings_override = override_settings(MEDIA_ROOT=media_root.name)
+        settings_override.enable()
+        self.addCleanup(settings_override.disable)
+
         st1 = SiderealTargetFactory.create()
         test_file = './tests/data/spectrum_sample.csv'
         self.params = {'target': st1, 'test_file': test_file}
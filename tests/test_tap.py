@@ -2,7 +2,8 @@ from django.test import TestCase
 from tom_targets.tests.factories import SiderealTargetFactory
 from tom_dataproducts.models import ReducedDatum
 from .test_fittools import generate_test_ReducedDatums
-from mop.toolbox import TAP
+from mop.toolbox import TAP, pspl_tools
+from mop.toolbox.mop_classes import MicrolensingEvent
 from astropy.time import Time, TimeDelta
 from astropy import units as u
 import numpy as np
@@ -171,6 +172,30 @@ class TestLightcurveData(TestCase):
         assert(mag_now == last_dp)
 
 
+    def test_TAP_model_mags_now(self):
+
+        events = []
+        for i, tE in enumerate([25.0, 250.0, -1.0]):
+            mulens = MicrolensingEvent(self.params['target'])
+            mulens.name = 'Event' + str(i)
+            mulens.t0 = Time(datetime.now()).jd + 5.0
+            mulens.u0 = 0.1
+            mulens.tE = tE
+            mulens.Source_magnitude = 18.0
+            mulens.Blend_magnitude = 19.0
+            events.append(mulens)
+
+        # The current magnitudes of all events are calculated together, and agree with those
+        # calculated for each event, except where the model parameters are invalid
+        model_mags = TAP.TAP_model_mags_now(events)
+        time_now = Time(datetime.now()).jd
+        for mulens in events[0:2]:
+            single = pspl_tools.model_magnitude(time_now, *pspl_tools.event_parameters(
+                {key: getattr(mulens, key) for key in ['t0', 'u0', 'tE', 'Source_magnitude', 'Blend_magnitude']}))
+            assert(abs(model_mags[mulens.name] - single) < 1e-3)
+        assert(np.isnan(model_mags['Event2']))
+        assert(TAP.TAP_model_mags_now([]) == {})
+
 class TestCheckBaselineSN(TestCase):
     def setUp(self):
         st1 = SiderealTargetFactory.create()
@@ -2,6 +2,10 @@ from django.test import TestCase
 from mop.toolbox import utilities
 from tom_targets.tests.factories import SiderealTargetFactory
 from tom_targets.models import Target
+from astropy.time import Time, TimezoneInfo
+import numpy as np
+import datetime
+
 class TestUtilities(TestCase):
     def setUp(self):
         self.target = SiderealTargetFactory.create()
@@ -15,4 +19,24 @@ class TestUtilities(TestCase):
         qs = Target.objects.filter(name=self.target.name)
 
         assert(hasattr(qs[0], 'galactic_lat'))
-        assert(hasattr(qs[0], 'galactic_lng'))
\ No newline at end of file
+        assert(hasattr(qs[0], 'galactic_lng'))
+    def test_datetimes_to_jd(self):
+        rng = np.random.default_rng(1)
+        jd = 2459000.0 + rng.uniform(0.0, 1500.0, 200)
+
+        # The conversions are identical to those made with a Time object for each timestamp
+        timestamps = utilities.jd_to_datetimes(jd, timezone=TimezoneInfo())
+        expected = [Time(t, format='jd', scale='utc').to_datetime(timezone=TimezoneInfo()) for t in jd]
+        assert(timestamps == expected)
+        assert(timestamps[0].utcoffset() == datetime.timedelta(0))
+
+        converted = utilities.datetimes_to_jd(timestamps)
+        assert((converted == np.array([Time(t).jd for t in timestamps])).all())
+        assert(np.abs(converted - jd).max() < 1e-10)
+
+        naive = utilities.jd_to_datetimes(jd[:10])
+        assert(naive == [Time(t, format='jd', scale='utc').to_datetime() for t in jd[:10]])
+        assert((utilities.datetimes_to_jd(naive) == converted[:10]).all())
+
+        assert(utilities.jd_to_datetimes([]) == [])
+        assert(len(utilities.datetimes_to_jd([])) == 0)